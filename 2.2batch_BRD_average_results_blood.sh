@@ -19,27 +19,19 @@ BRD_Results="BRD_Results/$Project_ID"
 mkdir -p "$BRD_Results"
 
 ###############################
-# 1.1 blood-->process_all_files
+# blood: all files + chr13_14_15_21_22_exon (45S) + chr1_exon_intron (5S)
+# single pass: every depth file is parsed once, $THREADS processes --> process_BRD_outputs
+# exact sums are cached in aggregate_cache.sqlite, unchanged depth files are not parsed again
+# stream=True appends the rows of each sample as soon as it is parsed (bounded memory, same CSV files)
 root_dir_blood="$Project_ID/depth_results_exon_intron_blood_no_duplication"
 output_file_blood_all="$BRD_Results/blood_all_BRD.csv"
-label="blood"
-
-python -c "from batch_BRD_average_results import process_all_files; \
-process_all_files(root_dir='$root_dir_blood', output_file='$output_file_blood_all', label='$label')" &
-
-###############################
-# 1.2 blood_chr13_14_15_21_22_exon/45S-->  process_multiple_files_with_label
 output_file_blood_45S_BRD="$BRD_Results/blood_chr13_14_15_21_22_exon_BRD.csv"
-python -c "from batch_BRD_average_results import process_multiple_files_with_label; \
-process_multiple_files_with_label(root_dir='$root_dir_blood', output_file='$output_file_blood_45S_BRD', label='$label', \
-selected_files=['chr13_exon_depth','chr14_exon_depth','chr15_exon_depth','chr21_exon_depth','chr22_exon_depth'], custom_label='chr13_14_15_21_22_exon')" &
-
-###############################
-# 1.3. blood-5S/chr1_exon_intron:--> process_multiple_files_with_label
 output_file_blood_5S_BRD="$BRD_Results/blood_chr1_exon_intron.csv"
-python -c "from batch_BRD_average_results import process_multiple_files_with_label; \
-process_multiple_files_with_label(root_dir='$root_dir_blood', output_file='$output_file_blood_5S_BRD', label='$label', \
-selected_files=['chr1_intron_depth','chr1_exon_depth'], custom_label='chr1_exon_intron')" &
-
-wait
+label="blood"
 
+python -c "from batch_BRD_average_results import process_BRD_outputs; \
+process_BRD_outputs(root_dir='$root_dir_blood', label='$label', output_file_all='$output_file_blood_all', workers=$THREADS, cache_file='$BRD_Results/aggregate_cache.sqlite', exact=True, stream=True, groups=[ \
+dict(output_file='$output_file_blood_45S_BRD', custom_label='chr13_14_15_21_22_exon', \
+selected_files=['chr13_exon_depth','chr14_exon_depth','chr15_exon_depth','chr21_exon_depth','chr22_exon_depth']), \
+dict(output_file='$output_file_blood_5S_BRD', custom_label='chr1_exon_intron', \
+selected_files=['chr1_intron_depth','chr1_exon_depth'])])"
@@ -1,89 +1,282 @@
 import os
 import csv
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 
-def calculate_file_average(file_path):
-    """Calculate the average depth and number of lines in a single file"""
-    total_depth = 0
-    total_length = 0
+import cn_path  # noqa: F401 - the shared depth readers live next to the copy number scripts
+from depth_binary import is_depth_binary, sum_depth_binary
+from aggregate_cache import HashingReader, file_sha256, open_cache, get_aggregate, put_aggregate
+from depth_text import READ_BUFFER_SIZE, depth_file_stem, open_depth_stream, open_depth_text
+from prefetch_io import PREFETCH_READ_SIZE, format_io_stats, new_io_stats, prefetch_files
+from table_io import TableWriter
 
-    with open(file_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split('\t')
-            if len(parts) != 3:
-                continue
-            try:
-                depth = int(parts[2])  # 提取深度值
-                total_depth += depth
-                total_length += 1
-            except ValueError:
-                continue
+# Bytes read per chunk by the NumPy depth reader; the per-line index arrays take a few times this
+CHUNK_SIZE = 8 * 1024 * 1024
 
-    if total_length == 0:
-        return 0, 0  # Avoid dividing by zero
-    return round(total_depth / total_length,3), total_length
+# Depth files merged into the BRD of 45S (acrocentric exons) and 5S (chr1 exons + introns)
+BRD_45S_FILES = ["chr13_exon_depth", "chr14_exon_depth", "chr15_exon_depth", "chr21_exon_depth", "chr22_exon_depth"]
+BRD_5S_FILES = ["chr1_intron_depth", "chr1_exon_depth"]
+# Columns of every BRD table
+BRD_COLUMNS = ["Sample_ID", "Depth_File", "Average_Depth", "Length", "Label"]
 
-    
+# Bytes that str.strip() would remove from the start of a line
+_LEADING_WHITESPACE = np.array([9, 10, 11, 12, 13, 28, 29, 30, 31, 32], dtype=np.uint8)
 
-def process_all_files(root_dir, output_file, label):
-    """Function 1: Process all files and calculate the average depth of each file"""
-    results = []
 
-    for sample_id in os.listdir(root_dir):  # Iterate through all sample folders
-        sample_dir = os.path.join(root_dir, sample_id)
-        if not os.path.isdir(sample_dir):
+def _sum_depth_lines(text):
+    """Sum the depth column of text lines, skipping malformed lines (pure Python)"""
+    total_depth = 0
+    total_length = 0
+
+    for line in text:
+        parts = line.strip().split('\t')
+        if len(parts) != 3:
+            continue
+        try:
+            depth = int(parts[2])  # 提取深度值
+            total_depth += depth
+            total_length += 1
+        except ValueError:
             continue
 
-        for file_name in os.listdir(sample_dir):  # Iterate through all samples
-            file_path = os.path.join(sample_dir, file_name)
-            if not os.path.isfile(file_path):
-                continue
+    return total_depth, total_length
+
+
+def _sum_depth_chunk(chunk):
+    """
+    Sum the depth column of a chunk of complete lines with NumPy.
+
+    The chunk must end with a newline. Chunks containing any line that the
+    vectorized parser cannot prove well-formed are handed to the pure Python
+    parser so that malformed lines are skipped exactly as before. Apart from
+    the byte masks, only arrays with one entry per line are allocated.
+    """
+    buf = np.frombuffer(chunk, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == 10)
+    tabs = np.flatnonzero(buf == 9)
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+
+    # Every line needs exactly two tabs, no carriage return and no leading whitespace:
+    # with 2 tabs per line in total, tabs 2i and 2i + 1 must both lie inside line i
+    well_formed = (
+        len(tabs) == 2 * len(line_ends)
+        and b"\r" not in chunk
+        and np.all(tabs[0::2] >= line_starts)
+        and np.all(tabs[1::2] < line_ends)
+        and not np.any(np.isin(buf[line_starts], _LEADING_WHITESPACE))
+        and not np.any(buf[line_starts] >= 128)
+    )
+    if well_formed:
+        field_starts = tabs[1::2] + 1
+        field_lengths = line_ends - field_starts
+        well_formed = np.all(field_lengths > 0) and np.all(field_lengths <= 18)
+    if not well_formed:
+        return _sum_depth_lines(io.StringIO(chunk.decode(), newline=None))
+
+    # Accumulate the depth digits from the right, one decimal place per pass; every byte of the
+    # depth field is visited once, so a non-digit byte is caught here
+    depths = np.zeros(len(line_ends), dtype=np.int64)
+    for place in range(int(field_lengths.max())):
+        has_digit = field_lengths > place
+        digits = buf[line_ends[has_digit] - 1 - place] - np.uint8(48)  # bytes below '0' wrap around
+        if np.any(digits > 9):
+            return _sum_depth_lines(io.StringIO(chunk.decode(), newline=None))
+        depths[has_digit] += digits.astype(np.int64) * 10 ** place
+
+    return int(depths.sum()), len(line_ends)
+
+
+def sum_file_depth(file_path, chunk_size=CHUNK_SIZE, stream=None, digest=False):
+    """
+    Read a samtools depth file (plain, gzip or bgzip) in large chunks and return the exact (total depth, number of lines).
+    stream is the text file already opened as a binary stream (see prefetch_io.prefetch_files); it is read instead of file_path and closed.
+    With digest=True the SHA-256 of the file's content, taken in the same read, is returned as a third value (for the aggregate cache).
+    """
+    if is_depth_binary(file_path):
+        sums = sum_depth_binary(file_path)
+        return (*sums, file_sha256(file_path)) if digest else sums
+    if digest:
+        hashed = HashingReader(stream if stream is not None else open(file_path, 'rb', buffering=0))
+        with io.BufferedReader(hashed, READ_BUFFER_SIZE) as buffered:
+            total_depth, total_length = _sum_depth_stream(open_depth_stream(buffered, 'rb'), chunk_size)
+            return total_depth, total_length, hashed.hexdigest()
+    if stream is not None:
+        with stream, open_depth_stream(stream, 'rb') as f:
+            return _sum_depth_stream(f, chunk_size)
+    with open_depth_text(file_path, 'rb') as f:
+        return _sum_depth_stream(f, chunk_size)
+
+
+def _sum_depth_stream(f, chunk_size):
+    """Exact (total depth, number of lines) of an open binary depth text stream"""
+    total_depth = 0
+    total_length = 0
+    remainder = b""
+
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+        block = remainder + block
+        cut = block.rfind(b"\n") + 1
+        if cut == 0:
+            remainder = block
+            continue
+        depth, length = _sum_depth_chunk(block[:cut])
+        total_depth += depth
+        total_length += length
+        remainder = block[cut:]
 
-            # get the basename
-            core_name = file_name.replace(f"{sample_id}_", "").replace(".txt", "")
+    # Last line without a trailing newline
+    if remainder:
+        depth, length = _sum_depth_chunk(remainder + b"\n")
+        total_depth += depth
+        total_length += length
 
-            avg_depth, length = calculate_file_average(file_path)
-            results.append({
-                "Sample_ID": sample_id,
-                "Depth_File": core_name,
-                "Average_Depth": avg_depth,
-                "Length": length,
-                "Label": label
-            })
+    return total_depth, total_length
 
-    # save
-    with open(output_file, 'w', newline='') as csvfile:
-        fieldnames = ["Sample_ID", "Depth_File", "Average_Depth", "Length", "Label"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
-        writer.writeheader()
-        for row in results:
-            writer.writerow(row)
+def _average(total_depth, total_length):
+    """Rounded average depth and length from exact totals, as returned by calculate_file_average"""
+    if total_length == 0:
+        return 0, 0  # Avoid dividing by zero
+    return round(total_depth / total_length,3), total_length
 
-    print(f"Function 1 The result has been saved to: {output_file}")
 
-#no use
-def process_selected_files(root_dir, output_file, label, selected_files):
-    """Function 2: Processes only the specified files and calculates their average depth."""
-    results = []
+def calculate_file_average(file_path, engine="numpy"):
+    """Calculate the average depth and number of lines in a single file"""
+    if engine == "numpy":
+        total_depth, total_length = sum_file_depth(file_path)
+    elif engine == "python":
+        with open_depth_text(file_path, 'r') as f:
+            total_depth, total_length = _sum_depth_lines(f)
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    return _average(total_depth, total_length)
+
 
-    for sample_id in os.listdir(root_dir):  
+def _sample_depth_files(root_dir, selected_files=None):
+    """Yields (sample_id, [(core_name, file_path), ...]) for every sample folder, sorted by sample ID and file name"""
+    for sample_id in sorted(os.listdir(root_dir)):  # Iterate through all sample folders
         sample_dir = os.path.join(root_dir, sample_id)
         if not os.path.isdir(sample_dir):
             continue
 
-        for file_name in os.listdir(sample_dir):  
+        files = []
+        for file_name in sorted(os.listdir(sample_dir)):  # Iterate through all samples
             file_path = os.path.join(sample_dir, file_name)
             if not os.path.isfile(file_path):
                 continue
 
-            
-            core_name = file_name.replace(f"{sample_id}_", "").replace(".txt", "")
-
-            
-            if core_name not in selected_files:
+            # get the basename
+            core_name = depth_file_stem(file_name.replace(f"{sample_id}_", ""))
+            if selected_files is not None and core_name not in selected_files:
                 continue
 
-            avg_depth, length = calculate_file_average(file_path)
+            files.append((core_name, file_path))
+        yield sample_id, files
+
+
+def iter_depth_partials(root_dir, selected_files=None, workers=1, cache_file=None, prefetch_depth=0,
+                        read_size=PREFETCH_READ_SIZE, io_stats=None):
+    """
+    Streaming form of collect_depth_partials: yields (sample_id, [(core_name, total_depth, total_length), ...])
+    in sample order as soon as the depth files of a sample are parsed. With workers > 1 at most
+    4 * workers depth files are queued ahead in the process pool, so memory does not grow with the
+    number of samples. In a serial run, prefetch_depth > 0 reads that many text depth files ahead in
+    threads (reads of read_size bytes, see prefetch_io.py) while the current one is parsed; the
+    prefetch statistics are added to io_stats.
+    """
+    cache = open_cache(cache_file) if cache_file else None
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    max_queued = 4 * workers
+    pending = deque()  # (sample_id, [(core_name, file_path, sums or future or None), ...])
+    queued = 0
+    parsed = 0
+    total = 0
+
+    samples = ((sample_id, [(core_name, file_path, get_aggregate(cache, file_path, core_name) if cache else None)
+                            for core_name, file_path in files])
+               for sample_id, files in _sample_depth_files(root_dir, selected_files))
+    text_files = []
+    if prefetch_depth and executor is None:
+        # all samples are listed first, so that reads run ahead across sample folders
+        samples = list(samples)
+        text_files = [file_path for _, files in samples for _, file_path, cached in files
+                      if cached is None and not is_depth_binary(file_path)]
+
+    def finish(sample_id, files, open_prefetched):
+        nonlocal queued, parsed
+        sample_partials = []
+        for core_name, file_path, result in files:
+            if isinstance(result, tuple):
+                total_depth, total_length = result
+            else:
+                if result is None:
+                    sums = sum_file_depth(file_path, stream=open_prefetched(file_path), digest=cache is not None)
+                else:
+                    sums = result.result()
+                    queued -= 1
+                total_depth, total_length = sums[:2]
+                parsed += 1
+                if cache:
+                    # the content hash was taken while the file was parsed
+                    put_aggregate(cache, file_path, core_name, sample_id, total_depth, total_length, sha256=sums[2])
+            sample_partials.append((core_name, total_depth, total_length))
+        return sample_id, sample_partials
+
+    try:
+        with prefetch_files(text_files, prefetch_depth, read_size, io_stats) as open_prefetched:
+            for sample_id, files in samples:
+                entries = []
+                for core_name, file_path, result in files:
+                    if result is None and executor:
+                        result = executor.submit(sum_file_depth, file_path, digest=cache is not None)
+                        queued += 1
+                    entries.append((core_name, file_path, result))
+                total += len(entries)
+                pending.append((sample_id, entries))
+                # serial runs parse each sample right away; the pool keeps up to max_queued files in flight
+                while pending and (executor is None or queued > max_queued):
+                    yield finish(*pending.popleft(), open_prefetched)
+            while pending:
+                yield finish(*pending.popleft(), open_prefetched)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        if cache:
+            cache.commit()
+            cache.close()
+            print(f"Aggregate cache {cache_file}: {parsed} depth files parsed, {total - parsed} reused.")
+
+
+def collect_depth_partials(root_dir, selected_files=None, workers=1, cache_file=None, prefetch_depth=0,
+                           read_size=PREFETCH_READ_SIZE, io_stats=None):
+    """
+    Parse every depth file under root_dir exactly once and keep its exact (sum, count).
+
+    Returns a dict {sample_id: [(core_name, total_depth, total_length), ...]} sorted by
+    sample ID and file name. Every sample folder gets an entry, even if none of its files
+    are selected. With workers > 1 the depth files are parsed in a process pool; the result
+    is identical to a serial run. With cache_file, exact sums are kept in an SQLite aggregate
+    cache (see aggregate_cache.py) and only new or changed depth files are parsed. prefetch_depth,
+    read_size and io_stats: read-ahead of a serial run, see iter_depth_partials.
+    """
+    return dict(iter_depth_partials(root_dir, selected_files, workers=workers, cache_file=cache_file,
+                                    prefetch_depth=prefetch_depth, read_size=read_size, io_stats=io_stats))
+
+
+def _file_rows(partials, label, selected_files=None):
+    """One row per depth file, with the per-file average depth"""
+    results = []
+    for sample_id, sample_partials in partials.items():
+        for core_name, total_depth, total_length in sample_partials:
+            if selected_files is not None and core_name not in selected_files:
+                continue
+            avg_depth, length = _average(total_depth, total_length)
             results.append({
                 "Sample_ID": sample_id,
                 "Depth_File": core_name,
@@ -91,53 +284,33 @@ def process_selected_files(root_dir, output_file, label, selected_files):
                 "Length": length,
                 "Label": label
             })
-
-    
-    with open(output_file, 'w', newline='') as csvfile:
-        fieldnames = ["Sample_ID", "Depth_File", "Average_Depth", "Length", "Label"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-        
-        writer.writeheader()
-        for row in results:
-            writer.writerow(row)
-
-    print(f"Function 2 The result has been saved to: {output_file}")
+    return results
 
 
-def process_multiple_files_with_label(root_dir, output_file, label, selected_files, custom_label):
-    """Function 3: Processes a specified number of files and calculates the average depth of the merge, retaining the result to 3 decimal places."""
+def _group_rows(partials, label, selected_files, custom_label, exact=False):
+    """
+    One row per sample, merging the selected depth files into a length-weighted average.
+    With exact=True the merge uses the exact depth sums instead of the rounded per-file averages.
+    """
     results = []
-
-    for sample_id in os.listdir(root_dir):  
-        sample_dir = os.path.join(root_dir, sample_id)
-        if not os.path.isdir(sample_dir):
-            continue
-
+    for sample_id, sample_partials in partials.items():
         # Store the results of all target files in the current sample
         sample_results = []
-
-        for file_name in os.listdir(sample_dir):  
-            file_path = os.path.join(sample_dir, file_name)
-            if not os.path.isfile(file_path):
-                continue
-
-            # basename
-            core_name = file_name.replace(f"{sample_id}_", "").replace(".txt", "")
-
-            # Check if the file is in the specified list
+        for core_name, total_depth, total_length in sample_partials:
             if core_name not in selected_files:
                 continue
-
-            avg_depth, length = calculate_file_average(file_path)
+            avg_depth, length = _average(total_depth, total_length)
             sample_results.append({
                 "Average_Depth": avg_depth,
-                "Length": length
+                "Length": length,
+                "Total_Depth": total_depth
             })
 
         # Merge to calculate the total average depth and total length of the current sample
         total_length = sum(r["Length"] for r in sample_results)
-        if total_length > 0:
+        if total_length > 0 and exact:
+            total_avg_depth = sum(r["Total_Depth"] for r in sample_results) / total_length
+        elif total_length > 0:
             total_avg_depth = sum(r["Average_Depth"] * r["Length"] for r in sample_results) / total_length
         else:
             total_avg_depth = 0
@@ -145,24 +318,188 @@ def process_multiple_files_with_label(root_dir, output_file, label, selected_fil
         results.append({
             "Sample_ID": sample_id,
             "Depth_File": custom_label,
-            "Average_Depth": total_avg_depth,
+            # Retain 3 decimal places
+            "Average_Depth": round(total_avg_depth, 3),
             "Length": total_length,
             "Label": label
         })
+    return results
+
 
-    # save
+def _write_BRD_csv(output_file, results):
+    """Write BRD rows to a CSV file"""
     with open(output_file, 'w', newline='') as csvfile:
-        fieldnames = ["Sample_ID", "Depth_File", "Average_Depth", "Length", "Label"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.DictWriter(csvfile, fieldnames=BRD_COLUMNS)
 
         writer.writeheader()
         for row in results:
-            # Retain 3 decimal places
-            row["Average_Depth"] = round(row["Average_Depth"], 3)
             writer.writerow(row)
 
+
+def _write_BRD_table(output_file, results, output_format="csv"):
+    """Write BRD rows as CSV, or as Parquet next to it; returns the path written"""
+    if output_format == "csv":
+        _write_BRD_csv(output_file, results)
+        return output_file
+    import pandas as pd
+    from table_io import write_table
+    return write_table(pd.DataFrame(results, columns=BRD_COLUMNS), output_file, output_format)
+
+
+def process_all_files(root_dir, output_file, label, workers=1, cache_file=None, stream=False, prefetch_depth=0,
+                      read_size=PREFETCH_READ_SIZE):
+    """Function 1: Process all files and calculate the average depth of each file"""
+    if stream:
+        # rows are appended as each sample is parsed (see stream_BRD_outputs)
+        process_BRD_outputs(root_dir, label, output_file, workers=workers, cache_file=cache_file, stream=True,
+                            prefetch_depth=prefetch_depth, read_size=read_size)
+        return
+    io_stats = new_io_stats()
+    partials = collect_depth_partials(root_dir, workers=workers, cache_file=cache_file, prefetch_depth=prefetch_depth,
+                                      read_size=read_size, io_stats=io_stats)
+    _write_BRD_csv(output_file, _file_rows(partials, label))
+    if io_stats["files"]:
+        print(format_io_stats(io_stats))
+
+    print(f"Function 1 The result has been saved to: {output_file}")
+
+#no use
+def process_selected_files(root_dir, output_file, label, selected_files, workers=1, cache_file=None):
+    """Function 2: Processes only the specified files and calculates their average depth."""
+    partials = collect_depth_partials(root_dir, selected_files, workers=workers, cache_file=cache_file)
+    _write_BRD_csv(output_file, _file_rows(partials, label))
+
+    print(f"Function 2 The result has been saved to: {output_file}")
+
+
+def process_multiple_files_with_label(root_dir, output_file, label, selected_files, custom_label, workers=1,
+                                      cache_file=None, exact=False):
+    """Function 3: Processes a specified number of files and calculates the average depth of the merge, retaining the result to 3 decimal places."""
+    partials = collect_depth_partials(root_dir, selected_files, workers=workers, cache_file=cache_file)
+    _write_BRD_csv(output_file, _group_rows(partials, label, selected_files, custom_label, exact))
+
     print(f"Function 3 Results have been saved to. {output_file}")
-    
+
+
+def write_BRD_outputs(partials, label, output_file_all=None, groups=(), exact=False, output_format="csv"):
+    """
+    Write the all-files CSV and any number of merged groups from (sum, count) partials.
+
+    Parameters:
+    - partials (dict): {sample_id: [(core_name, total_depth, total_length), ...]},
+      as returned by collect_depth_partials.
+    - label (str): Label written to every row, e.g. 'blood'.
+    - output_file_all (str, optional): Output CSV of process_all_files. Skipped if None.
+    - groups (list of dict): Each dict has 'output_file', 'selected_files' and 'custom_label',
+      the arguments of process_multiple_files_with_label.
+    - exact (bool): If True, groups are merged from exact depth sums instead of rounded averages.
+    - output_format (str): 'csv' or 'parquet' (written with the '.parquet' extension, needs pyarrow).
+    """
+    if output_file_all:
+        output_file = _write_BRD_table(output_file_all, _file_rows(partials, label), output_format)
+        print(f"Function 1 The result has been saved to: {output_file}")
+
+    for group in groups:
+        rows = _group_rows(partials, label, group["selected_files"], group["custom_label"], exact)
+        output_file = _write_BRD_table(group["output_file"], rows, output_format)
+        print(f"Function 3 Results have been saved to. {output_file}")
+
+
+def stream_BRD_outputs(sample_partials, label, output_file_all=None, groups=(), exact=False, output_format="csv"):
+    """
+    Same outputs as write_BRD_outputs, written while the depth files are parsed: the rows of each
+    sample are appended to every output as soon as the sample is done, so only one sample is held
+    in memory. CSV files are identical to those of write_BRD_outputs.
+
+    Parameters:
+    - sample_partials (iterable): (sample_id, [(core_name, total_depth, total_length), ...]) pairs,
+      as yielded by iter_depth_partials.
+    - label, output_file_all, groups, exact, output_format: see write_BRD_outputs.
+    """
+    # csv.DictWriter of _write_BRD_csv ends lines with \r\n
+    writers = []
+    try:
+        if output_file_all:
+            writers.append((None, TableWriter(output_file_all, BRD_COLUMNS, output_format, lineterminator="\r\n")))
+        for group in groups:
+            writers.append((group, TableWriter(group["output_file"], BRD_COLUMNS, output_format, lineterminator="\r\n")))
+
+        for sample_id, partials in sample_partials:
+            partials = {sample_id: partials}
+            for group, writer in writers:
+                if group is None:
+                    writer.write_rows(_file_rows(partials, label))
+                else:
+                    writer.write_rows(_group_rows(partials, label, group["selected_files"], group["custom_label"], exact))
+    finally:
+        for _, writer in writers:
+            writer.close()
+
+    for group, writer in writers:
+        if group is None:
+            print(f"Function 1 The result has been saved to: {writer.path}")
+        else:
+            print(f"Function 3 Results have been saved to. {writer.path}")
+
+
+def standard_BRD_groups(output_dir, label):
+    """The two merged BRD groups used by calculate_CN_TCGA_py, written to output_dir"""
+    return [
+        {
+            "output_file": os.path.join(output_dir, f"{label}_chr13_14_15_21_22_exon_BRD.csv"),
+            "selected_files": BRD_45S_FILES,
+            "custom_label": "chr13_14_15_21_22_exon"
+        },
+        {
+            "output_file": os.path.join(output_dir, f"{label}_chr1_exon_intron.csv"),
+            "selected_files": BRD_5S_FILES,
+            "custom_label": "chr1_exon_intron"
+        }
+    ]
+
+
+def process_BRD_outputs(root_dir, label, output_file_all=None, groups=(), workers=1, cache_file=None, exact=False,
+                        output_format="csv", stream=False, prefetch_depth=0, read_size=PREFETCH_READ_SIZE):
+    """
+    Single-pass engine: parses each depth file once and writes the all-files CSV and
+    any number of merged groups from the cached (sum, count) partials.
+
+    Parameters:
+    - root_dir (str): Directory with one folder of depth files per sample.
+    - label (str): Label written to every row, e.g. 'blood'.
+    - output_file_all (str, optional): Output CSV of process_all_files. Skipped if None.
+    - groups (list of dict): Each dict has 'output_file', 'selected_files' and 'custom_label',
+      the arguments of process_multiple_files_with_label.
+    - workers (int): Number of processes used to parse depth files. 1 runs serially.
+    - cache_file (str, optional): SQLite aggregate cache; only new or changed depth files are parsed.
+    - exact (bool): If True, groups are merged from exact depth sums instead of rounded averages.
+    - output_format (str): 'csv' or 'parquet'.
+    - stream (bool): If True, rows are appended to the outputs as each sample is parsed, in memory
+      that does not grow with the number of samples (see stream_BRD_outputs).
+    - prefetch_depth (int): With workers=1, text depth files read ahead in threads while the current
+      one is parsed, for network filesystems (see prefetch_io.py). The time still blocked on I/O is printed.
+    - read_size (int): Bytes per read of the prefetch threads.
+    """
+    # Only parse the files that some output needs
+    if output_file_all:
+        selected_files = None
+    else:
+        selected_files = set()
+        for group in groups:
+            selected_files.update(group["selected_files"])
+
+    io_stats = new_io_stats()
+    if stream:
+        sample_partials = iter_depth_partials(root_dir, selected_files, workers=workers, cache_file=cache_file,
+                                              prefetch_depth=prefetch_depth, read_size=read_size, io_stats=io_stats)
+        stream_BRD_outputs(sample_partials, label, output_file_all, groups, exact, output_format)
+    else:
+        partials = collect_depth_partials(root_dir, selected_files, workers=workers, cache_file=cache_file,
+                                          prefetch_depth=prefetch_depth, read_size=read_size, io_stats=io_stats)
+        write_BRD_outputs(partials, label, output_file_all, groups, exact, output_format)
+    if io_stats["files"]:
+        print(format_io_stats(io_stats))
+
 
 '''
 if __name__ == "__main__":
@@ -0,0 +1,380 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import contextlib
+import importlib
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BED_DIR = os.path.join(REPO_DIR, "intron_exon_no_duplication")
+
+from cn_path import CN_DIR
+from batch_BRD_average_results import BRD_45S_FILES, BRD_5S_FILES, process_BRD_outputs, standard_BRD_groups
+from stream_BRD_from_bam import read_bed_regions
+
+# Synthetic fixtures in the layouts of the pipeline:
+#   <work_dir>/depth_results_exon_intron_blood_no_duplication/<sample>/<sample>_<bed>_depth.txt  (step 2.1)
+#   <work_dir>/CN_results/TCGA-BENCH/depth_results_blood/<sample>_GL000220v1_45S_depth.txt       (step 1.4)
+#   <work_dir>/CN_results/TCGA-BENCH/depth_results_blood/<sample>_1q42_5S_depth.txt
+# BRD depth files cover the real BED intervals of intron_exon_no_duplication, each interval cut
+# to `scale` of its length; rDNA depth files cover the full 45S and 5S references (samtools depth -a).
+
+PROJECT_ID = "TCGA-BENCH"
+BRD_TREE = "depth_results_exon_intron_blood_no_duplication"
+CN_ROOT = "CN_results"
+REFERENCE_45S = ("U13369.1_Modified_16kb", 15979)  # rDNA_paper/45S_U13369.1_Modified_forward_16kb.fasta
+REFERENCE_5S = ("gi|23898|emb|X12811.1|", 2231)  # rDNA_paper/5S_X12811.1.fasta
+
+# Imports paid by every short python invocation of the pipeline (e.g. the python -c calls of 2.2)
+STARTUP_IMPORTS = [
+    ("python (no import)", REPO_DIR, "pass"),
+    ("batch_BRD_average_results", REPO_DIR, "import batch_BRD_average_results"),
+    ("main", CN_DIR, "import main"),
+    ("average_depth", CN_DIR, "import average_depth"),
+    ("calculate_all_CN", CN_DIR, "import calculate_all_CN"),
+    ("batch_main", CN_DIR, "import batch_main"),
+]
+
+REPORT_COLUMNS = ["Stage", "Samples", "Scale", "Workers", "Seconds", "Files", "Lines", "MB",
+                  "Lines_per_s", "MB_per_s", "Base_RSS_MB", "Peak_RSS_MB"]
+
+
+def sample_ids(samples):
+    """Synthetic TCGA blood sample IDs."""
+    return [f"TCGA-BM-{i:04d}-10A" for i in range(samples)]
+
+
+def bed_positions(bed_file, scale=1.0):
+    """
+    1-based positions reported by `samtools depth -a -b bed_file`, keeping the first `scale` of
+    every merged interval (at least one position per interval).
+
+    Returns:
+    - contigs (np.ndarray), positions (np.ndarray)
+    """
+    contigs = []
+    positions = []
+    for contig, intervals in read_bed_regions(bed_file).items():
+        for start, end in intervals:
+            length = max(1, int(round((end - start) * scale)))
+            positions.append(np.arange(start + 1, start + 1 + length, dtype=np.int64))
+            contigs.append(np.full(length, contig, dtype=object))
+    if not positions:
+        return np.zeros(0, dtype=object), np.zeros(0, dtype=np.int64)
+    return np.concatenate(contigs), np.concatenate(positions)
+
+
+def write_depth_text(file_path, contigs, positions, depths):
+    """Writes a `samtools depth` text file (contig, position, depth; tab-separated)."""
+    pd.DataFrame({"contig": contigs, "position": positions, "depth": depths}).to_csv(
+        file_path, sep='\t', header=False, index=False)
+
+
+def generate_BRD_tree(root_dir, samples, scale=0.01, seed=0):
+    """Writes one depth file per sample and BED file, as 2.1depth_results_exon_intron_blood_no_duplication.sh does."""
+    rng = np.random.default_rng(seed)
+    beds = {os.path.basename(bed_file)[:-len(".bed")]: bed_positions(os.path.join(BED_DIR, bed_file), scale)
+            for bed_file in sorted(os.listdir(BED_DIR)) if bed_file.endswith(".bed")}
+
+    for sample_id in sample_ids(samples):
+        sample_dir = os.path.join(root_dir, sample_id)
+        os.makedirs(sample_dir, exist_ok=True)
+        coverage = rng.uniform(20, 40)
+        for bed_name, (contigs, positions) in beds.items():
+            depths = rng.poisson(coverage, len(positions))
+            write_depth_text(os.path.join(sample_dir, f"{sample_id}_{bed_name}_depth.txt"), contigs, positions, depths)
+
+
+def generate_rDNA_tree(depth_dir, samples, seed=0):
+    """Writes the 45S and 5S depth files of every sample, as 1.4depth_calculation.sh does."""
+    rng = np.random.default_rng(seed + 1)
+    os.makedirs(depth_dir, exist_ok=True)
+
+    for sample_id in sample_ids(samples):
+        for rDNA_type, (contig, length), tag in [("45S", REFERENCE_45S, "GL000220v1"), ("5S", REFERENCE_5S, "1q42")]:
+            positions = np.arange(1, length + 1, dtype=np.int64)
+            depths = rng.poisson(rng.uniform(3000, 9000), length)
+            write_depth_text(os.path.join(depth_dir, f"{sample_id}_{tag}_{rDNA_type}_depth.txt"),
+                             np.full(length, contig, dtype=object), positions, depths)
+
+
+def generate_fixtures(work_dir, samples=10, scale=0.01, seed=0):
+    """
+    Generates the BRD and rDNA depth trees and the BRD CSVs main.py expects next to them.
+    Existing fixtures of the same size are reused.
+
+    Parameters:
+    - work_dir (str): Directory for the fixtures and the outputs of the benchmarked stages.
+    - samples (int): Number of samples, e.g. 10 to 1000.
+    - scale (float): Fraction of every BED interval written to the BRD depth files (1.0 = real size).
+    - seed (int): Seed of the synthetic depths.
+    """
+    stamp_file = os.path.join(work_dir, "fixture.txt")
+    stamp = f"samples={samples} scale={scale} seed={seed}\n"
+    if os.path.exists(stamp_file):
+        with open(stamp_file, 'r') as file:
+            if file.read() == stamp:
+                print(f"Reusing fixtures in {work_dir}")
+                return
+
+    for name in (BRD_TREE, CN_ROOT):
+        shutil.rmtree(os.path.join(work_dir, name), ignore_errors=True)
+    project_dir = os.path.join(work_dir, CN_ROOT, PROJECT_ID)
+
+    print(f"Generating {samples} samples in {work_dir} (BED scale {scale})")
+    generate_BRD_tree(os.path.join(work_dir, BRD_TREE), samples, scale, seed)
+    generate_rDNA_tree(os.path.join(project_dir, "depth_results_blood"), samples, seed)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        process_BRD_outputs(os.path.join(work_dir, BRD_TREE), "blood",
+                            os.path.join(project_dir, "blood_all_BRD.csv"), standard_BRD_groups(project_dir, "blood"))
+
+    with open(stamp_file, 'w') as file:
+        file.write(stamp)
+
+
+def _input_stats(file_paths):
+    """Number of files, lines and bytes of the given files."""
+    lines = 0
+    size = 0
+    for file_path in file_paths:
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(16 * 1024 * 1024), b""):
+                lines += block.count(b"\n")
+                size += len(block)
+    return len(file_paths), lines, size
+
+
+def _tree_files(root_dir, core_names=None):
+    """Depth files of a BRD tree, optionally only the given core names (e.g. 'chr1_exon_depth')."""
+    file_paths = []
+    for dir_path, _, file_names in os.walk(root_dir):
+        for file_name in sorted(file_names):
+            core_name = "_".join(file_name.split("_")[1:])[:-len(".txt")]
+            if file_name.endswith(".txt") and (core_names is None or core_name in core_names):
+                file_paths.append(os.path.join(dir_path, file_name))
+    return file_paths
+
+
+def _dir_files(directory, rDNA_types):
+    """Depth files of a depth_results directory whose rDNA type is in rDNA_types."""
+    return [os.path.join(directory, file_name) for file_name in sorted(os.listdir(directory))
+            if len(file_name.split("_")) > 2 and file_name.split("_")[2] in rDNA_types]
+
+
+def benchmark_stages(work_dir, workers=1):
+    """
+    The benchmarked stages, in run order: (stage name, module, function, kwargs, input files).
+    Input files are listed lazily, since CN stages read the outputs of the stages before them.
+    """
+    BRD_root = os.path.join(work_dir, BRD_TREE)
+    output_dir = os.path.join(work_dir, "BRD_Results")
+    os.makedirs(output_dir, exist_ok=True)
+    CN_root = os.path.join(work_dir, CN_ROOT)
+    depth_dir = os.path.join(CN_root, PROJECT_ID, "depth_results_blood")
+    split_dir = os.path.join(CN_root, PROJECT_ID, "depth_results_blood_5s_45s_18s_5.8s_28s")
+    average_dir = os.path.join(CN_root, PROJECT_ID, "average_depth_blood_csv")
+    brd_groups = standard_BRD_groups(output_dir, "blood")
+
+    return [
+        ("2.2 process_all_files", "batch_BRD_average_results", "process_all_files",
+         dict(root_dir=BRD_root, output_file=os.path.join(output_dir, "blood_all_BRD.csv"), label="blood", workers=workers),
+         lambda: _tree_files(BRD_root)),
+        ("2.2 45S exon group", "batch_BRD_average_results", "process_multiple_files_with_label",
+         dict(root_dir=BRD_root, output_file=brd_groups[0]["output_file"], label="blood", selected_files=BRD_45S_FILES,
+              custom_label=brd_groups[0]["custom_label"], workers=workers),
+         lambda: _tree_files(BRD_root, BRD_45S_FILES)),
+        ("2.2 5S exon+intron group", "batch_BRD_average_results", "process_multiple_files_with_label",
+         dict(root_dir=BRD_root, output_file=brd_groups[1]["output_file"], label="blood", selected_files=BRD_5S_FILES,
+              custom_label=brd_groups[1]["custom_label"], workers=workers),
+         lambda: _tree_files(BRD_root, BRD_5S_FILES)),
+        ("2.2 single pass (all + groups)", "batch_BRD_average_results", "process_BRD_outputs",
+         dict(root_dir=BRD_root, label="blood", output_file_all=os.path.join(output_dir, "blood_all_BRD.csv"),
+              groups=brd_groups, workers=workers),
+         lambda: _tree_files(BRD_root)),
+        ("main split_depth_files", "split_depth_files", "split_depth_files",
+         dict(Project_ID=PROJECT_ID, root_dir=CN_root),
+         lambda: _dir_files(depth_dir, ["45S", "5S"])),
+        ("main average_depth", "average_depth", "process_depth_files_for_all_rDNA",
+         dict(Project_ID=PROJECT_ID, root_dir=CN_root),
+         lambda: _dir_files(split_dir, ["5S", "45S", "18S", "5.8S", "28S"])),
+        ("main calculate_CN", "calculate_all_CN", "calculate_CN_for_all_rDNA_vectorized",
+         dict(Project_ID=PROJECT_ID, root_dir=CN_root, write_per_type=True),
+         lambda: [os.path.join(average_dir, file_name) for file_name in sorted(os.listdir(average_dir))]),
+        ("main --views (split + average + CN)", "main", "main",
+         dict(Project_ID=PROJECT_ID, root_dir=CN_root, use_views=True),
+         lambda: _dir_files(depth_dir, ["45S", "5S"])),
+    ]
+
+
+def _max_rss_mb():
+    """Peak RSS of this process and of its finished children, in MB."""
+    unit = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, in KB on Linux
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * unit / 1024 / 1024
+
+
+def _timed_call(module_name, function_name, kwargs):
+    """
+    Runs one stage and returns (seconds, RSS before the stage, peak RSS in MB); stage output is discarded.
+    The RSS before the stage is that of the interpreter with the pipeline modules imported.
+    """
+    function = getattr(importlib.import_module(module_name), function_name)
+    base_rss = _max_rss_mb()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        function(**kwargs)
+        seconds = time.perf_counter() - start
+    return seconds, base_rss, _max_rss_mb()
+
+
+def run_stage(module_name, function_name, kwargs):
+    """Runs a stage in a new spawned process, so its peak RSS is measured on its own."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(_timed_call, module_name, function_name, kwargs).result()
+
+
+def run_benchmarks(work_dir, samples=10, scale=0.01, workers=1, stages=None, repeat=1, seed=0, report_file=None):
+    """
+    Generates (or reuses) the fixtures, times every stage and appends the results to a CSV report.
+
+    Parameters:
+    - work_dir (str): Directory for the fixtures and outputs.
+    - samples (int): Number of synthetic samples.
+    - scale (float): Fraction of every BED interval in the BRD depth files.
+    - workers (int): Worker processes passed to the BRD stages.
+    - stages (list, optional): Substrings of the stage names to run, e.g. ['2.2', 'split']. Default: all.
+    - repeat (int): Runs per stage; the fastest run is reported.
+    - seed (int): Seed of the synthetic depths.
+    - report_file (str, optional): CSV report, appended to. Defaults to '<work_dir>/benchmark_results.csv'.
+
+    Returns:
+    - pd.DataFrame: One row per stage with seconds, lines/s, MB/s and RSS before and during the stage.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    generate_fixtures(work_dir, samples, scale, seed)
+
+    rows = []
+    for stage, module_name, function_name, kwargs, input_files in benchmark_stages(work_dir, workers):
+        if stages and not any(pattern in stage for pattern in stages):
+            continue
+        files, lines, size = _input_stats(input_files())
+        runs = [run_stage(module_name, function_name, kwargs) for _ in range(repeat)]
+        seconds = min(run[0] for run in runs)
+        rows.append({
+            "Stage": stage,
+            "Samples": samples,
+            "Scale": scale,
+            "Workers": workers,
+            "Seconds": round(seconds, 3),
+            "Files": files,
+            "Lines": lines,
+            "MB": round(size / 1e6, 1),
+            "Lines_per_s": round(lines / seconds) if seconds else 0,
+            "MB_per_s": round(size / 1e6 / seconds, 1) if seconds else 0,
+            "Base_RSS_MB": round(min(run[1] for run in runs), 1),
+            "Peak_RSS_MB": round(max(run[2] for run in runs), 1)
+        })
+        print(f"{stage}: {seconds:.3f} s")
+
+    results = pd.DataFrame(rows, columns=REPORT_COLUMNS)
+    report_file = report_file or os.path.join(work_dir, "benchmark_results.csv")
+    results.assign(Date=time.strftime("%Y-%m-%d %H:%M:%S")).to_csv(
+        report_file, mode='a', header=not os.path.exists(report_file), index=False)
+    print(results.to_string(index=False))
+    print(f"Results appended to {report_file}")
+    return results
+
+
+def benchmark_startup(repeat=10, report_file=None):
+    """
+    Measures the startup cost of the pipeline modules: wall time of a fresh `python -c "import <module>"`,
+    the fastest of `repeat` runs.
+
+    Returns:
+    - pd.DataFrame: Module, Startup_ms and Import_ms (startup minus a bare interpreter).
+    """
+    rows = []
+    for name, cwd, code in STARTUP_IMPORTS:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=cwd, check=True)
+            times.append(time.perf_counter() - start)
+        rows.append({"Module": name, "Startup_ms": round(min(times) * 1000, 1)})
+
+    results = pd.DataFrame(rows)
+    results["Import_ms"] = (results["Startup_ms"] - results["Startup_ms"].iloc[0]).round(1)
+    if report_file:
+        results.assign(Date=time.strftime("%Y-%m-%d %H:%M:%S")).to_csv(
+            report_file, mode='a', header=not os.path.exists(report_file), index=False)
+    print(results.to_string(index=False))
+    return results
+
+
+def check_table_writer(work_dir):
+    """
+    Checks that TableWriter appends Parquet batches whose label columns have more categories than
+    the first batch: 2 Sample_IDs, then 300 new ones (more than an int8 dictionary index holds).
+
+    Returns:
+    - bool: True if the table read back equals the batches written.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("pyarrow is not installed, Parquet check skipped")
+        return True
+    from batch_BRD_average_results import BRD_COLUMNS
+    from table_io import TableWriter, read_table
+
+    os.makedirs(work_dir, exist_ok=True)
+    batches = [
+        pd.DataFrame({"Sample_ID": ["S0", "S1"], "Depth_File": "chr1_exon_depth", "Average_Depth": [1.5, 2.0],
+                      "Length": [3, 4], "Label": "blood"}),
+        pd.DataFrame({"Sample_ID": [f"T{i}" for i in range(300)], "Depth_File": "chr1_exon_depth",
+                      "Average_Depth": 1.0, "Length": 5, "Label": "blood"}),
+    ]
+    with TableWriter(os.path.join(work_dir, "table_writer_check.parquet"), BRD_COLUMNS, "parquet") as writer:
+        for batch in batches:
+            writer.write_frame(batch)
+    written = read_table(writer.path).astype({"Sample_ID": str, "Depth_File": str, "Label": str})
+    passed = written.equals(pd.concat(batches, ignore_index=True))
+    print(f"TableWriter Parquet check {'passed' if passed else 'FAILED'}: {writer.path}")
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark batch_BRD_average_results.py and calculate_CN_TCGA_py/main.py on synthetic depth files.")
+    parser.add_argument("work_dir", help="directory for the synthetic fixtures and stage outputs")
+    parser.add_argument("--samples", type=int, default=10, help="number of synthetic samples, e.g. 10 to 1000")
+    parser.add_argument("--scale", type=float, default=0.01, help="fraction of every BED interval written (1.0 = real chr1/13/14/15/21/22 sizes)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of the BRD stages")
+    parser.add_argument("--stages", nargs="*", help="only run stages whose name contains one of these, e.g. 2.2 split")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic depths")
+    parser.add_argument("--report", help="CSV report to append to (default <work_dir>/benchmark_results.csv)")
+    parser.add_argument("--startup", action="store_true",
+                        help="only measure module startup times, appended to <work_dir>/startup_results.csv")
+    parser.add_argument("--check", action="store_true", help="only run the output checks (TableWriter Parquet batches)")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check_table_writer(args.work_dir) else 1)
+
+    if args.startup:
+        os.makedirs(args.work_dir, exist_ok=True)
+        benchmark_startup(max(args.repeat, 10), args.report or os.path.join(args.work_dir, "startup_results.csv"))
+        sys.exit(0)
+    run_benchmarks(args.work_dir, args.samples, args.scale, args.workers, args.stages, args.repeat, args.seed, args.report)
+
+# Example usage:
+#python benchmark_pipeline.py /tmp/rdna_bench --samples 10
+#python benchmark_pipeline.py /scratch/rdna_bench --samples 1000 --scale 0.1 --workers 16 --stages 2.2
+#python benchmark_pipeline.py /tmp/rdna_bench --startup
+#python benchmark_pipeline.py /tmp/rdna_bench --check
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# The shared depth readers (depth_text, depth_binary, aggregate_cache, prefetch_io, table_io, ...)
+# live next to the copy number scripts in intron_exon_no_duplication/calculate_CN_TCGA_py.
+# The scripts at the top of the repository import this module once to make them importable,
+# instead of each one extending sys.path itself.
+
+CN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intron_exon_no_duplication", "calculate_CN_TCGA_py")
+
+if CN_DIR not in sys.path:
+    sys.path.insert(0, CN_DIR)
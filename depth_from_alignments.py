@@ -0,0 +1,274 @@
+import os
+import sys
+import argparse
+import threading
+import subprocess
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pysam
+
+import cn_path  # noqa: F401 - the shared depth readers live next to the copy number scripts
+
+from depth_binary import DEPTH_BINARY_EXT, DepthBlock, write_depth_binary
+
+# In-process replacement for steps 1.3 and 1.4: the bwa alignments are read once (from a SAM/BAM
+# file or straight from the stdout of bwa mem), reads are filtered on FLAG 0/16 like the awk filter
+# of 1.3, and the depth of every position of the small 5S/45S references is accumulated in a NumPy
+# array. No filtered SAM, BAM, sorted BAM or index is written, only the depth file.
+#
+# The depth matches `samtools depth -a` of 1.4: aligned bases only (deletions and reference skips
+# are not counted), every position of each reference with at least one read, 1-based positions.
+
+# FLAG values kept by step 1.3: primary alignments mapped on the forward (0) or reverse (16) strand
+KEPT_FLAGS = (0, 16)
+ALIGNMENT_EXTS = (".sam", ".bam")
+
+
+def alignment_depth(alignments, kept_flags=KEPT_FLAGS):
+    """
+    Computes per-position depth of the reads whose FLAG is in kept_flags.
+
+    Parameters:
+    - alignments (str or file): Path to a SAM/BAM file (unsorted is fine), '-' for stdin, or an open
+      binary file such as the stdout of bwa mem.
+    - kept_flags (tuple): FLAG values of the reads that are counted.
+
+    Returns:
+    - tuple: ({contig: np.ndarray of uint32 depths, position 1 at index 0}, kept reads, total reads).
+      Only contigs with at least one kept read are returned, like samtools depth -a.
+    """
+    kept_flags = frozenset(kept_flags)
+    kept_reads = 0
+    total_reads = 0
+
+    with pysam.AlignmentFile(alignments, "r", check_sq=False) as sam:
+        lengths = sam.lengths
+        # Start and end of every aligned block, per reference id; turned into depth by a prefix sum
+        starts = {}
+        ends = {}
+        for read in sam.fetch(until_eof=True):
+            total_reads += 1
+            if read.flag not in kept_flags:
+                continue
+            kept_reads += 1
+            tid = read.reference_id
+            if tid not in starts:
+                starts[tid] = array('q')
+                ends[tid] = array('q')
+            for block_start, block_end in read.get_blocks():
+                starts[tid].append(block_start)
+                ends[tid].append(block_end)
+
+        depths = {}
+        for tid in sorted(starts):
+            length = lengths[tid]
+            steps = (np.bincount(np.frombuffer(starts[tid], dtype=np.int64), minlength=length + 1)
+                     - np.bincount(np.frombuffer(ends[tid], dtype=np.int64), minlength=length + 1))
+            depths[sam.get_reference_name(tid)] = np.cumsum(steps[:length]).astype(np.uint32)
+
+    return depths, kept_reads, total_reads
+
+
+def write_depth_file(depths, depth_file):
+    """
+    Writes depth arrays as a `samtools depth -a` text file (contig, position, depth), or as a binary
+    depth file if depth_file ends with '.dbin'.
+    """
+    if depth_file.endswith(DEPTH_BINARY_EXT):
+        write_depth_binary(depth_file, [DepthBlock(contig, 1, contig_depths) for contig, contig_depths in depths.items()])
+        return
+
+    with open(depth_file, 'w') as file:
+        for contig, contig_depths in depths.items():
+            file.writelines(f"{contig}\t{position}\t{depth}\n"
+                            for position, depth in enumerate(contig_depths.tolist(), 1))
+
+
+def depth_from_alignment_file(alignment_file, depth_file):
+    """
+    Steps 1.3 + 1.4 for one bwa output file: FLAG 0/16 filter and depth, without intermediate files.
+
+    Parameters:
+    - alignment_file (str): Path to the SAM/BAM output of bwa mem.
+    - depth_file (str): Path of the depth file ('.txt' or '.dbin').
+    """
+    depths, kept_reads, total_reads = alignment_depth(alignment_file)
+    write_depth_file(depths, depth_file)
+    print(f"Processed {alignment_file} -> {depth_file} ({kept_reads} of {total_reads} reads with FLAG 0/16)")
+    return depth_file
+
+
+def _bwa_depth(command, depth_file, source, write_reads=None):
+    """Runs bwa mem and reads its stdout with alignment_depth; write_reads(stdin) feeds the reads from a thread"""
+    process = subprocess.Popen(command, stdin=subprocess.PIPE if write_reads else None,
+                               stdout=subprocess.PIPE)  # bwa logs to stderr as in 1.2
+    writer = None
+    writer_errors = []
+    if write_reads:
+        def feed():
+            try:
+                write_reads(process.stdin)
+            except BrokenPipeError:
+                pass  # bwa exited early, its return code is checked below
+            except Exception as error:
+                writer_errors.append(error)
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+
+    try:
+        depths, kept_reads, total_reads = alignment_depth(process.stdout)
+    except (OSError, ValueError) as error:
+        # a failed bwa usually shows up as truncated or missing SAM output
+        process.stdout.close()
+        if writer:
+            writer.join()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command) from error
+        raise
+    process.stdout.close()
+    if writer:
+        writer.join()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    if writer_errors:
+        raise writer_errors[0]
+
+    write_depth_file(depths, depth_file)
+    print(f"Aligned {source} -> {depth_file} ({kept_reads} of {total_reads} reads with FLAG 0/16)")
+    return depth_file
+
+
+def align_and_depth(fastq_file, reference, depth_file, threads=1):
+    """
+    Steps 1.2 to 1.4 for one FASTQ file: bwa mem output is piped into alignment_depth, so no SAM
+    file is written.
+
+    Parameters:
+    - fastq_file (str): Path to the FASTQ file.
+    - reference (str): Path to the bwa-indexed reference FASTA.
+    - depth_file (str): Path of the depth file ('.txt' or '.dbin').
+    - threads (int): bwa mem threads.
+    """
+    command = ["bwa", "mem", "-t", str(threads), reference, fastq_file]
+    return _bwa_depth(command, depth_file, fastq_file)
+
+
+def align_reads_and_depth(write_reads, reference, depth_file, threads=1, source="reads"):
+    """
+    Like align_and_depth, with the reads written to the stdin of bwa mem instead of read from a
+    FASTQ file, so neither the FASTQ nor the SAM file is written.
+
+    Parameters:
+    - write_reads (callable): write_reads(file) writes FASTQ records to a binary file object; it runs
+      in a thread while the alignments are read.
+    - reference (str): Path to the bwa-indexed reference FASTA.
+    - depth_file (str): Path of the depth file ('.txt' or '.dbin').
+    - threads (int): bwa mem threads.
+    - source (str): Name of the reads in the log line.
+    """
+    command = ["bwa", "mem", "-t", str(threads), reference, "-"]
+    return _bwa_depth(command, depth_file, source, write_reads)
+
+
+def process_alignment_dir(input_dir, depth_dir, workers=1, binary=False):
+    """
+    Replaces 1.3filter_0_16_parellel.sh and 1.4depth_calculation.sh for a directory of bwa outputs.
+    '<base>.sam' gives '<base>_f0_16_depth.txt', the name written by 1.4.
+
+    Parameters:
+    - input_dir (str): Directory with the SAM/BAM files of step 1.2, e.g. '$Project_ID/bwa_results'.
+    - depth_dir (str): Output directory, e.g. '$Project_ID/depth_results_blood'.
+    - workers (int): Number of files processed in parallel.
+    - binary (bool): If True, writes '.dbin' depth files instead of text.
+    """
+    os.makedirs(depth_dir, exist_ok=True)
+    extension = DEPTH_BINARY_EXT if binary else ".txt"
+    alignment_files = sorted(os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(ALIGNMENT_EXTS))
+    depth_files = [os.path.join(depth_dir, f"{os.path.splitext(os.path.basename(f))[0]}_f0_16_depth{extension}")
+                   for f in alignment_files]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(depth_from_alignment_file, alignment_files, depth_files))
+    else:
+        for alignment_file, depth_file in zip(alignment_files, depth_files):
+            depth_from_alignment_file(alignment_file, depth_file)
+    print("All files processed.")
+
+
+def fastq_reference(fastq_name, reference_5S, reference_45S):
+    """Returns (rDNA_type, reference) for a FASTQ of step 1.1, following 1.2, or (None, None)."""
+    if "1q42" in fastq_name:
+        return "5S", reference_5S
+    if "GL000220v1" in fastq_name:
+        return "45S", reference_45S
+    return None, None
+
+
+def process_fastq_dir(fastq_dir, depth_dir, reference_5S, reference_45S, threads=1, workers=1, binary=False):
+    """
+    Replaces steps 1.2 to 1.4 for a directory of FASTQ files: '<base>.fastq' is aligned to the 5S or
+    45S reference as in 1.2 and gives '<base>_<rDNA_type>_f0_16_depth.txt'.
+
+    Parameters:
+    - fastq_dir (str): Directory with the FASTQ files of step 1.1.
+    - depth_dir (str): Output directory, e.g. '$Project_ID/depth_results_blood'.
+    - reference_5S (str), reference_45S (str): bwa-indexed reference FASTA files.
+    - threads (int): bwa mem threads per file.
+    - workers (int): Number of files aligned in parallel.
+    - binary (bool): If True, writes '.dbin' depth files instead of text.
+    """
+    os.makedirs(depth_dir, exist_ok=True)
+    extension = DEPTH_BINARY_EXT if binary else ".txt"
+    jobs = []
+    for fastq_name in sorted(os.listdir(fastq_dir)):
+        if not fastq_name.endswith((".fastq", ".fastq.gz")):
+            continue
+        base_name = fastq_name.split(".fastq")[0]
+        rDNA_type, reference = fastq_reference(base_name, reference_5S, reference_45S)
+        if reference is None:
+            print(f"Skipping {fastq_name}: does not match expected naming conventions.")
+            continue
+        jobs.append((os.path.join(fastq_dir, fastq_name), reference,
+                     os.path.join(depth_dir, f"{base_name}_{rDNA_type}_f0_16_depth{extension}")))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(align_and_depth, *zip(*jobs), [threads] * len(jobs)))
+    else:
+        for fastq_file, reference, depth_file in jobs:
+            align_and_depth(fastq_file, reference, depth_file, threads)
+    print("All FASTQ files have been processed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FLAG 0/16 filter and depth of the 5S/45S alignments, without intermediate SAM/BAM files.")
+    parser.add_argument("input_dir", help="directory with the bwa SAM/BAM files (step 1.2), or the FASTQ files with --bwa")
+    parser.add_argument("depth_dir", help="directory for the depth files, e.g. TCGA-BLCA/depth_results_blood")
+    parser.add_argument("--bwa", action="store_true", help="align the FASTQ files of input_dir with bwa mem and read its output directly")
+    parser.add_argument("--reference_5S", default="rDNA_paper/5S_X12811.1.fasta", help="5S reference for --bwa")
+    parser.add_argument("--reference_45S", default="rDNA_paper/45S_U13369.1_Modified_forward_16kb.fasta", help="45S reference for --bwa")
+    parser.add_argument("--threads", type=int, default=1, help="bwa mem threads per file")
+    parser.add_argument("--workers", type=int, default=1, help="number of files processed in parallel")
+    parser.add_argument("--binary", action="store_true", help="write binary .dbin depth files")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Input directory not found: {args.input_dir}")
+        sys.exit(1)
+    if args.bwa:
+        process_fastq_dir(args.input_dir, args.depth_dir, args.reference_5S, args.reference_45S,
+                          threads=args.threads, workers=args.workers, binary=args.binary)
+    else:
+        process_alignment_dir(args.input_dir, args.depth_dir, workers=args.workers, binary=args.binary)
+
+# Example usage (replaces 1.3 + 1.4, reads the SAM files of 1.2):
+#python depth_from_alignments.py TCGA-BLCA/bwa_results TCGA-BLCA/depth_results_blood --workers 30
+# Replaces 1.2 + 1.3 + 1.4, bwa output is never written to disk:
+#python depth_from_alignments.py TCGA-BLCA/wgs_fastq_GL000220v1_1q42_10_v1 TCGA-BLCA/depth_results_blood --bwa --threads 8 --workers 4
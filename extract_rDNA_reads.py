@@ -0,0 +1,201 @@
+import os
+import sys
+import gzip
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pysam
+
+from depth_from_alignments import DEPTH_BINARY_EXT, align_reads_and_depth
+
+try:
+    from isal import igzip
+except ImportError:  # python-isal is optional
+    igzip = None
+
+# In-process replacement for step 1.1: each indexed BAM is opened once, the reads of the 45S
+# scaffold and of the 5S cluster are fetched through the BAM index in the same session and written
+# straight to FASTQ (optionally gzip compressed), or piped into bwa mem (steps 1.2 to 1.4, see
+# depth_from_alignments.py). No SAM file is written and the BAM header is decoded once per BAM.
+#
+# The FASTQ matches `samtools view -h <bam> <region> | samtools fastq`: secondary and supplementary
+# alignments are skipped, reverse-strand reads are written in their original orientation,
+# READ1/READ2 get '/1' and '/2', and a read stored without qualities gets 'B' qualities.
+
+# (name suffix, region, rDNA type, default reference) of 1.1 and 1.2
+EXTRACT_REGIONS = [
+    ("GL000220v1", "chrUn_GL000220v1", "45S", "rDNA_paper/45S_U13369.1_Modified_forward_16kb.fasta"),
+    ("1q42", "chr1:226743523-231781906", "5S", "rDNA_paper/5S_X12811.1.fasta"),
+]
+# samtools fastq default --excl-flags: SECONDARY, SUPPLEMENTARY
+FASTQ_EXCLUDE_FLAGS = 0x100 | 0x800
+READ1 = 0x40
+READ2 = 0x80
+# Quality written by samtools fastq (htslib) for reads stored without qualities
+DEFAULT_QUALITY = "B"
+# FASTQ records joined per write
+WRITE_BATCH = 10000
+# gzip level of '.fastq.gz' output; the files are only read once by bwa
+GZIP_LEVEL = 1
+
+
+def fastq_records(bam, region, exclude_flags=FASTQ_EXCLUDE_FLAGS):
+    """
+    Yields the FASTQ records (str) of the reads overlapping region, in BAM order.
+
+    Parameters:
+    - bam (pysam.AlignmentFile): Open, indexed BAM file.
+    - region (str): samtools region, e.g. 'chrUn_GL000220v1' or 'chr1:226743523-231781906'.
+    - exclude_flags (int): Reads with any of these FLAG bits are skipped.
+    """
+    for read in bam.fetch(region=region):
+        flag = read.flag
+        if flag & exclude_flags:
+            continue
+        mate = flag & (READ1 | READ2)
+        suffix = "/1" if mate == READ1 else "/2" if mate == READ2 else ""
+        sequence = read.get_forward_sequence() or ""
+        qualities = read.query_qualities_str
+        if qualities is None:
+            qualities = DEFAULT_QUALITY * len(sequence)
+        elif read.is_reverse:
+            qualities = qualities[::-1]
+        yield f"@{read.query_name}{suffix}\n{sequence}\n+\n{qualities}\n"
+
+
+def write_fastq(records, file):
+    """Writes FASTQ records to a binary file object in batches; returns the number of records."""
+    count = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == WRITE_BATCH:
+            file.write("".join(batch).encode())
+            count += len(batch)
+            batch = []
+    if batch:
+        file.write("".join(batch).encode())
+        count += len(batch)
+    return count
+
+
+def _open_fastq(fastq_file):
+    if not fastq_file.endswith(".gz"):
+        return open(fastq_file, 'wb')
+    gzip_module = igzip if igzip is not None else gzip
+    return gzip_module.open(fastq_file, 'wb', compresslevel=GZIP_LEVEL)
+
+
+def extract_bam_fastq(bam_file, fastq_dir, compress=False, regions=EXTRACT_REGIONS):
+    """
+    Step 1.1 for one BAM: writes '<base>_GL000220v1.fastq' and '<base>_1q42.fastq' from one
+    session of the indexed BAM.
+
+    Parameters:
+    - bam_file (str): Path to an indexed BAM file.
+    - fastq_dir (str): Output directory, e.g. '$Project_ID/wgs_fastq_GL000220v1_1q42_10_v1'.
+    - compress (bool): If True, writes '.fastq.gz' files.
+    - regions (list): (name suffix, region, rDNA type, reference) tuples, EXTRACT_REGIONS by default.
+
+    Returns:
+    - list: Paths of the FASTQ files.
+    """
+    base_name = os.path.basename(bam_file)[:-len(".bam")]
+    extension = ".fastq.gz" if compress else ".fastq"
+    fastq_files = []
+    with pysam.AlignmentFile(bam_file, "rb") as bam:
+        for suffix, region, _, _ in regions:
+            fastq_file = os.path.join(fastq_dir, f"{base_name}_{suffix}{extension}")
+            with _open_fastq(fastq_file) as file:
+                count = write_fastq(fastq_records(bam, region), file)
+            print(f"Extracted {count} reads of {region} from {bam_file} -> {fastq_file}")
+            fastq_files.append(fastq_file)
+    return fastq_files
+
+
+def extract_bam_depth(bam_file, depth_dir, references=None, threads=1, binary=False, regions=EXTRACT_REGIONS):
+    """
+    Steps 1.1 to 1.4 for one BAM: the reads of each region are piped from the BAM into bwa mem and
+    its alignments into the FLAG 0/16 depth, without FASTQ, SAM or BAM files. The depth files have
+    the names of the --bwa mode of depth_from_alignments.py, '<base>_GL000220v1_45S_f0_16_depth.txt'.
+
+    Parameters:
+    - bam_file (str): Path to an indexed BAM file.
+    - depth_dir (str): Output directory, e.g. '$Project_ID/depth_results_blood'.
+    - references (dict, optional): {rDNA type: bwa-indexed reference}; defaults to the references of 1.2.
+    - threads (int): bwa mem threads.
+    - binary (bool): If True, writes '.dbin' depth files instead of text.
+    - regions (list): (name suffix, region, rDNA type, reference) tuples, EXTRACT_REGIONS by default.
+
+    Returns:
+    - list: Paths of the depth files.
+    """
+    base_name = os.path.basename(bam_file)[:-len(".bam")]
+    extension = DEPTH_BINARY_EXT if binary else ".txt"
+    depth_files = []
+    with pysam.AlignmentFile(bam_file, "rb") as bam:
+        for suffix, region, rDNA_type, reference in regions:
+            reference = (references or {}).get(rDNA_type, reference)
+            depth_file = os.path.join(depth_dir, f"{base_name}_{suffix}_{rDNA_type}_f0_16_depth{extension}")
+            align_reads_and_depth(lambda file: write_fastq(fastq_records(bam, region), file), reference, depth_file,
+                                  threads, source=f"{bam_file} {region}")
+            depth_files.append(depth_file)
+    return depth_files
+
+
+def process_bam_dir(bam_dir, output_dir, workers=1, compress=False, bwa=False, references=None, threads=1,
+                    binary=False):
+    """
+    Replaces 1.1extract_merge_reads_test_data_paralle.sh (and with bwa=True also 1.2 to 1.4) for a
+    directory of indexed BAM files, with at most `workers` BAM files open at a time.
+
+    Parameters:
+    - bam_dir (str): Directory containing the indexed BAM files.
+    - output_dir (str): FASTQ directory, e.g. '$Project_ID/wgs_fastq_GL000220v1_1q42_10_v1', or with
+      bwa=True the depth directory, e.g. '$Project_ID/depth_results_blood'.
+    - workers (int): Number of BAM files processed in parallel.
+    - compress (bool): If True, writes '.fastq.gz' files.
+    - bwa (bool): If True, pipes the reads into bwa mem and writes depth files instead of FASTQ files.
+    - references (dict, optional): {rDNA type: bwa-indexed reference} for bwa=True.
+    - threads (int): bwa mem threads per BAM for bwa=True.
+    - binary (bool): If True, writes '.dbin' depth files (bwa=True).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    bam_files = sorted(os.path.join(bam_dir, f) for f in os.listdir(bam_dir) if f.endswith(".bam"))
+    if bwa:
+        function, arguments = extract_bam_depth, (output_dir, references, threads, binary)
+    else:
+        function, arguments = extract_bam_fastq, (output_dir, compress)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(function, bam_files, *([argument] * len(bam_files) for argument in arguments)))
+    else:
+        for bam_file in bam_files:
+            function(bam_file, *arguments)
+    print("All BAM files processed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the 45S (GL000220v1) and 5S (1q42) reads of indexed BAM files in one pass per BAM.")
+    parser.add_argument("bam_dir", help="directory containing the indexed BAM files")
+    parser.add_argument("output_dir", help="directory for the FASTQ files, e.g. TCGA-BLCA/wgs_fastq_GL000220v1_1q42_10_v1 (depth files with --bwa)")
+    parser.add_argument("--workers", type=int, default=1, help="number of BAM files processed in parallel")
+    parser.add_argument("--gzip", action="store_true", help="write .fastq.gz files")
+    parser.add_argument("--bwa", action="store_true", help="pipe the reads into bwa mem and write the FLAG 0/16 depth files (steps 1.1 to 1.4)")
+    parser.add_argument("--reference_5S", default=EXTRACT_REGIONS[1][3], help="5S reference for --bwa")
+    parser.add_argument("--reference_45S", default=EXTRACT_REGIONS[0][3], help="45S reference for --bwa")
+    parser.add_argument("--threads", type=int, default=1, help="bwa mem threads per BAM file")
+    parser.add_argument("--binary", action="store_true", help="with --bwa, write binary .dbin depth files")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.bam_dir):
+        print(f"BAM directory not found: {args.bam_dir}")
+        sys.exit(1)
+    process_bam_dir(args.bam_dir, args.output_dir, workers=args.workers, compress=args.gzip, bwa=args.bwa,
+                    references={"5S": args.reference_5S, "45S": args.reference_45S}, threads=args.threads,
+                    binary=args.binary)
+
+# Example usage (replaces 1.1, no SAM files are written):
+#python extract_rDNA_reads.py /home/user/CancerEvolution/Datasets/TCGA_WGS/data/TCGA-BLCA TCGA-BLCA/wgs_fastq_GL000220v1_1q42_10_v1 --workers 32
+# Replaces 1.1 to 1.4, only the depth files are written:
+#python extract_rDNA_reads.py /home/user/CancerEvolution/Datasets/TCGA_WGS/data/TCGA-BLCA TCGA-BLCA/depth_results_blood --bwa --threads 4 --workers 8
@@ -0,0 +1,127 @@
+import io
+import os
+import hashlib
+import sqlite3
+
+# On-disk cache of exact depth aggregates, shared by batch_BRD_average_results.py and average_depth.py.
+#
+# One row per (depth file, name), where name is the depth file's core name for BRD files
+# (e.g. 'chr1_exon_depth') or the rDNA type and range for rDNA files (e.g. '18S_all').
+# Rows store the integer depth sum and number of positions, so averages and merged groups
+# are exact. Rows of a file are evicted as soon as the file's content changes: size and mtime are
+# checked first, and the content hash only if they differ (e.g. a file rewritten with the same data).
+# The hash of a parsed file is computed in the same read as its sums (HashingReader), so a file is
+# not read a second time to store its aggregates.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS aggregates (
+    file_path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    total_depth INTEGER NOT NULL,
+    total_length INTEGER NOT NULL,
+    PRIMARY KEY (file_path, name)
+)
+"""
+
+
+def file_sha256(file_path, chunk_size=16 * 1024 * 1024):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashingReader(io.RawIOBase):
+    """Raw stream over a binary file object that adds every byte read to a SHA-256 digest."""
+
+    def __init__(self, file):
+        self.name = getattr(file, "name", None)
+        self._file = file
+        self._digest = hashlib.sha256()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self._file.readinto(buffer)
+        if size:
+            self._digest.update(memoryview(buffer)[:size])
+        else:
+            self._eof = True
+        return size
+
+    def hexdigest(self, chunk_size=16 * 1024 * 1024):
+        """SHA-256 of the whole file's content; the part not read yet is read now."""
+        if not self._eof:
+            for block in iter(lambda: self._file.read(chunk_size), b""):
+                self._digest.update(block)
+            self._eof = True
+        return self._digest.hexdigest()
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def open_cache(cache_file):
+    """Opens (and creates if needed) an aggregate cache."""
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    os.makedirs(cache_dir, exist_ok=True)
+    cache = sqlite3.connect(cache_file)
+    cache.execute(_SCHEMA)
+    return cache
+
+
+def get_aggregate(cache, file_path, name):
+    """
+    Returns the cached (total depth, total length) of a depth file, or None if it is missing
+    or the file changed since it was cached. Stale rows of the file are evicted.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    row = cache.execute(
+        "SELECT size, mtime_ns, sha256, total_depth, total_length FROM aggregates WHERE file_path = ? AND name = ?",
+        (file_path, name)).fetchone()
+    if row is None:
+        return None
+    if row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+        if row[0] != stat.st_size or row[2] != file_sha256(file_path):
+            cache.execute("DELETE FROM aggregates WHERE file_path = ?", (file_path,))
+            cache.commit()
+            return None
+        # Same content, only touched or rewritten
+        cache.execute("UPDATE aggregates SET mtime_ns = ? WHERE file_path = ?", (stat.st_mtime_ns, file_path))
+    return row[3], row[4]
+
+
+def put_aggregate(cache, file_path, name, sample, total_depth, total_length, sha256=None):
+    """
+    Stores the exact (total depth, total length) of a depth file. sha256 is the content hash taken
+    while the file was parsed (HashingReader.hexdigest()); without it the file is hashed here.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    if sha256 is None:
+        sha256 = file_sha256(file_path)
+    cache.execute(
+        "INSERT OR REPLACE INTO aggregates VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (file_path, name, sample, stat.st_size, stat.st_mtime_ns, sha256, int(total_depth), int(total_length)))
+
+
+def prune_cache(cache_file):
+    """Removes the rows of depth files that no longer exist."""
+    cache = open_cache(cache_file)
+    file_paths = [row[0] for row in cache.execute("SELECT DISTINCT file_path FROM aggregates")]
+    missing = [(file_path,) for file_path in file_paths if not os.path.exists(file_path)]
+    cache.executemany("DELETE FROM aggregates WHERE file_path = ?", missing)
+    cache.commit()
+    cache.close()
+    print(f"Removed {len(missing)} missing depth files from {cache_file}.")
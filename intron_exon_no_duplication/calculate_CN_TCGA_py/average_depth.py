@@ -1,37 +1,83 @@
+import io
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
+from depth_binary import DEPTH_BINARY_EXT, is_depth_binary, read_depth_binary, slice_depth_blocks
+from aggregate_cache import HashingReader, open_cache, get_aggregate, put_aggregate
+from table_io import write_rows
+from depth_text import DEPTH_FILE_EXTS, READ_BUFFER_SIZE, open_depth_stream, open_depth_text
+from prefetch_io import PREFETCH_READ_SIZE, prefetch_files
+import run_report
 
 
 
 
 #notice 5S and 45s
-def read_and_filter_depth(file_path, position_range=None):
+def read_and_filter_depth(file_path, position_range=None, stream=None):
     """
     Reads depth data from a file and filters it based on a position range.
 
     Parameters:
-    - file_path (str): Path to the input file containing depth data.
+    - file_path (str): Path to the input file containing depth data, text (plain, gzip or bgzip) or binary ('.dbin').
     - position_range (tuple, optional): A tuple specifying the range of positions (min_position, max_position).
+    - stream (optional): The text file already opened as a binary stream (see prefetch_io.prefetch_files);
+      it is read instead of file_path and closed.
 
     Returns:
-    - positions (list): List of filtered positions.
-    - depths (list): List of filtered depths.
+    - positions (list): List of filtered positions (NumPy array for binary files).
+    - depths (list): List of filtered depths (NumPy array for binary files).
     """
+    if is_depth_binary(file_path):
+        return read_and_filter_depth_binary(file_path, position_range)
+
     positions = []
     depths = []
 
-    with open(file_path, 'r') as file:
-        for line in file:
-            parts = line.strip().split('\t')
-            position = int(parts[1])
-            depth = int(parts[2])
+    if stream is not None:
+        with stream, open_depth_stream(stream, 'r') as file:
+            _read_depth_lines(file, position_range, positions, depths)
+    else:
+        with open_depth_text(file_path, 'r') as file:
+            _read_depth_lines(file, position_range, positions, depths)
+
+    return positions, depths
+
+
+def _read_depth_lines(file, position_range, positions, depths):
+    for line in file:
+        parts = line.strip().split('\t')
+        position = int(parts[1])
+        depth = int(parts[2])
+
+        # Apply position range filter if provided
+        if position_range is None or (position_range[0] <= position <= position_range[1]):
+            positions.append(position)
+            depths.append(depth)
+
+
+def read_and_filter_depth_binary(file_path, position_range=None):
+    """
+    Reads depth data from a binary depth file and filters it based on a position range.
+    The range is applied by slicing the memory-mapped depth arrays.
 
-            # Apply position range filter if provided
-            if position_range is None or (position_range[0] <= position <= position_range[1]):
-                positions.append(position)
-                depths.append(depth)
+    Parameters:
+    - file_path (str): Path to the binary depth file.
+    - position_range (tuple, optional): A tuple specifying the range of positions (min_position, max_position).
 
+    Returns:
+    - positions (np.ndarray): Filtered positions.
+    - depths (np.ndarray): Filtered depths.
+    """
+    blocks = read_depth_binary(file_path)
+    if position_range is not None:
+        blocks = slice_depth_blocks(blocks, position_range[0], position_range[1])
+    if not blocks:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32)
+    if len(blocks) == 1:
+        block = blocks[0]
+        return np.arange(block.start, block.start + len(block.depths)), block.depths
+
+    positions = np.concatenate([np.arange(b.start, b.start + len(b.depths)) for b in blocks])
+    depths = np.concatenate([b.depths for b in blocks])
     return positions, depths
 
 
@@ -45,6 +91,8 @@ def calculate_average_depth(depths):
     Returns:
     - float: Average depth.
     """
+    if isinstance(depths, np.ndarray):
+        return int(depths.sum(dtype=np.uint64)) / len(depths) if len(depths) else 0
     return sum(depths) / len(depths) if depths else 0
 
 
@@ -57,18 +105,16 @@ def save_depth_distribution_plot(positions, depths, output_path, title='Depth Di
     - depths (list): List of depth values.
     - output_path (str): Path to save the plot image.
     - title (str): Title of the plot.
+    The profile is decimated to depth_plots.PLOT_BINS bins (mean line and min-max band).
     """
-    plt.figure(figsize=(10, 6))
-    plt.plot(positions, depths, marker='o', linestyle='-', color='#377EB8', markersize=1)
-    plt.title(title, fontsize=16)
-    plt.xlabel('Position', fontsize=14)
-    plt.ylabel('Depth', fontsize=14)
-    plt.grid(True)
-    plt.savefig(output_path)
-    plt.close()
+    import depth_plots  # only needed with save_plots=True
+
+    depth_plots.render_profile(depth_plots.binned_profile(positions, depths), output_path, title)
 
 
-def process_depth_files(input_dir, output_dir="/depth/processed", rDNA_type="45S", Project_ID="Not", position_range=None, save_plots=False):
+def process_depth_files(input_dir, output_dir="/depth/processed", rDNA_type="45S", Project_ID="Not", position_range=None, save_plots=False,
+                        cache_file=None, output_format="csv", plot_workers=1, prefetch_depth=0,
+                        read_size=PREFETCH_READ_SIZE, io_stats=None):
     """
     Processes multiple depth files in a directory, calculates average depth for a specified range, 
     and saves results in a summary table. Optionally, saves depth distribution plots.
@@ -79,42 +125,83 @@ def process_depth_files(input_dir, output_dir="/depth/processed", rDNA_type="45S
     - rDNA_type (str): Type of rDNA to process (e.g., '45S').
     - position_range (tuple, optional): Range of positions to filter depth data (min_position, max_position).
     - save_plots (bool): If True, saves depth distribution plots.
+    - cache_file (str, optional): SQLite aggregate cache (see aggregate_cache.py). Files whose exact
+      depth sum is cached and unchanged are not read again.
+    - output_format (str): 'csv' or 'parquet' summary table.
+    - plot_workers (int): Processes rendering the plots (see depth_plots.render_profiles).
+    - prefetch_depth (int): Text depth files read ahead in threads while the current one is parsed
+      (see prefetch_io.py); 0 reads them one after another.
+    - read_size (int): Bytes per read of the prefetch threads.
+    - io_stats (dict, optional): prefetch_io.new_io_stats() dict that the prefetch statistics are added to.
     """
     os.makedirs(output_dir, exist_ok=True)
     results = []
+    plot_jobs = []
     print(output_dir)
+    range_str = f"{position_range[0]}-{position_range[1]}" if position_range else "all"
+    cache = open_cache(cache_file) if cache_file else None
 
+    files = []
     for filename in os.listdir(input_dir):
         filename_rDNA = filename.split("_")[2]
-        if rDNA_type == filename_rDNA and filename.endswith('.txt'):
+        if rDNA_type == filename_rDNA and filename.endswith(DEPTH_FILE_EXTS):
             file_path = os.path.join(input_dir, filename)
+            # Cached exact sums give the same average without reading the file
+            cached = get_aggregate(cache, file_path, f"{rDNA_type}_{range_str}") if cache and not save_plots else None
+            files.append((filename, file_path, cached))
+
+    # Text files that are read are prefetched; binary files are memory-mapped
+    text_files = [file_path for _, file_path, cached in files if cached is None and not is_depth_binary(file_path)]
+    with prefetch_files(text_files, prefetch_depth, read_size, io_stats) as open_prefetched:
+        for filename, file_path, cached in files:
             base_name = filename.split('_')[0]  # Extract sample ID, e.g., 'TCGA-4Z-AA7Y-10A'
 
+            if cached is not None:
+                total_depth, total_length = cached
+                results.append({"Sample": f"{base_name}_{rDNA_type}", "Average Depth": total_depth / total_length if total_length else 0})
+                run_report.count(rDNA_type, cached_files=1)
+                continue
+
             # Read and filter data, then calculate average depth
-            positions, depths = read_and_filter_depth(file_path, position_range)
+            stream = open_prefetched(file_path)
+            hashed = None
+            if cache and not is_depth_binary(file_path):
+                # the content hash of the cache is taken in the same read
+                hashed = HashingReader(stream if stream is not None else open(file_path, 'rb', buffering=0))
+                stream = io.BufferedReader(hashed, READ_BUFFER_SIZE)
+            positions, depths = read_and_filter_depth(file_path, position_range, stream)
+            run_report.count(rDNA_type, files=1, bytes=os.path.getsize(file_path), lines=len(depths))
             average_depth = calculate_average_depth(depths)
+            if cache:
+                put_aggregate(cache, file_path, f"{rDNA_type}_{range_str}", base_name, int(np.sum(depths, dtype=np.int64)), len(depths),
+                              sha256=hashed.hexdigest() if hashed else None)
 
-            # Save plot if requested
+            # Queue the decimated profile if plots are requested; they are rendered in batches below
             if save_plots:
+                from depth_plots import binned_profile
                 plot_path = os.path.join(output_dir, f"{base_name}_depth_distribution.png")
-                save_depth_distribution_plot(positions, depths, plot_path, title=f"{base_name} Depth Distribution")
+                plot_jobs.append((binned_profile(positions, depths), plot_path, f"{base_name} Depth Distribution"))
 
             # Append results for summary table
             results.append({"Sample": f"{base_name}_{rDNA_type}", "Average Depth": average_depth})
 
+    if cache:
+        cache.commit()
+        cache.close()
+
     # Define summary file name with rDNA type and position range
-    range_str = f"{position_range[0]}-{position_range[1]}" if position_range else "all"
     #summary_file_name = f"{rDNA_type}_{range_str}_{input_dir}_average_depth.csv"
     #summary_file_name = f"{rDNA_type}_{range_str}_average_depth.csv"
     summary_file_name = f"{rDNA_type}_{range_str}_{Project_ID}_average_depth.csv"
     summary_path = os.path.join(output_dir, summary_file_name)
 
     # Save results to a summary table
-    summary_df = pd.DataFrame(results)
-    summary_df.to_csv(summary_path, index=False)
+    summary_path = write_rows(results, ["Sample", "Average Depth"], summary_path, output_format)
 
     print(f"Processing complete. Summary saved to {summary_path}.")
     if save_plots:
+        from depth_plots import render_profiles
+        render_profiles(plot_jobs, plot_workers)
         print("Depth distribution plots saved in", output_dir)
 
 #example usage for process_depth_files
@@ -137,13 +224,59 @@ process_depth_files(
 ) """
 
 
-def process_depth_files_for_all_rDNA(Project_ID=None, root_dir=None):
+def save_average_depth_summaries(averages, output_dir, Project_ID="Not", output_format="csv"):
+    """
+    Saves one summary table per rDNA type, named like the tables of process_depth_files.
+
+    Parameters:
+    - averages (dict): {rDNA_type: {sample_id: average depth}}.
+    - output_dir (str): Directory to save results.
+    - Project_ID (str): The TCGA project
+    - output_format (str): 'csv' or 'parquet'.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    for rDNA_type, samples in averages.items():
+        results = [{"Sample": f"{base_name}_{rDNA_type}", "Average Depth": average} for base_name, average in samples.items()]
+
+        summary_path = os.path.join(output_dir, f"{rDNA_type}_all_{Project_ID}_average_depth.csv")
+        summary_path = write_rows(results, ["Sample", "Average Depth"], summary_path, output_format)
+        print(f"Processed average depth for {rDNA_type}. Summary saved to {summary_path}.")
+
+
+def process_depth_views(views, output_dir, Project_ID="Not", output_format="csv"):
+    """
+    Calculates average depth for every rDNA type from in-memory depth arrays, as returned by
+    split_depth_files.split_depth_views, and saves the same summary tables as process_depth_files.
+
+    Parameters:
+    - views (dict): {rDNA_type: {sample_id: (positions, depths)}}.
+    - output_dir (str): Directory to save results.
+    - Project_ID (str): The TCGA project
+    - output_format (str): 'csv' or 'parquet'.
+    """
+    averages = {
+        rDNA_type: {base_name: calculate_average_depth(depths) for base_name, (positions, depths) in samples.items()}
+        for rDNA_type, samples in views.items()
+    }
+    for rDNA_type, samples in views.items():
+        run_report.count(rDNA_type, samples=len(samples), positions=sum(len(depths) for _, depths in samples.values()))
+    save_average_depth_summaries(averages, output_dir, Project_ID, output_format)
+
+
+def process_depth_files_for_all_rDNA(Project_ID=None, root_dir=None, views=None, cache_file=None, output_format="csv",
+                                     prefetch_depth=0, read_size=PREFETCH_READ_SIZE, io_stats=None):
     """
     Processes depth files for all rDNA regions (45S, 18S, 5.8S, 28S) in the specified project directory.
 
     Parameters:
     - Project_ID (str): The TCGA project
     - root_dir (str): The root directory where the project data is stored.
+    - views (dict, optional): Depth arrays from split_depth_files.split_depth_views. If given,
+      averages are computed from them instead of re-reading the split depth files.
+    - cache_file (str, optional): SQLite aggregate cache passed to process_depth_files.
+    - output_format (str): 'csv' or 'parquet' summary tables.
+    - prefetch_depth, read_size, io_stats: read-ahead of the depth files, see process_depth_files.
     """
     if not Project_ID or not root_dir:
         raise ValueError("Project_ID and root_dir must be provided.")
@@ -153,9 +286,16 @@ def process_depth_files_for_all_rDNA(Project_ID=None, root_dir=None):
     #print(input_dir)
     #print(output_dir)
 
+    if views is not None:
+        process_depth_views(views, output_dir, Project_ID=Project_ID, output_format=output_format)
+        return
+
     # Process depth files for each rDNA region
     for rDNA_type in ['5S', '45S', '18S', '5.8S', '28S']:
-        process_depth_files(input_dir, output_dir, rDNA_type, Project_ID=Project_ID, save_plots=False)
+        with run_report.stage("average_depth", rDNA_type=rDNA_type):
+            process_depth_files(input_dir, output_dir, rDNA_type, Project_ID=Project_ID, save_plots=False, cache_file=cache_file,
+                                output_format=output_format, prefetch_depth=prefetch_depth, read_size=read_size,
+                                io_stats=io_stats)
         print(f"Processed average depth for {rDNA_type}.")
 
 # Example usage
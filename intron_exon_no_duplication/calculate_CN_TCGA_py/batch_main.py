@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import main as project_main
+from calculate_all_CN import SUMMARY_COLUMNS
+from table_io import TableWriter, iter_table_chunks, table_path
+
+# Input files of one project, as listed in Part 3 of the README
+BRD_FILES = ["blood_all_BRD.csv", "blood_chr13_14_15_21_22_exon_BRD.csv", "blood_chr1_exon_intron.csv"]
+
+
+def discover_projects(root_dir):
+    """Returns the project folders under root_dir that contain depth_results_blood, sorted."""
+    return sorted(
+        name for name in os.listdir(root_dir)
+        if os.path.isdir(os.path.join(root_dir, name, "depth_results_blood"))
+    )
+
+
+def stage_project_inputs(Project_ID, source_root, root_dir):
+    """
+    Replaces the manual copy of Part 3: links <source_root>/<Project_ID>/depth_results_blood and
+    copies the BRD CSVs of <source_root>/BRD_Results/<Project_ID> into <root_dir>/<Project_ID>.
+    """
+    project_dir = os.path.join(root_dir, Project_ID)
+    os.makedirs(project_dir, exist_ok=True)
+
+    depth_dir = os.path.join(project_dir, "depth_results_blood")
+    if not os.path.exists(depth_dir):
+        os.symlink(os.path.abspath(os.path.join(source_root, Project_ID, "depth_results_blood")), depth_dir)
+
+    for file_name in BRD_FILES:
+        source_path = os.path.join(source_root, "BRD_Results", Project_ID, file_name)
+        if os.path.exists(source_path):
+            shutil.copy2(source_path, os.path.join(project_dir, file_name))
+
+
+def run_project(Project_ID, root_dir, source_root=None, main_kwargs=None):
+    """
+    Runs split/average/CN for one project, logging its output to <root_dir>/logs/<Project_ID>.log.
+
+    Returns:
+    - dict: Project_ID, Status ('done' or 'failed'), Seconds, Samples, Log, Error.
+    """
+    log_dir = os.path.join(root_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, f"{Project_ID}.log")
+    start = time.time()
+    output_format = (main_kwargs or {}).get("output_format", "csv")
+    status = {"Project_ID": Project_ID, "Status": "done", "Seconds": 0.0, "Samples": 0, "Log": log_file, "Error": ""}
+
+    with open(log_file, 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        try:
+            if source_root:
+                stage_project_inputs(Project_ID, source_root, root_dir)
+            project_main.main(Project_ID, root_dir, **(main_kwargs or {}))
+            summary_file = table_path(os.path.join(root_dir, f"{Project_ID}_CN_all.csv"), output_format)
+            sample_IDs = set()
+            for chunk in iter_table_chunks(summary_file, columns=["Sample_ID"]):
+                sample_IDs.update(chunk["Sample_ID"].astype(str))
+            status["Samples"] = len(sample_IDs)
+        except Exception as error:
+            traceback.print_exc()
+            status["Status"] = "failed"
+            status["Error"] = f"{type(error).__name__}: {error}"
+
+    status["Seconds"] = round(time.time() - start, 1)
+    return status
+
+
+def main_batch(root_dir, Project_IDs=None, workers=4, source_root=None, main_kwargs=None):
+    """
+    Runs many projects in a bounded process pool and writes a pan-cancer CN table and a status report.
+
+    Parameters:
+    - root_dir (str): The root directory where the project data is stored, e.g. 'CN_results'.
+    - Project_IDs (list, optional): Projects to run. Defaults to every project folder under root_dir
+      (or under source_root if given) that contains depth_results_blood.
+    - workers (int): Number of projects processed at the same time.
+    - source_root (str, optional): Directory holding <Project_ID>/depth_results_blood and
+      BRD_Results/<Project_ID>; inputs are staged into root_dir before each run.
+    - main_kwargs (dict, optional): Options passed to main.main, e.g. {'use_views': True}.
+      With {'output_format': 'parquet'} the pan-cancer table is written as Parquet too.
+
+    Output files:
+    - '<root_dir>/pan_cancer_CN_all.csv': the <Project_ID>_CN_all.csv tables of all successful projects
+      ('.parquet' with output_format 'parquet'; the projects are then also in '<root_dir>/CN_all_parquet').
+      The project tables are appended chunk by chunk, so the pan-cancer table is never held in memory.
+    - '<root_dir>/batch_status.csv': one row per project with status, runtime, sample count and error,
+      plus a failed 'pan_cancer' row if the pan-cancer table could not be written.
+    """
+    os.makedirs(root_dir, exist_ok=True)
+    if not Project_IDs:
+        Project_IDs = discover_projects(source_root or root_dir)
+    print(f"Running {len(Project_IDs)} projects with {workers} workers: {' '.join(Project_IDs)}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_project, Project_ID, root_dir, source_root, main_kwargs) for Project_ID in Project_IDs]
+        statuses = []
+        for Project_ID, future in zip(Project_IDs, futures):
+            try:
+                status = future.result()
+            except Exception as error:
+                # e.g. BrokenProcessPool after a worker was killed (OOM); the other projects are still reported
+                status = {"Project_ID": Project_ID, "Status": "failed", "Seconds": 0.0, "Samples": 0,
+                          "Log": os.path.join(root_dir, "logs", f"{Project_ID}.log"),
+                          "Error": f"{type(error).__name__}: {error}"}
+            statuses.append(status)
+            print(f"{status['Project_ID']}: {status['Status']} in {status['Seconds']} s {status['Error']}")
+
+    status_file = os.path.join(root_dir, "batch_status.csv")
+    pd.DataFrame(statuses).to_csv(status_file, index=False)
+    print(f"Status report saved to {status_file}")
+
+    output_format = (main_kwargs or {}).get("output_format", "csv")
+    summary_files = [
+        table_path(os.path.join(root_dir, f"{status['Project_ID']}_CN_all.csv"), output_format)
+        for status in statuses if status["Status"] == "done"
+    ]
+    if summary_files:
+        start = time.time()
+        pan_cancer_file = table_path(os.path.join(root_dir, "pan_cancer_CN_all.csv"), output_format)
+        try:
+            with TableWriter(pan_cancer_file, SUMMARY_COLUMNS, output_format) as writer:
+                for summary_file in summary_files:
+                    for chunk in iter_table_chunks(summary_file):
+                        writer.write_frame(chunk)
+            print(f"Pan-cancer copy number results saved to {writer.path}")
+        except Exception as error:
+            # the projects are done, but the run is not: the failure is added to the status report
+            traceback.print_exc()
+            if os.path.exists(pan_cancer_file):
+                os.remove(pan_cancer_file)
+            statuses.append({"Project_ID": "pan_cancer", "Status": "failed", "Seconds": round(time.time() - start, 1),
+                             "Samples": 0, "Log": "", "Error": f"{type(error).__name__}: {error}"})
+            pd.DataFrame(statuses).to_csv(status_file, index=False)
+            print(f"Pan-cancer table {pan_cancer_file} failed: {type(error).__name__}: {error}; see {status_file}")
+
+    failed = [status["Project_ID"] for status in statuses if status["Status"] != "done"]
+    if failed:
+        print(f"Failed projects: {' '.join(failed)}")
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate rDNA copy number for many TCGA projects.")
+    parser.add_argument("root_dir", help="the root directory where the project data is stored, e.g. CN_results")
+    parser.add_argument("Project_IDs", nargs="*", help="projects to run; default: discover them under root_dir or --source_root")
+    parser.add_argument("--workers", type=int, default=4, help="number of projects processed at the same time")
+    parser.add_argument("--source_root", help="directory with <Project_ID>/depth_results_blood and BRD_Results/<Project_ID>")
+    parser.add_argument("--views", action="store_true", help="see main.py")
+    parser.add_argument("--regions", nargs="?", const=project_main.rDNA_regions.DEFAULT_REGION_FILE, default=None, help="see main.py")
+    parser.add_argument("--incremental", action="store_true", help="see main.py")
+    parser.add_argument("--force", action="store_true", help="see main.py")
+    parser.add_argument("--cache", action="store_true", help="see main.py")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="see main.py")
+    parser.add_argument("--stream", action="store_true", help="see main.py")
+    parser.add_argument("--prefetch", type=int, nargs="?", const=project_main.prefetch_io.PREFETCH_DEPTH, default=0, help="see main.py")
+    parser.add_argument("--read_size", type=float, default=project_main.prefetch_io.PREFETCH_READ_SIZE / 1024 / 1024, help="see main.py")
+    parser.add_argument("--report", action="store_true", help="save <Project_ID>/run_report.json for every project, see main.py")
+    args = parser.parse_args()
+
+    statuses = main_batch(args.root_dir, args.Project_IDs, workers=args.workers, source_root=args.source_root,
+                          main_kwargs={"use_views": args.views, "region_file": args.regions, "incremental": args.incremental,
+                                       "force": args.force, "use_cache": args.cache, "output_format": args.format,
+                                       "stream": args.stream, "prefetch_depth": args.prefetch,
+                                       "read_size": int(args.read_size * 1024 * 1024),
+                                       "report_file": "" if args.report else None})
+    sys.exit(1 if any(status["Status"] != "done" for status in statuses) else 0)
+
+# Example usage:
+#python calculate_CN_TCGA_py/batch_main.py CN_results --source_root . --workers 16 --views
+#python calculate_CN_TCGA_py/batch_main.py CN_results TCGA-BLCA TCGA-LUSC --workers 2
@@ -0,0 +1,485 @@
+import os
+import re
+import sys
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from depth_binary import is_depth_binary, read_depth_binary, iter_depth_text_chunks
+from depth_text import DEPTH_FILE_EXTS, depth_file_stem
+
+# BED-aware aggregation of the BRD depth files of 2.1.
+#
+# `samtools depth -a -b <bed>` writes every position of the merged BED intervals once, without
+# saying which interval it belongs to. The intervals of one BED file are cut at all their start
+# and end points into disjoint "atoms", sorted per contig; every interval is a contiguous range of
+# atoms. One streaming pass over a depth file sums the depth of every atom (searchsorted on the
+# sorted atom starts/ends), and any union of intervals - one interval, a gene, all exons minus
+# CNA segments - is then a sum over its atoms, each position counted once per BED file, like the
+# depth files themselves. Atom sums of all samples are kept in '<label>_atom_sums.npz'.
+
+_NAME = re.compile(r"^(.+?)_(exon|intron)_")
+
+# BED intervals of one or more BED files, in file order. source: index into the list of BED names;
+# atom_first/atom_last: range of the interval's atoms in the BedIndex
+BedIntervals = namedtuple("BedIntervals", ["source", "contig", "start", "end", "name", "gene", "feature"])
+# sources: BED names (e.g. 'chr1_exon'); atoms: source, contig, start, end arrays (0-based, half-open);
+# spans: {(source, contig): (first atom, last atom + 1)}
+BedIndex = namedtuple("BedIndex", ["sources", "intervals", "atom_source", "atom_contig", "atom_start", "atom_end",
+                                   "atom_first", "atom_last", "spans"])
+
+
+def read_bed_intervals(bed_files):
+    """
+    Reads BED files, keeping every interval (overlaps are not merged). An interval with end < start
+    raises ValueError; zero-length intervals (start == end) are kept.
+
+    Parameters:
+    - bed_files (list): Paths to BED files, e.g. intron_exon_no_duplication/chr1_exon.bed.
+
+    Returns:
+    - tuple: (BED names, BedIntervals). The gene of 'NM_001005484_exon_0_0_chr1_69091_f' is
+      'NM_001005484' and its feature 'exon'; other names are their own gene.
+    """
+    sources = []
+    rows = []
+    for source, bed_file in enumerate(bed_files):
+        sources.append(os.path.basename(bed_file)[:-len(".bed")])
+        with open(bed_file, 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                    continue
+                parts = line.rstrip('\n').split('\t')
+                if int(parts[2]) < int(parts[1]):
+                    raise ValueError(f"{bed_file}:{line_number}: interval ends before it starts ({parts[1]} > {parts[2]})")
+                name = parts[3] if len(parts) > 3 else f"{parts[0]}:{parts[1]}-{parts[2]}"
+                match = _NAME.match(name)
+                gene, feature = (match.group(1), match.group(2)) if match else (name, "")
+                rows.append((source, parts[0], int(parts[1]), int(parts[2]), name, gene, feature))
+
+    columns = list(zip(*rows)) if rows else [()] * 7
+    intervals = BedIntervals(
+        np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype=str),
+        np.array(columns[2], dtype=np.int64), np.array(columns[3], dtype=np.int64),
+        np.array(columns[4], dtype=str), np.array(columns[5], dtype=str), np.array(columns[6], dtype=str))
+    return sources, intervals
+
+
+def build_bed_index(bed_files):
+    """
+    Builds the atom index of BED files (see the module comment). Zero-length intervals get no atoms
+    (atom_first == atom_last), so all their sums are 0.
+
+    Returns:
+    - BedIndex
+    """
+    sources, intervals = read_bed_intervals(bed_files)
+    atom_source, atom_contig, atom_start, atom_end = [], [], [], []
+    atom_first = np.zeros(len(intervals.start), dtype=np.int64)
+    atom_last = np.zeros(len(intervals.start), dtype=np.int64)
+    spans = {}
+    n_atoms = 0
+    nonempty = intervals.end > intervals.start
+
+    for source in range(len(sources)):
+        for contig in sorted(set(intervals.contig[(intervals.source == source) & nonempty])):
+            rows = np.flatnonzero((intervals.source == source) & (intervals.contig == contig) & nonempty)
+            starts, ends = intervals.start[rows], intervals.end[rows]
+            boundaries = np.unique(np.concatenate((starts, ends)))
+            # Number of intervals covering each segment [boundaries[i], boundaries[i + 1])
+            steps = (np.bincount(np.searchsorted(boundaries, starts), minlength=len(boundaries))
+                     - np.bincount(np.searchsorted(boundaries, ends), minlength=len(boundaries)))
+            covered = np.cumsum(steps)[:-1] > 0
+            atom_of_segment = np.cumsum(covered) - 1 + n_atoms
+
+            segments = np.flatnonzero(covered)
+            atom_source.append(np.full(len(segments), source))
+            atom_contig.append(np.full(len(segments), contig, dtype=object))
+            atom_start.append(boundaries[segments])
+            atom_end.append(boundaries[segments + 1])
+            # Every segment inside an interval is covered, so its atoms are contiguous
+            atom_first[rows] = atom_of_segment[np.searchsorted(boundaries, starts)]
+            atom_last[rows] = atom_of_segment[np.searchsorted(boundaries, ends) - 1] + 1
+            spans[(source, contig)] = (n_atoms, n_atoms + len(segments))
+            n_atoms += len(segments)
+
+    def join(arrays, dtype):
+        return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+
+    return BedIndex(sources, intervals, join(atom_source, np.int64), join(atom_contig, str),
+                    join(atom_start, np.int64), join(atom_end, np.int64), atom_first, atom_last, spans)
+
+
+def _add_positions(sums, counts, index, span, positions, depths):
+    """Adds depths at sorted 1-based positions of one contig to the atoms of span."""
+    # An atom [start, end) covers positions start + 1..end
+    lo = span[0] + np.searchsorted(index.atom_end[span[0]:span[1]], positions[0], side='left')
+    hi = span[0] + np.searchsorted(index.atom_start[span[0]:span[1]], positions[-1], side='left')
+    if lo >= hi:
+        return
+    cumulative = np.concatenate(([0], np.cumsum(depths, dtype=np.int64)))
+    first = np.searchsorted(positions, index.atom_start[lo:hi], side='right')
+    last = np.searchsorted(positions, index.atom_end[lo:hi], side='right')
+    sums[lo:hi] += cumulative[last] - cumulative[first]
+    counts[lo:hi] += last - first
+
+
+def atom_depth_sums(file_path, index, source):
+    """
+    Sums the depth of a depth file (text or '.dbin') over the atoms of its BED file, in one streaming
+    pass: every text chunk (or binary block) is matched to the atoms with searchsorted.
+
+    Parameters:
+    - file_path (str): Depth file of `samtools depth -a -b <bed>`.
+    - index (BedIndex): Index of the BED files.
+    - source (int): Index of the file's BED in index.sources.
+
+    Returns:
+    - tuple: (sums, counts) int64 arrays over all atoms of the index (zero outside this BED);
+      counts is the number of positions found in each atom.
+    """
+    n_atoms = len(index.atom_start)
+    sums = np.zeros(n_atoms, dtype=np.int64)
+    counts = np.zeros(n_atoms, dtype=np.int64)
+
+    if is_depth_binary(file_path):
+        for block in read_depth_binary(file_path):
+            span = index.spans.get((source, block.contig))
+            if span is None or len(block.depths) == 0:
+                continue
+            # Positions of a block are consecutive: atoms are cut out of its cumulative sum directly
+            a = block.start
+            lo = span[0] + np.searchsorted(index.atom_end[span[0]:span[1]], a, side='left')
+            hi = span[0] + np.searchsorted(index.atom_start[span[0]:span[1]], a + len(block.depths) - 1, side='left')
+            if lo >= hi:
+                continue
+            cumulative = np.concatenate(([0], np.cumsum(block.depths, dtype=np.int64)))
+            first = np.clip(index.atom_start[lo:hi] + 1 - a, 0, len(block.depths))
+            last = np.clip(index.atom_end[lo:hi] + 1 - a, 0, len(block.depths))
+            sums[lo:hi] += cumulative[last] - cumulative[first]
+            counts[lo:hi] += last - first
+        return sums, counts
+
+    for contigs, positions, depths in iter_depth_text_chunks(file_path):
+        breaks = np.flatnonzero(contigs[1:] != contigs[:-1]) + 1
+        for first, last in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(positions)]))):
+            span = index.spans.get((source, contigs[first]))
+            if span is not None:
+                _add_positions(sums, counts, index, span, positions[first:last], depths[first:last])
+    return sums, counts
+
+
+def _sample_atom_sums(index, sample_files):
+    sums = np.zeros(len(index.atom_start), dtype=np.int64)
+    counts = np.zeros(len(index.atom_start), dtype=np.int64)
+    for source, file_path in sample_files:
+        file_sums, file_counts = atom_depth_sums(file_path, index, source)
+        sums += file_sums
+        counts += file_counts
+    return sums, counts
+
+
+def collect_atom_sums(root_dir, bed_dir, workers=1):
+    """
+    Atom sums of every sample of a BRD depth tree (one folder per sample with
+    '<sample>_<bed name>_depth.txt' files, as written by 2.1).
+
+    Parameters:
+    - root_dir (str): Directory with one folder of depth files per sample.
+    - bed_dir (str): Directory with the BED files used by 2.1.
+    - workers (int): Number of samples parsed in parallel.
+
+    Returns:
+    - tuple: (BedIndex, dict with 'Sample_ID', 'sources', 'sums' and 'counts' (n samples x atoms)).
+      Atoms of BED files without a depth file in a sample have count 0.
+    """
+    bed_files = sorted(os.path.join(bed_dir, f) for f in os.listdir(bed_dir) if f.endswith(".bed"))
+    index = build_bed_index(bed_files)
+    source_of = {f"{source}_depth": i for i, source in enumerate(index.sources)}
+
+    samples = []
+    tasks = []
+    for sample_id in sorted(os.listdir(root_dir)):
+        sample_dir = os.path.join(root_dir, sample_id)
+        if not os.path.isdir(sample_dir):
+            continue
+        sample_files = []
+        for file_name in sorted(os.listdir(sample_dir)):
+            core_name = depth_file_stem(file_name.replace(f"{sample_id}_", ""))
+            if file_name.endswith(DEPTH_FILE_EXTS) and core_name in source_of:
+                sample_files.append((source_of[core_name], os.path.join(sample_dir, file_name)))
+        samples.append(sample_id)
+        tasks.append(sample_files)
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(_sample_atom_sums, [index] * len(tasks), tasks))
+    else:
+        parsed = [_sample_atom_sums(index, sample_files) for sample_files in tasks]
+
+    n_atoms = len(index.atom_start)
+    atom_sums = {
+        "Sample_ID": np.array(samples, dtype=str),
+        "sources": np.array(index.sources, dtype=str),
+        "sums": np.vstack([sums for sums, _ in parsed]) if parsed else np.zeros((0, n_atoms), dtype=np.int64),
+        "counts": np.vstack([counts for _, counts in parsed]) if parsed else np.zeros((0, n_atoms), dtype=np.int64)
+    }
+    return index, atom_sums
+
+
+def save_atom_sums(atom_sums, output_file):
+    """Saves atom sums (see collect_atom_sums) as a compressed '.npz' file."""
+    np.savez_compressed(output_file, **atom_sums)
+    return output_file
+
+
+def load_atom_sums(input_file, bed_dir):
+    """
+    Loads atom sums saved by save_atom_sums and rebuilds the index of the same BED files.
+
+    Returns:
+    - tuple: (BedIndex, atom sums dict)
+    """
+    with np.load(input_file) as data:
+        atom_sums = {key: data[key] for key in data.files}
+    bed_files = [os.path.join(bed_dir, f"{source}.bed") for source in atom_sums["sources"]]
+    index = build_bed_index(bed_files)
+    if atom_sums["sums"].shape[1] != len(index.atom_start):
+        raise ValueError(f"The BED files in {bed_dir} do not match the atoms of {input_file}.")
+    return index, atom_sums
+
+
+def group_sums(values, index, interval_groups, n_groups):
+    """
+    Sums atom values over groups of intervals, counting every atom once per group.
+
+    Parameters:
+    - values (np.ndarray): n samples x atoms (atom sums or counts).
+    - index (BedIndex)
+    - interval_groups (np.ndarray): Group number of every interval, -1 for intervals in no group.
+    - n_groups (int): Number of groups.
+
+    Returns:
+    - np.ndarray: n samples x n_groups.
+    """
+    selected = np.flatnonzero(interval_groups >= 0)
+    lengths = index.atom_last[selected] - index.atom_first[selected]
+    # (group, atom) pairs of all selected intervals, without repeats
+    groups = np.repeat(interval_groups[selected], lengths)
+    atoms = np.repeat(index.atom_first[selected] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    pairs = np.unique(np.stack((groups, atoms)), axis=1) if len(groups) else np.zeros((2, 0), dtype=np.int64)
+
+    result = np.zeros((values.shape[0], n_groups), dtype=values.dtype)
+    if pairs.shape[1]:
+        starts = np.flatnonzero(np.concatenate(([True], pairs[0, 1:] != pairs[0, :-1])))
+        result[:, pairs[0, starts]] = np.add.reduceat(values[:, pairs[1]], starts, axis=1)
+    return result
+
+
+def interval_sums(values, index):
+    """Sums atom values over every interval: n samples x intervals."""
+    cumulative = np.concatenate((np.zeros((values.shape[0], 1), dtype=values.dtype), np.cumsum(values, axis=1)), axis=1)
+    return cumulative[:, index.atom_last] - cumulative[:, index.atom_first]
+
+
+def overlapping_intervals(index, bed_file):
+    """Boolean mask of the intervals that overlap any region of bed_file (e.g. CNA segments, low mappability)."""
+    _, regions = read_bed_intervals([bed_file])
+    mask = np.zeros(len(index.intervals.start), dtype=bool)
+    for contig in set(regions.contig):
+        rows = np.flatnonzero(index.intervals.contig == contig)
+        order = np.argsort(regions.start[regions.contig == contig])
+        region_starts = regions.start[regions.contig == contig][order]
+        # Running maximum of the region ends: a region ending after x starts before the first index where it exceeds x
+        region_ends = np.maximum.accumulate(regions.end[regions.contig == contig][order])
+        before_end = np.searchsorted(region_starts, index.intervals.end[rows], side='left')  # regions starting before the interval ends
+        after_start = np.searchsorted(region_ends, index.intervals.start[rows], side='right')  # first region ending after its start
+        mask[rows] = after_start < before_end
+    return mask
+
+
+def select_intervals(index, sources=None, genes=None, features=None, exclude_bed=None):
+    """
+    Boolean mask of the intervals in the given BED files, genes and features, minus those overlapping exclude_bed.
+
+    Parameters:
+    - sources (list, optional): BED names, e.g. ['chr13_exon', 'chr14_exon'] or depth file names like 'chr13_exon_depth'.
+    - genes (list, optional): Genes (transcript accessions of the BED names), e.g. ['NM_001005484'].
+    - features (list, optional): 'exon' and/or 'intron'.
+    - exclude_bed (str, optional): BED of regions to leave out.
+    """
+    intervals = index.intervals
+    mask = np.ones(len(intervals.start), dtype=bool)
+    if sources is not None:
+        names = {source[:-len("_depth")] if source.endswith("_depth") else source for source in sources}
+        mask &= np.isin(intervals.source, [i for i, source in enumerate(index.sources) if source in names])
+    if genes is not None:
+        mask &= np.isin(intervals.gene, list(genes))
+    if features is not None:
+        mask &= np.isin(intervals.feature, list(features))
+    if exclude_bed:
+        mask &= ~overlapping_intervals(index, exclude_bed)
+    return mask
+
+
+def write_interval_tables(index, atom_sums, output_dir, label="blood", output_format="csv"):
+    """
+    Writes the per-interval and per-gene depth tables of every sample.
+
+    Output files:
+    - '<label>_interval_depth.csv': Sample_ID, Depth_File, name, contig, start, end, gene, feature,
+      Total_Depth, Length, Average_Depth, Label (one row per sample and BED interval).
+    - '<label>_gene_depth.csv': Sample_ID, Depth_File, gene, feature, Total_Depth, Length, Average_Depth,
+      Label (one row per sample, BED file and gene; positions shared by intervals of a gene count once).
+    """
+    import pandas as pd
+    from table_io import write_table
+
+    os.makedirs(output_dir, exist_ok=True)
+    intervals = index.intervals
+    samples = atom_sums["Sample_ID"]
+    n_intervals = len(intervals.start)
+    depth_files = np.array([f"{source}_depth" for source in index.sources], dtype=str)
+
+    totals = interval_sums(atom_sums["sums"], index)
+    lengths = interval_sums(atom_sums["counts"], index)
+    table = pd.DataFrame({
+        "Sample_ID": np.repeat(samples, n_intervals),
+        "Depth_File": np.tile(depth_files[intervals.source], len(samples)),
+        "name": np.tile(intervals.name, len(samples)),
+        "contig": np.tile(intervals.contig, len(samples)),
+        "start": np.tile(intervals.start, len(samples)),
+        "end": np.tile(intervals.end, len(samples)),
+        "gene": np.tile(intervals.gene, len(samples)),
+        "feature": np.tile(intervals.feature, len(samples)),
+        "Total_Depth": totals.ravel(),
+        "Length": lengths.ravel()
+    })
+    table["Average_Depth"] = (table["Total_Depth"] / table["Length"].where(table["Length"] > 0)).fillna(0).round(3)
+    table["Label"] = label
+    interval_file = write_table(table, os.path.join(output_dir, f"{label}_interval_depth.csv"), output_format)
+    print(f"Per-interval depth saved to {interval_file}")
+
+    # One group per (BED file, gene)
+    keys = pd.MultiIndex.from_arrays([intervals.source, intervals.gene])
+    group_of_interval, group_keys = pd.factorize(keys)
+    group_totals = group_sums(atom_sums["sums"], index, group_of_interval, len(group_keys))
+    group_lengths = group_sums(atom_sums["counts"], index, group_of_interval, len(group_keys))
+    features = pd.Series(intervals.feature).groupby(group_of_interval).first().to_numpy()
+    group_sources = np.array([source for source, _ in group_keys], dtype=np.int64)
+    genes = np.array([gene for _, gene in group_keys], dtype=str)
+    table = pd.DataFrame({
+        "Sample_ID": np.repeat(samples, len(group_keys)),
+        "Depth_File": np.tile(depth_files[group_sources], len(samples)),
+        "gene": np.tile(genes, len(samples)),
+        "feature": np.tile(features, len(samples)),
+        "Total_Depth": group_totals.ravel(),
+        "Length": group_lengths.ravel()
+    })
+    table["Average_Depth"] = (table["Total_Depth"] / table["Length"].where(table["Length"] > 0)).fillna(0).round(3)
+    table["Label"] = label
+    gene_file = write_table(table, os.path.join(output_dir, f"{label}_gene_depth.csv"), output_format)
+    print(f"Per-gene depth saved to {gene_file}")
+
+
+def subset_BRD(index, atom_sums, mask, output_file, label="blood", custom_label="subset", interval_file=None,
+               output_format="csv"):
+    """
+    Writes the BRD of a subset of BED intervals, in the format of the 2.2 BRD CSVs, so it can replace
+    blood_chr13_14_15_21_22_exon_BRD.csv or blood_chr1_exon_intron.csv in calculate_copy_number.
+
+    Parameters:
+    - index (BedIndex), atom_sums (dict): As returned by collect_atom_sums or load_atom_sums.
+    - mask (np.ndarray): Boolean mask of the intervals, see select_intervals.
+    - output_file (str): BRD table path.
+    - label (str), custom_label (str): Label and Depth_File written to every row.
+    - interval_file (str, optional): Also save the per-interval sums of the subset for brd_stats.py
+      (robust BRD and bootstrap intervals over the BED intervals).
+    - output_format (str): 'csv' or 'parquet'.
+    """
+    import pandas as pd
+    from table_io import write_table
+
+    groups = np.where(mask, 0, -1)
+    total_depth = group_sums(atom_sums["sums"], index, groups, 1)[:, 0]
+    total_length = group_sums(atom_sums["counts"], index, groups, 1)[:, 0]
+    average = np.divide(total_depth, total_length, out=np.zeros(len(total_depth)), where=total_length > 0)
+    table = pd.DataFrame({
+        "Sample_ID": atom_sums["Sample_ID"],
+        "Depth_File": custom_label,
+        "Average_Depth": np.round(average, 3),
+        "Length": total_length,
+        "Label": label
+    })
+    output_file = write_table(table, output_file, output_format)
+    print(f"BRD of {int(mask.sum())} intervals saved to {output_file}")
+
+    if interval_file:
+        from brd_stats import save_interval_sums
+
+        rows = np.flatnonzero(mask)
+        lengths = interval_sums(atom_sums["counts"], index)[:, rows]
+        keep = lengths.min(axis=0) > 0 if len(lengths) else np.zeros(len(rows), dtype=bool)
+        save_interval_sums({
+            "Sample_ID": atom_sums["Sample_ID"],
+            "contig": index.intervals.contig[rows][keep],
+            "start": index.intervals.start[rows][keep] + 1,
+            "length": lengths[0, keep] if len(lengths) else np.zeros(0, dtype=np.int64),
+            "sums": interval_sums(atom_sums["sums"], index)[:, rows][:, keep]
+        }, interval_file)
+        print(f"Interval sums of the subset saved to {interval_file}")
+    return output_file
+
+
+def _read_list(path):
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-interval and per-gene BRD from the depth files of 2.1.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    collect = subparsers.add_parser("collect", help="atom sums of a BRD depth tree, per-interval and per-gene tables")
+    collect.add_argument("root_dir", help="e.g. TCGA-BLCA/depth_results_exon_intron_blood_no_duplication")
+    collect.add_argument("output_dir", help="e.g. BRD_Results/TCGA-BLCA")
+    collect.add_argument("--bed_dir", default="intron_exon_no_duplication")
+    collect.add_argument("--label", default="blood")
+    collect.add_argument("--workers", type=int, default=1)
+    collect.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    collect.add_argument("--no_tables", action="store_true", help="only save <label>_atom_sums.npz")
+
+    subset = subparsers.add_parser("subset", help="BRD table of a subset of BED intervals")
+    subset.add_argument("atom_sums", help="<label>_atom_sums.npz written by collect")
+    subset.add_argument("output_file", help="BRD table, e.g. BRD_Results/TCGA-BLCA/blood_acro_exon_noCNA_BRD.csv")
+    subset.add_argument("--bed_dir", default="intron_exon_no_duplication")
+    subset.add_argument("--bed_names", nargs="+", help="BED files to use, e.g. chr13_exon chr14_exon")
+    subset.add_argument("--genes", help="file with one gene (transcript accession) per line")
+    subset.add_argument("--features", nargs="+", choices=["exon", "intron"])
+    subset.add_argument("--exclude", help="BED of regions to leave out, e.g. CNA segments")
+    subset.add_argument("--label", default="blood")
+    subset.add_argument("--custom_label", default="subset", help="Depth_File written to every row")
+    subset.add_argument("--interval_file", help="also save the subset's interval sums for brd_stats.py")
+    subset.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        if not os.path.isdir(args.root_dir):
+            print(f"Depth directory not found: {args.root_dir}")
+            sys.exit(1)
+        os.makedirs(args.output_dir, exist_ok=True)
+        index, atom_sums = collect_atom_sums(args.root_dir, args.bed_dir, args.workers)
+        output_file = save_atom_sums(atom_sums, os.path.join(args.output_dir, f"{args.label}_atom_sums.npz"))
+        print(f"Saved {len(index.atom_start)} atoms of {len(atom_sums['Sample_ID'])} samples to {output_file}")
+        if not args.no_tables:
+            write_interval_tables(index, atom_sums, args.output_dir, args.label, args.format)
+    else:
+        index, atom_sums = load_atom_sums(args.atom_sums, args.bed_dir)
+        mask = select_intervals(index, args.bed_names, _read_list(args.genes) if args.genes else None,
+                                args.features, args.exclude)
+        subset_BRD(index, atom_sums, mask, args.output_file, args.label, args.custom_label, args.interval_file, args.format)
+
+# Example usage:
+#python calculate_CN_TCGA_py/bed_index.py collect TCGA-BLCA/depth_results_exon_intron_blood_no_duplication BRD_Results/TCGA-BLCA --workers 8 --format parquet
+# 45S BRD without the exons in CNA segments:
+#python calculate_CN_TCGA_py/bed_index.py subset BRD_Results/TCGA-BLCA/blood_atom_sums.npz BRD_Results/TCGA-BLCA/blood_acro_exon_noCNA_BRD.csv --bed_names chr13_exon chr14_exon chr15_exon chr21_exon chr22_exon --exclude cna_segments.bed --custom_label chr13_14_15_21_22_exon
@@ -0,0 +1,354 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from depth_binary import is_depth_binary, read_depth_binary, iter_depth_text_runs
+from depth_text import depth_file_stem
+from table_io import list_tables, read_table, write_table
+
+# Robust background read depth (BRD) and copy number confidence intervals.
+#
+# The BRD of calculate_copy_number is the length-weighted mean depth of thousands of exon/intron
+# intervals, so a few intervals in segmental duplications or tumor CNAs can move it. Here every
+# interval keeps its own depth sum (an interval is a run of consecutive positions in the
+# `samtools depth -a -b` output, i.e. a merged BED interval), and the BRD is also computed as the
+# median and the trimmed mean of the interval mean depths. Confidence intervals come from a
+# bootstrap over intervals that draws the same resamples for all samples, so every replicate of
+# every sample is one matrix product (mean) or one sort (median, trimmed mean).
+#
+# The copy number intervals treat the rDNA average depth as fixed: CN CI = rDNA depth / BRD CI.
+
+STATISTICS = ("mean", "median", "trimmed_mean")
+TRIM = 0.1
+N_BOOT = 1000
+CONFIDENCE = 0.95
+# Elements (samples x replicates x intervals) held at once by the median/trimmed mean bootstrap
+MAX_ELEMENTS = 20_000_000
+
+# BRD groups of calculate_CN_TCGA_py and their depth files (standard_BRD_groups of batch_BRD_average_results.py)
+BRD_GROUPS = {
+    "chr13_14_15_21_22_exon": ["chr13_exon_depth", "chr14_exon_depth", "chr15_exon_depth", "chr21_exon_depth", "chr22_exon_depth"],
+    "chr1_exon_intron": ["chr1_intron_depth", "chr1_exon_depth"]
+}
+
+
+def depth_run_sums(file_path):
+    """
+    Depth sum of every run of consecutive positions of a depth file (text or '.dbin'), streaming.
+
+    Returns:
+    - tuple: (contigs list, starts np.ndarray, lengths np.ndarray, sums np.ndarray), 1-based starts.
+    """
+    runs = []  # [contig, start, length, sum]
+    if is_depth_binary(file_path):
+        pieces = ((block.contig, block.start, block.depths) for block in read_depth_binary(file_path))
+    else:
+        pieces = iter_depth_text_runs(file_path)
+
+    for contig, start, depths in pieces:
+        total = int(depths.sum(dtype=np.uint64))
+        if runs and runs[-1][0] == contig and runs[-1][1] + runs[-1][2] == start:
+            runs[-1][2] += len(depths)
+            runs[-1][3] += total
+        else:
+            runs.append([contig, start, len(depths), total])
+
+    return ([run[0] for run in runs], np.array([run[1] for run in runs], dtype=np.int64),
+            np.array([run[2] for run in runs], dtype=np.int64), np.array([run[3] for run in runs], dtype=np.int64))
+
+
+def _sample_interval_sums(file_paths):
+    contigs, starts, lengths, sums = [], [], [], []
+    for file_path in file_paths:
+        file_contigs, file_starts, file_lengths, file_sums = depth_run_sums(file_path)
+        contigs.extend(file_contigs)
+        starts.append(file_starts)
+        lengths.append(file_lengths)
+        sums.append(file_sums)
+    if not contigs:
+        empty = np.zeros(0, dtype=np.int64)
+        return [], empty, empty, empty
+    return contigs, np.concatenate(starts), np.concatenate(lengths), np.concatenate(sums)
+
+
+def collect_interval_sums(root_dir, selected_files, workers=1):
+    """
+    Per-interval depth sums of the selected depth files of every sample of a BRD depth tree
+    (one folder of depth files per sample, as written by 2.1).
+
+    Parameters:
+    - root_dir (str): Directory with one folder of depth files per sample.
+    - selected_files (list): Depth files of the group, e.g. ['chr1_intron_depth', 'chr1_exon_depth'].
+    - workers (int): Number of samples parsed in parallel.
+
+    Returns:
+    - dict: 'Sample_ID' (n), 'contig', 'start', 'length' (k intervals) and 'sums' (n x k int64).
+      Samples whose intervals differ from the first sample's are skipped with a message.
+    """
+    samples = []
+    sample_files = []
+    for sample_id in sorted(os.listdir(root_dir)):
+        sample_dir = os.path.join(root_dir, sample_id)
+        if not os.path.isdir(sample_dir):
+            continue
+        files = {depth_file_stem(file_name.replace(f"{sample_id}_", "")): os.path.join(sample_dir, file_name)
+                 for file_name in sorted(os.listdir(sample_dir))}
+        file_paths = [files[core_name] for core_name in selected_files if core_name in files]
+        if len(file_paths) < len(selected_files):
+            print(f"Skipping {sample_id}: missing depth files of {', '.join(selected_files)}")
+            continue
+        samples.append(sample_id)
+        sample_files.append(file_paths)
+
+    if workers > 1 and len(sample_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(_sample_interval_sums, sample_files))
+    else:
+        parsed = [_sample_interval_sums(file_paths) for file_paths in sample_files]
+
+    kept, rows = [], []
+    contigs = starts = lengths = None
+    for sample_id, (sample_contigs, sample_starts, sample_lengths, sample_sums) in zip(samples, parsed):
+        if contigs is None:
+            contigs, starts, lengths = sample_contigs, sample_starts, sample_lengths
+        elif (sample_contigs != contigs or not np.array_equal(sample_starts, starts)
+              or not np.array_equal(sample_lengths, lengths)):
+            print(f"Skipping {sample_id}: its depth intervals differ from those of {kept[0]}")
+            continue
+        kept.append(sample_id)
+        rows.append(sample_sums)
+
+    empty = np.zeros(0, dtype=np.int64)
+    return {
+        "Sample_ID": np.array(kept, dtype=str),
+        "contig": np.array(contigs or [], dtype=str),
+        "start": empty if starts is None else starts,
+        "length": empty if lengths is None else lengths,
+        "sums": np.vstack(rows) if rows else np.zeros((0, 0), dtype=np.int64)
+    }
+
+
+def save_interval_sums(interval_sums, output_file):
+    """Saves per-interval sums (see collect_interval_sums) as a compressed '.npz' file."""
+    np.savez_compressed(output_file, **interval_sums)
+    return output_file
+
+
+def load_interval_sums(input_file):
+    """Loads per-interval sums saved by save_interval_sums."""
+    with np.load(input_file) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _trimmed_mean(values, trim, axis=-1):
+    """Mean of values along axis without the lowest and highest `trim` fraction."""
+    k = values.shape[axis]
+    cut = int(k * trim)
+    ordered = np.sort(values, axis=axis)
+    return np.take(ordered, np.arange(cut, k - cut), axis=axis).mean(axis=axis)
+
+
+def robust_BRD(sums, lengths, trim=TRIM):
+    """
+    BRD of every sample from per-interval sums.
+
+    Parameters:
+    - sums (np.ndarray): n samples x k intervals depth sums.
+    - lengths (np.ndarray): k interval lengths.
+    - trim (float): Fraction of intervals cut at each end by the trimmed mean.
+
+    Returns:
+    - dict: {'mean': length-weighted mean (the BRD of calculate_copy_number),
+             'median': median of the interval mean depths, 'trimmed_mean': trimmed mean of them}
+    """
+    means = sums / lengths
+    return {
+        "mean": sums.sum(axis=1) / lengths.sum(),
+        "median": np.median(means, axis=1),
+        "trimmed_mean": _trimmed_mean(means, trim)
+    }
+
+
+def bootstrap_BRD(sums, lengths, statistic="mean", n_boot=N_BOOT, confidence=CONFIDENCE, trim=TRIM, seed=0):
+    """
+    Bootstrap confidence interval of the BRD of every sample, resampling intervals.
+    All samples share the same resamples, so each batch of replicates is computed for all samples at once.
+
+    Parameters:
+    - sums (np.ndarray): n samples x k intervals depth sums.
+    - lengths (np.ndarray): k interval lengths.
+    - statistic (str): 'mean', 'median' or 'trimmed_mean', see robust_BRD.
+    - n_boot (int): Number of bootstrap replicates.
+    - confidence (float): Confidence level of the percentile interval.
+    - trim (float): Trim fraction of the trimmed mean.
+    - seed (int): Seed of the random generator, for reproducible intervals.
+
+    Returns:
+    - tuple: (low, high) np.ndarrays with one value per sample.
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f"Unknown statistic: {statistic}")
+    rng = np.random.default_rng(seed)
+    n, k = sums.shape
+    replicates = np.empty((n, n_boot))
+
+    if statistic == "mean":
+        # A resample is a vector of interval counts: replicate = (sums @ counts) / (lengths @ counts)
+        batch = max(1, MAX_ELEMENTS // max(k, 1))
+        for first in range(0, n_boot, batch):
+            counts = rng.multinomial(k, np.full(k, 1 / k), size=min(batch, n_boot - first)).T
+            replicates[:, first:first + counts.shape[1]] = (sums @ counts) / (lengths @ counts)
+    else:
+        means = sums / lengths
+        batch = max(1, MAX_ELEMENTS // max(n * k, 1))
+        for first in range(0, n_boot, batch):
+            index = rng.integers(0, k, size=(min(batch, n_boot - first), k))
+            resampled = means[:, index]  # n x batch x k
+            if statistic == "median":
+                replicates[:, first:first + len(index)] = np.median(resampled, axis=2)
+            else:
+                replicates[:, first:first + len(index)] = _trimmed_mean(resampled, trim, axis=2)
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(replicates, [alpha, 1 - alpha], axis=1)
+    return low, high
+
+
+def BRD_statistics(interval_sums, statistic="mean", n_boot=N_BOOT, confidence=CONFIDENCE, trim=TRIM, seed=0):
+    """
+    Table of robust BRDs and the bootstrap interval of `statistic` for every sample.
+
+    Returns:
+    - pd.DataFrame: Sample_ID, BRD_mean, BRD_median, BRD_trimmed_mean, BRD_ci_low, BRD_ci_high, Intervals.
+    """
+    import pandas as pd
+
+    sums = interval_sums["sums"].astype(np.float64)
+    lengths = interval_sums["length"].astype(np.float64)
+    robust = robust_BRD(sums, lengths, trim)
+    low, high = bootstrap_BRD(sums, lengths, statistic, n_boot, confidence, trim, seed)
+    return pd.DataFrame({
+        "Sample_ID": interval_sums["Sample_ID"],
+        "BRD_mean": robust["mean"],
+        "BRD_median": robust["median"],
+        "BRD_trimmed_mean": robust["trimmed_mean"],
+        "BRD_ci_low": low,
+        "BRD_ci_high": high,
+        "Intervals": len(lengths)
+    })
+
+
+def write_interval_sums(root_dir, output_dir, label="blood", workers=1):
+    """
+    Writes '<label>_<group>_interval_sums.npz' for the two BRD groups of calculate_CN_TCGA_py,
+    next to the BRD CSVs of 2.2.
+
+    Parameters:
+    - root_dir (str): BRD depth tree of 2.1, e.g. '$Project_ID/depth_results_exon_intron_blood_no_duplication'.
+    - output_dir (str): Output directory, e.g. 'BRD_Results/$Project_ID'.
+    - label (str): Label of the BRD files, e.g. 'blood'.
+    - workers (int): Number of samples parsed in parallel.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for group, selected_files in BRD_GROUPS.items():
+        output_file = os.path.join(output_dir, f"{label}_{group}_interval_sums.npz")
+        interval_sums = collect_interval_sums(root_dir, selected_files, workers)
+        save_interval_sums(interval_sums, output_file)
+        print(f"Saved {len(interval_sums['length'])} interval sums of {len(interval_sums['Sample_ID'])} samples to {output_file}")
+
+
+def calculate_CN_confidence(Project_ID=None, root_dir=None, label="blood", statistic="mean", n_boot=N_BOOT,
+                            confidence=CONFIDENCE, trim=TRIM, seed=0, output_format="csv"):
+    """
+    Copy numbers with robust BRDs and bootstrap confidence intervals for all rDNA types of a project.
+    Reads the average depth tables of main.py and the interval sums copied next to the BRD CSVs
+    ('<root_dir>/<Project_ID>/<label>_<group>_interval_sums.npz').
+
+    Parameters:
+    - Project_ID (str): The TCGA project
+    - root_dir (str): The root directory where the project data is stored.
+    - statistic (str): BRD statistic of the confidence interval: 'mean', 'median' or 'trimmed_mean'.
+    - n_boot, confidence, trim, seed: see bootstrap_BRD.
+    - output_format (str): 'csv' or 'parquet'.
+
+    Output file '<root_dir>/<Project_ID>_CN_CI.csv': Sample_ID, chr, rDNA_type, copy_number (as in
+    <Project_ID>_CN_all.csv, with the unrounded BRD), copy_number_median, copy_number_trimmed_mean, copy_number_ci_low,
+    copy_number_ci_high, statistic.
+    """
+    import pandas as pd
+
+    if not Project_ID or not root_dir:
+        raise ValueError("Project_ID and root_dir must be provided.")
+
+    BRD = []
+    for group, BRD_group in (("chr1_exon_intron", "5S"), ("chr13_14_15_21_22_exon", "45S")):
+        interval_file = os.path.join(root_dir, Project_ID, f"{label}_{group}_interval_sums.npz")
+        statistics = BRD_statistics(load_interval_sums(interval_file), statistic, n_boot, confidence, trim, seed)
+        BRD.append(statistics.assign(BRD_group=BRD_group))
+    BRD = pd.concat(BRD, ignore_index=True)
+
+    tables = []
+    for average_depth_file in list_tables(os.path.join(root_dir, Project_ID, "average_depth_blood_csv")):
+        table = read_table(average_depth_file)
+        table["rDNA_type"] = os.path.basename(average_depth_file).split("_")[0]
+        tables.append(table)
+    average_depth = pd.concat(tables, ignore_index=True)
+    sample_parts = average_depth["Sample"].str.split("_", n=2, expand=True)
+    average_depth["Sample_ID"] = sample_parts[0]
+    average_depth["chr"] = sample_parts[1]
+    average_depth["BRD_group"] = average_depth["rDNA_type"].where(average_depth["rDNA_type"] == "5S", "45S")
+
+    merged = pd.merge(average_depth, BRD, on=["Sample_ID", "BRD_group"], how="inner")
+    depth = merged["Average Depth"]
+    merged["copy_number"] = depth / merged["BRD_mean"]
+    merged["copy_number_median"] = depth / merged["BRD_median"]
+    merged["copy_number_trimmed_mean"] = depth / merged["BRD_trimmed_mean"]
+    # A higher BRD gives a lower copy number
+    merged["copy_number_ci_low"] = depth / merged["BRD_ci_high"]
+    merged["copy_number_ci_high"] = depth / merged["BRD_ci_low"]
+    merged["statistic"] = statistic
+    merged["Project_ID"] = Project_ID
+
+    columns = ["Sample_ID", "chr", "rDNA_type", "copy_number", "copy_number_median", "copy_number_trimmed_mean",
+               "copy_number_ci_low", "copy_number_ci_high", "statistic", "Project_ID"]
+    output_file = write_table(merged[columns], os.path.join(root_dir, f"{Project_ID}_CN_CI.csv"), output_format)
+    print(f"Copy numbers with {confidence:.0%} confidence intervals saved to {output_file}")
+    return merged[columns]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Robust BRD and bootstrap copy number confidence intervals.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    intervals = subparsers.add_parser("intervals", help="per-interval depth sums of a BRD depth tree (after 2.1)")
+    intervals.add_argument("root_dir", help="e.g. TCGA-BLCA/depth_results_exon_intron_blood_no_duplication")
+    intervals.add_argument("output_dir", help="e.g. BRD_Results/TCGA-BLCA")
+    intervals.add_argument("--label", default="blood")
+    intervals.add_argument("--workers", type=int, default=1)
+
+    cn = subparsers.add_parser("cn", help="copy numbers with confidence intervals (after main.py)")
+    cn.add_argument("Project_ID")
+    cn.add_argument("root_dir")
+    cn.add_argument("--label", default="blood")
+    cn.add_argument("--statistic", choices=STATISTICS, default="mean", help="BRD statistic of the confidence interval")
+    cn.add_argument("--n_boot", type=int, default=N_BOOT)
+    cn.add_argument("--confidence", type=float, default=CONFIDENCE)
+    cn.add_argument("--trim", type=float, default=TRIM)
+    cn.add_argument("--seed", type=int, default=0)
+    cn.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    args = parser.parse_args()
+
+    if args.command == "intervals":
+        if not os.path.isdir(args.root_dir):
+            print(f"Depth directory not found: {args.root_dir}")
+            sys.exit(1)
+        write_interval_sums(args.root_dir, args.output_dir, args.label, args.workers)
+    else:
+        calculate_CN_confidence(args.Project_ID, args.root_dir, args.label, args.statistic, args.n_boot,
+                                args.confidence, args.trim, args.seed, args.format)
+
+# Example usage:
+#python calculate_CN_TCGA_py/brd_stats.py intervals TCGA-BLCA/depth_results_exon_intron_blood_no_duplication BRD_Results/TCGA-BLCA --workers 8
+#(copy BRD_Results/TCGA-BLCA/*_interval_sums.npz to CN_results/TCGA-BLCA together with the BRD CSVs)
+#python calculate_CN_TCGA_py/brd_stats.py cn TCGA-BLCA CN_results --statistic median
@@ -1,25 +1,33 @@
 import os
 import pandas as pd
+from table_io import (TableWriter, iter_table_chunks, list_tables, partition_file, read_table, resolve_table, write_table,
+                      write_partitioned_dataset)
+import run_report
+
+# Columns of <Project_ID>_CN_all.csv and of the per-type copy number tables
+SUMMARY_COLUMNS = ["Sample_ID", "copy_number", "Depth_File", "chr", "Label", "Project_ID"]
+# Rows of an average depth or summary table held in memory at once by the streaming functions
+SUMMARY_CHUNK_ROWS = 100000
 
 def calculate_copy_number(Project_ID=None, average_depth_file=None, BRD_file=None, output_file=None):
     """
     Calculates copy number based on average depth and BRD depth.
 
     Parameters:
-    - average_depth_file (str): Path to the average depth file.
-    - BRD_file (str): Path to the BRD file.
+    - average_depth_file (str): Path to the average depth file (CSV or Parquet).
+    - BRD_file (str): Path to the BRD file (CSV or Parquet).
 
     Returns:
     - pd.DataFrame: DataFrame with calculated copy numbers.
     """
     # Read average depth and BRD files
-    average_depth = pd.read_csv(average_depth_file)
+    average_depth = read_table(average_depth_file)
     average_depth["Sample_ID"] = average_depth["Sample"].str.split("_").str[0]
     average_depth["chr"] = average_depth["Sample"].str.split("_").str[1]
     average_depth.drop(columns=["Sample"], inplace=True)
     average_depth = average_depth[["Sample_ID", "chr", "Average Depth"]]
 
-    BRD = pd.read_csv(BRD_file)
+    BRD = read_table(BRD_file)
     BRD["BRD.Average_Depth"] = BRD["Average_Depth"]
     BRD.drop(columns=["Average_Depth"], inplace=True)
 
@@ -55,7 +63,7 @@ calculate_copy_number(average_depth_file, BRD_file, output_file)
 
 def caculate_CN_for_all_rDNA(Project_ID=None, root_dir=None):
     """
-    Calculates copy number for all rDNA regions (45S, 18S, 5.8S, 28S) in the specified project directory.
+    Calculates copy number for all rDNA regions (5S, 45S and the 45S sub-regions) in the specified project directory.
 
     Parameters:
     - Project_ID (str): The TCGA project
@@ -65,35 +73,221 @@ def caculate_CN_for_all_rDNA(Project_ID=None, root_dir=None):
         raise ValueError("Project_ID and root_dir must be provided.")
     
     average_depth_dir = os.path.join(root_dir, Project_ID, "average_depth_blood_csv")
-    BRD_5S = os.path.join(root_dir, Project_ID, f"blood_chr1_exon_intron.csv")
-    BRD_45S = os.path.join(root_dir, Project_ID, f"blood_chr13_14_15_21_22_exon_BRD.csv")
+    BRD_5S = resolve_table(os.path.join(root_dir, Project_ID, f"blood_chr1_exon_intron.csv"))
+    BRD_45S = resolve_table(os.path.join(root_dir, Project_ID, f"blood_chr13_14_15_21_22_exon_BRD.csv"))
     output_path = os.path.join(root_dir, Project_ID,"copy_number_results")
     os.makedirs(output_path, exist_ok=True)
     output_summary = os.path.join(root_dir, f"{Project_ID}_CN_all.csv")
 
-    for files in os.listdir(average_depth_dir):
-        if files.endswith(".csv"):
-            rDNA_type = files.split("_")[0]
-            if rDNA_type == "5S":
-                average_depth_file = os.path.join(average_depth_dir, files)
-                output_file = os.path.join(output_path, f"{Project_ID}_{rDNA_type}_CN_results.csv")
-                calculate_copy_number(Project_ID=Project_ID, average_depth_file=average_depth_file, BRD_file=BRD_5S, output_file=output_file)
-                print(f"Calculated copy number for {rDNA_type}.")
-            if rDNA_type in ['45S', '18S', '5.8S', '28S']: #?
-                average_depth_file = os.path.join(average_depth_dir, files)
-                output_file = os.path.join(output_path, f"{Project_ID}_{rDNA_type}_CN_results.csv")
-                calculate_copy_number(Project_ID=Project_ID, average_depth_file=average_depth_file, BRD_file=BRD_45S, output_file=output_file)
-                print(f"Calculated copy number for {rDNA_type}.")
+    # CSV or Parquet average depth tables
+    for average_depth_file in list_tables(average_depth_dir):
+        files = os.path.basename(average_depth_file)
+        rDNA_type = files.split("_")[0]
+        if rDNA_type == "5S":
+            output_file = os.path.join(output_path, f"{Project_ID}_{rDNA_type}_CN_results.csv")
+            calculate_copy_number(Project_ID=Project_ID, average_depth_file=average_depth_file, BRD_file=BRD_5S, output_file=output_file)
+            print(f"Calculated copy number for {rDNA_type}.")
+        else: # 45S and every region of the 45S registry
+            output_file = os.path.join(output_path, f"{Project_ID}_{rDNA_type}_CN_results.csv")
+            calculate_copy_number(Project_ID=Project_ID, average_depth_file=average_depth_file, BRD_file=BRD_45S, output_file=output_file)
+            print(f"Calculated copy number for {rDNA_type}.")
+    
+    #merge all copy number results in outputsummary, one chunk at a time
+    with TableWriter(output_summary, SUMMARY_COLUMNS) as writer:
+        for files in os.listdir(output_path):
+            if files.endswith(".csv"):
+                file_path = os.path.join(output_path, files)
+                for df in iter_table_chunks(file_path, SUMMARY_CHUNK_ROWS):
+                    writer.write_frame(df)
+
+    print(f"Copy number results saved to {output_summary}")
     
-    #merge all copy number results in outputsummary
-    all_results = []
-    for files in os.listdir(output_path):
-        if files.endswith(".csv"):
-            file_path = os.path.join(output_path, files)
-            df = pd.read_csv(file_path)
-            all_results.append(df)
-    summary_df = pd.concat(all_results)
-    summary_df.to_csv(output_summary, index=False)
+def _read_BRD_groups(Project_ID, root_dir):
+    """Both BRD tables of a project, tagged with the BRD group (5S or 45S) they are used for"""
+    return pd.concat([
+        read_table(os.path.join(root_dir, Project_ID, "blood_chr1_exon_intron.csv")).assign(BRD_group="5S"),
+        read_table(os.path.join(root_dir, Project_ID, "blood_chr13_14_15_21_22_exon_BRD.csv")).assign(BRD_group="45S")
+    ], ignore_index=True).rename(columns={"Average_Depth": "BRD.Average_Depth"})
+
+
+def calculate_CN_for_all_rDNA_vectorized(Project_ID=None, root_dir=None, write_per_type=False, output_format="csv"):
+    """
+    Calculates copy number for all rDNA regions in one vectorized merge: every average depth table
+    and both BRD tables are read once, joined in a single long-format frame and divided at once.
+    Writes the same summary as caculate_CN_for_all_rDNA.
+
+    Parameters:
+    - Project_ID (str): The TCGA project
+    - root_dir (str): The root directory where the project data is stored.
+    - write_per_type (bool): If True, also writes the per-type '<Project_ID>_<rDNA_type>_CN_results.csv' files.
+    - output_format (str): 'csv' or 'parquet'. Parquet also updates the '<root_dir>/CN_all_parquet'
+      dataset, partitioned by Project_ID. Inputs are read in either format.
+
+    Returns:
+    - pd.DataFrame: The summary table.
+    """
+    if not Project_ID or not root_dir:
+        raise ValueError("Project_ID and root_dir must be provided.")
+
+    average_depth_dir = os.path.join(root_dir, Project_ID, "average_depth_blood_csv")
+    output_path = os.path.join(root_dir, Project_ID, "copy_number_results")
+    output_summary = os.path.join(root_dir, f"{Project_ID}_CN_all.csv")
+
+    # Long-format table of all average depths, tagged with the rDNA type of their file
+    tables = []
+    for average_depth_file in list_tables(average_depth_dir):
+        rDNA_type = os.path.basename(average_depth_file).split("_")[0]
+        table = read_table(average_depth_file)
+        table["rDNA_type"] = rDNA_type
+        run_report.count(rDNA_type, files=1, bytes=os.path.getsize(average_depth_file), rows=len(table))
+        tables.append(table)
+    average_depth = pd.concat(tables, ignore_index=True)
+    sample_parts = average_depth["Sample"].str.split("_", n=2, expand=True)
+    average_depth["Sample_ID"] = sample_parts[0]
+    average_depth["chr"] = sample_parts[1]
+    # 5S uses the chr1 BRD, 45S and all its sub-regions use the acrocentric exon BRD
+    average_depth["BRD_group"] = average_depth["rDNA_type"].where(average_depth["rDNA_type"] == "5S", "45S")
+
+    BRD = _read_BRD_groups(Project_ID, root_dir)
+
+    merged = pd.merge(average_depth, BRD, on=["Sample_ID", "BRD_group"], how="inner")
+    merged["copy_number"] = merged["Average Depth"] / merged["BRD.Average_Depth"]
+    merged["Project_ID"] = Project_ID
+
+    #print unmatched samples if any
+    matched = average_depth.set_index(["Sample_ID", "BRD_group"]).index.isin(BRD.set_index(["Sample_ID", "BRD_group"]).index)
+    if not matched.all():
+        print("Samples not matched:")
+        print(average_depth.loc[~matched, ["Sample_ID", "chr", "Average Depth"]])
+
+    summary_df = merged[SUMMARY_COLUMNS]
+    output_summary = write_table(summary_df, output_summary, output_format)
+    if output_format == "parquet":
+        write_partitioned_dataset(summary_df, os.path.join(root_dir, "CN_all_parquet"))
+
+    if write_per_type:
+        os.makedirs(output_path, exist_ok=True)
+        for rDNA_type, type_df in summary_df.groupby(merged["rDNA_type"], sort=False):
+            output_file = os.path.join(output_path, f"{Project_ID}_{rDNA_type}_CN_results.csv")
+            write_table(type_df, output_file, output_format)
 
     print(f"Copy number results saved to {output_summary}")
-    
\ No newline at end of file
+    return summary_df
+
+
+def calculate_CN_for_all_rDNA_streaming(Project_ID=None, root_dir=None, write_per_type=False, output_format="csv",
+                                        chunksize=SUMMARY_CHUNK_ROWS):
+    """
+    Same summary as calculate_CN_for_all_rDNA_vectorized, in bounded memory: the average depth
+    tables are read chunk by chunk and the copy numbers of each chunk are appended to the summary
+    (and to the per-type table) before the next chunk is read. Only the two BRD tables, one row per
+    sample, are held in memory, so the memory use does not grow with the number of rDNA types.
+
+    Parameters:
+    - Project_ID (str): The TCGA project
+    - root_dir (str): The root directory where the project data is stored.
+    - write_per_type (bool): If True, also writes the per-type '<Project_ID>_<rDNA_type>_CN_results.csv' files.
+    - output_format (str): 'csv' or 'parquet'. Parquet also replaces the project partition of the
+      '<root_dir>/CN_all_parquet' dataset.
+    - chunksize (int): Rows of an average depth table read at once.
+
+    Returns:
+    - str: Path of the summary table.
+    """
+    if not Project_ID or not root_dir:
+        raise ValueError("Project_ID and root_dir must be provided.")
+
+    average_depth_dir = os.path.join(root_dir, Project_ID, "average_depth_blood_csv")
+    output_path = os.path.join(root_dir, Project_ID, "copy_number_results")
+    if write_per_type:
+        os.makedirs(output_path, exist_ok=True)
+    BRD = _read_BRD_groups(Project_ID, root_dir)
+
+    writers = [TableWriter(os.path.join(root_dir, f"{Project_ID}_CN_all.csv"), SUMMARY_COLUMNS, output_format)]
+    if output_format == "parquet":
+        dataset_file = partition_file(os.path.join(root_dir, "CN_all_parquet"), Project_ID)
+        writers.append(TableWriter(dataset_file, SUMMARY_COLUMNS[:-1], output_format))
+    try:
+        for average_depth_file in list_tables(average_depth_dir):
+            rDNA_type = os.path.basename(average_depth_file).split("_")[0]
+            BRD_type = BRD[BRD["BRD_group"] == ("5S" if rDNA_type == "5S" else "45S")]
+            type_writer = None
+            if write_per_type:
+                type_writer = TableWriter(os.path.join(output_path, f"{Project_ID}_{rDNA_type}_CN_results.csv"),
+                                          SUMMARY_COLUMNS, output_format)
+            rows = 0
+            for average_depth in iter_table_chunks(average_depth_file, chunksize):
+                rows += len(average_depth)
+                sample_parts = average_depth["Sample"].str.split("_", n=2, expand=True)
+                average_depth["Sample_ID"] = sample_parts[0]
+                average_depth["chr"] = sample_parts[1]
+
+                merged = pd.merge(average_depth, BRD_type, on="Sample_ID", how="inner")
+                merged["copy_number"] = merged["Average Depth"] / merged["BRD.Average_Depth"]
+                merged["Project_ID"] = Project_ID
+
+                matched = average_depth["Sample_ID"].isin(BRD_type["Sample_ID"])
+                if not matched.all():
+                    print("Samples not matched:")
+                    print(average_depth.loc[~matched, ["Sample_ID", "chr", "Average Depth"]])
+
+                for writer in writers:
+                    writer.write_frame(merged)
+                if type_writer:
+                    type_writer.write_frame(merged)
+            if type_writer:
+                type_writer.close()
+            run_report.count(rDNA_type, files=1, bytes=os.path.getsize(average_depth_file), rows=rows)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    print(f"Copy number results saved to {writers[0].path}")
+    return writers[0].path
+
+
+def summarize_copy_number(summary_file, output_file=None, by=("Project_ID", "chr"), chunksize=SUMMARY_CHUNK_ROWS,
+                          filters=None):
+    """
+    Count, mean, standard deviation, min and max of copy_number per group of a CN summary
+    ('<Project_ID>_CN_all.csv', 'pan_cancer_CN_all.csv' or the 'CN_all_parquet' dataset),
+    accumulated over chunks so that the summary is never loaded at once.
+
+    Parameters:
+    - summary_file (str): Path to the summary table or dataset directory.
+    - output_file (str, optional): Output table (CSV or Parquet, by its extension).
+    - by (tuple): Grouping columns.
+    - chunksize (int): Rows read at once.
+    - filters (list, optional): Parquet filters, e.g. [("Project_ID", "in", ["TCGA-BLCA"])].
+
+    Returns:
+    - pd.DataFrame: One row per group.
+    """
+    by = list(by)
+    partial = None
+    for chunk in iter_table_chunks(summary_file, chunksize, columns=by + ["copy_number"], filters=filters):
+        chunk = chunk.astype({column: str for column in by})
+        chunk["copy_number_sq"] = chunk["copy_number"] ** 2
+        stats = chunk.groupby(by, sort=False).agg(
+            count=("copy_number", "count"), total=("copy_number", "sum"), total_sq=("copy_number_sq", "sum"),
+            min=("copy_number", "min"), max=("copy_number", "max"))
+        if partial is None:
+            partial = stats
+        else:
+            combined = pd.concat([partial, stats])
+            partial = combined.groupby(level=by, sort=False).agg(
+                {"count": "sum", "total": "sum", "total_sq": "sum", "min": "min", "max": "max"})
+
+    if partial is None:
+        return pd.DataFrame(columns=by + ["count", "mean", "std", "min", "max"])
+    partial = partial.sort_index()
+    count = partial["count"]
+    mean = partial["total"] / count
+    # sample standard deviation from the accumulated sums, like Series.std
+    variance = (partial["total_sq"] - count * mean ** 2) / (count - 1)
+    summary = pd.DataFrame({"count": count, "mean": mean, "std": variance.clip(lower=0) ** 0.5,
+                            "min": partial["min"], "max": partial["max"]}).reset_index()
+    if output_file:
+        write_table(summary, output_file, "parquet" if output_file.endswith(".parquet") else "csv")
+        print(f"Copy number statistics saved to {output_file}")
+    return summary
@@ -0,0 +1,264 @@
+import os
+import sys
+import gzip
+import struct
+from collections import namedtuple
+import numpy as np
+
+# Compact binary alternative to `samtools depth` text output.
+#
+# Layout (little-endian):
+#   header   magic b"DPTH", version (u8), compression (u8), reserved (u16), number of blocks (u32)
+#   blocks   per block: contig name length (u16), contig name, start position (u64, 1-based),
+#            number of positions (u64), data offset (u64), stored data size (u64)
+#   data     one uint32 depth array per block, optionally gzip or zstd compressed
+#
+# A block is a run of consecutive positions on one contig, so `samtools depth -a` output of
+# one contig is a single block and the position column is never stored.
+
+DEPTH_BINARY_EXT = ".dbin"
+MAGIC = b"DPTH"
+VERSION = 1
+COMPRESSIONS = {None: 0, "gzip": 1, "zstd": 2}
+
+_HEADER = struct.Struct("<4sBBHI")
+_BLOCK = struct.Struct("<QQQQ")
+
+DepthBlock = namedtuple("DepthBlock", ["contig", "start", "depths"])
+
+
+def is_depth_binary(file_path):
+    """Returns True if file_path is a binary depth file (by extension)."""
+    return file_path.endswith(DEPTH_BINARY_EXT)
+
+
+def _compress(data, compression):
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        import zstandard  # optional dependency, only needed for zstd files
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def _decompress(data, compression_code):
+    if compression_code == 1:
+        return gzip.decompress(data)
+    if compression_code == 2:
+        import zstandard  # optional dependency, only needed for zstd files
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def write_depth_binary(output_path, blocks, compression=None):
+    """
+    Writes depth blocks to a binary depth file.
+
+    Parameters:
+    - output_path (str): Path of the output file.
+    - blocks (list): List of DepthBlock (contig, 1-based start position, depth array).
+    - compression (str, optional): None, 'gzip' or 'zstd'.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+
+    payloads = [_compress(np.ascontiguousarray(block.depths, dtype="<u4").tobytes(), compression) for block in blocks]
+    names = [block.contig.encode() for block in blocks]
+
+    # Data starts right after the header and the block table
+    offset = _HEADER.size + sum(2 + len(name) + _BLOCK.size for name in names)
+
+    with open(output_path, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, COMPRESSIONS[compression], 0, len(blocks)))
+        for name, block, payload in zip(names, blocks, payloads):
+            file.write(struct.pack("<H", len(name)) + name)
+            file.write(_BLOCK.pack(block.start, len(block.depths), offset, len(payload)))
+            offset += len(payload)
+        for payload in payloads:
+            file.write(payload)
+
+
+def read_depth_binary(file_path):
+    """
+    Reads a binary depth file.
+
+    Uncompressed depth arrays are memory-mapped, so reading is O(1) and only the
+    positions that are actually used are loaded from disk.
+
+    Parameters:
+    - file_path (str): Path to the binary depth file.
+
+    Returns:
+    - blocks (list): List of DepthBlock (contig, 1-based start position, depth array).
+    """
+    blocks = []
+    with open(file_path, 'rb') as file:
+        magic, version, compression_code, _, n_blocks = _HEADER.unpack(file.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{file_path} is not a binary depth file.")
+        if version != VERSION:
+            raise ValueError(f"Unsupported binary depth version {version} in {file_path}.")
+
+        table = []
+        for _ in range(n_blocks):
+            (name_length,) = struct.unpack("<H", file.read(2))
+            contig = file.read(name_length).decode()
+            start, length, offset, stored_size = _BLOCK.unpack(file.read(_BLOCK.size))
+            table.append((contig, start, length, offset, stored_size))
+
+        for contig, start, length, offset, stored_size in table:
+            if length == 0:
+                depths = np.zeros(0, dtype="<u4")
+            elif compression_code == 0:
+                depths = np.memmap(file_path, dtype="<u4", mode="r", offset=offset, shape=(length,))
+            else:
+                file.seek(offset)
+                depths = np.frombuffer(_decompress(file.read(stored_size), compression_code), dtype="<u4")
+            blocks.append(DepthBlock(contig, start, depths))
+
+    return blocks
+
+
+def slice_depth_blocks(blocks, min_position, max_position):
+    """
+    Restricts depth blocks to positions min_position..max_position (inclusive) without copying.
+
+    Returns:
+    - blocks (list): List of DepthBlock views, empty blocks are dropped.
+    """
+    sliced = []
+    for block in blocks:
+        first = max(min_position, block.start)
+        last = min(max_position, block.start + len(block.depths) - 1)
+        if first > last:
+            continue
+        sliced.append(DepthBlock(block.contig, first, block.depths[first - block.start:last - block.start + 1]))
+    return sliced
+
+
+def sum_depth_binary(file_path):
+    """Returns the exact (total depth, number of positions) of a binary depth file."""
+    total_depth = 0
+    total_length = 0
+    for block in read_depth_binary(file_path):
+        total_depth += int(block.depths.sum(dtype=np.uint64))
+        total_length += len(block.depths)
+    return total_depth, total_length
+
+
+def iter_depth_text_chunks(file_path, chunksize=10_000_000):
+    """
+    Reads a `samtools depth` text file (plain, gzip or bgzip) chunk by chunk and yields
+    (contigs, positions, depths) arrays of every chunk, positions and depths as int64.
+
+    Malformed lines are skipped, as in the text readers.
+    """
+    import pandas as pd  # only needed for conversion
+    from depth_text import open_depth_text
+
+    if os.path.getsize(file_path) == 0:
+        return
+
+    with open_depth_text(file_path, 'rb') as file:
+        try:
+            chunks = pd.read_csv(file, sep='\t', header=None, names=["contig", "position", "depth"],
+                                 dtype={"contig": str}, chunksize=chunksize, on_bad_lines="skip")
+        except pd.errors.EmptyDataError:  # compressed empty file
+            return
+
+        for chunk in chunks:
+            chunk["position"] = pd.to_numeric(chunk["position"], errors="coerce")
+            chunk["depth"] = pd.to_numeric(chunk["depth"], errors="coerce")
+            chunk = chunk.dropna()
+            chunk = chunk[(chunk["position"] % 1 == 0) & (chunk["depth"] % 1 == 0)]
+            if chunk.empty:
+                continue
+
+            depths = chunk["depth"].to_numpy(dtype=np.int64)
+            if depths.min() < 0 or depths.max() > np.iinfo(np.uint32).max:
+                raise ValueError(f"Depth out of uint32 range in {file_path}.")
+            yield chunk["contig"].to_numpy(), chunk["position"].to_numpy(dtype=np.int64), depths
+
+
+def iter_depth_text_runs(file_path, chunksize=10_000_000):
+    """
+    Reads a `samtools depth` text file chunk by chunk and yields (contig, start, depths) for every
+    run of consecutive positions within a chunk. A run that continues in the next chunk is yielded
+    in pieces; depths are int64 arrays.
+    """
+    for contigs, positions, depths in iter_depth_text_chunks(file_path, chunksize):
+        # A new run starts where the contig changes or positions are not consecutive
+        breaks = np.flatnonzero((contigs[1:] != contigs[:-1]) | (positions[1:] != positions[:-1] + 1)) + 1
+        for first, last in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(positions)]))):
+            yield contigs[first], int(positions[first]), depths[first:last]
+
+
+def read_depth_text_blocks(file_path, chunksize=10_000_000):
+    """
+    Reads a `samtools depth` text file (plain, gzip or bgzip) into depth blocks of consecutive positions.
+
+    Malformed lines are skipped, as in the text readers.
+    """
+    runs = []  # [contig, start, next expected position, list of depth arrays]
+    for contig, start, depths in iter_depth_text_runs(file_path, chunksize):
+        if runs and runs[-1][0] == contig and runs[-1][2] == start:
+            runs[-1][2] = start + len(depths)
+            runs[-1][3].append(depths)
+        else:
+            runs.append([contig, start, start + len(depths), [depths]])
+
+    return [DepthBlock(contig, start, np.concatenate(arrays).astype("<u4")) for contig, start, _, arrays in runs]
+
+
+def convert_depth_text(input_path, output_path=None, compression=None):
+    """
+    Converts a `samtools depth` text file to the binary depth format.
+
+    Parameters:
+    - input_path (str): Path to the text depth file, e.g. '<sample>_GL000220v1_45S_depth.txt'.
+    - output_path (str, optional): Output path. Defaults to input_path with '.txt' (or '.txt.gz') replaced by '.dbin'.
+    - compression (str, optional): None, 'gzip' or 'zstd'.
+    """
+    from depth_text import depth_file_stem
+
+    if output_path is None:
+        output_path = depth_file_stem(input_path) + DEPTH_BINARY_EXT
+    write_depth_binary(output_path, read_depth_text_blocks(input_path), compression)
+    return output_path
+
+
+def convert_depth_tree(input_dir, output_dir, compression=None):
+    """
+    Converts every '.txt' (or '.txt.gz'/'.txt.bgz') depth file under input_dir, mirroring the folder
+    layout in output_dir. Other files are ignored.
+
+    Parameters:
+    - input_dir (str): Directory with depth text files, e.g. 'depth_results_blood' or a BRD depth tree.
+    - output_dir (str): Directory where the binary depth files are saved.
+    - compression (str, optional): None, 'gzip' or 'zstd'.
+    """
+    from depth_text import DEPTH_TEXT_EXTS, depth_file_stem
+
+    for dir_path, _, file_names in os.walk(input_dir):
+        target_dir = os.path.join(output_dir, os.path.relpath(dir_path, input_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for file_name in sorted(file_names):
+            if not file_name.endswith(DEPTH_TEXT_EXTS):
+                continue
+            output_path = os.path.join(target_dir, depth_file_stem(file_name) + DEPTH_BINARY_EXT)
+            convert_depth_text(os.path.join(dir_path, file_name), output_path, compression)
+            print(f"Converted {file_name} -> {output_path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        compression = sys.argv[3] if len(sys.argv) > 3 else None
+        convert_depth_tree(sys.argv[1], sys.argv[2], compression)
+    else:
+        print("Usage: python depth_binary.py <input_dir> <output_dir> [gzip|zstd]")
+
+# Example usage:
+#python calculate_CN_TCGA_py/depth_binary.py TCGA-BLCA/depth_results_blood TCGA-BLCA/depth_results_blood_bin
+#python calculate_CN_TCGA_py/depth_binary.py TCGA-BLCA/depth_results_exon_intron_blood_no_duplication TCGA-BLCA/depth_results_exon_intron_blood_bin gzip
@@ -0,0 +1,217 @@
+import os
+import sys
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from depth_text import DEPTH_FILE_EXTS
+from split_depth_files import load_depth_array
+
+# Prefix-sum index of a depth file, saved next to it as '<depth file>.idx.npz'.
+#
+# The positions of the file are stored as runs of consecutive positions (run start, offset of
+# the run in the concatenated depth array) and `cumsum[i]` is the sum of the first i depths, so
+# the sum and number of positions in any window are two lookups.
+
+INDEX_SUFFIX = ".idx.npz"
+
+
+def index_path(depth_file):
+    """Path of the prefix-sum index of a depth file."""
+    return depth_file + INDEX_SUFFIX
+
+
+def build_depth_index(depth_file):
+    """
+    Builds and saves the prefix-sum index of a depth file (text or binary, one contig).
+
+    Parameters:
+    - depth_file (str): Path to the depth file.
+
+    Returns:
+    - str: Path of the saved index.
+    """
+    contig, positions, depths = load_depth_array(depth_file)
+
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    run_offsets = np.concatenate(([0], breaks)).astype(np.int64)
+    run_starts = positions[run_offsets] if len(positions) else np.zeros(0, dtype=np.int64)
+    cumsum = np.concatenate(([0], np.cumsum(depths, dtype=np.int64)))
+
+    stat = os.stat(depth_file)
+    output_path = index_path(depth_file)
+    with open(output_path, 'wb') as file:
+        np.savez(file, contig=np.array(contig), run_starts=run_starts, run_offsets=run_offsets,
+                 cumsum=cumsum, source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns)
+    return output_path
+
+
+@lru_cache(maxsize=1024)
+def _load_index(depth_file, source_size, source_mtime_ns):
+    path = index_path(depth_file)
+    if os.path.exists(path):
+        with np.load(path) as index:
+            if int(index["source_size"]) == source_size and int(index["source_mtime_ns"]) == source_mtime_ns:
+                return {key: index[key] for key in index.files}
+    build_depth_index(depth_file)
+    with np.load(path) as index:
+        return {key: index[key] for key in index.files}
+
+
+def load_depth_index(depth_file):
+    """
+    Loads the prefix-sum index of a depth file, (re)building it if it is missing or older
+    than the depth file. Loaded indexes are cached in memory.
+    """
+    stat = os.stat(depth_file)
+    return _load_index(depth_file, stat.st_size, stat.st_mtime_ns)
+
+
+def _rank(index, positions):
+    """Number of positions in the file that are <= each of the given positions."""
+    run_starts = index["run_starts"]
+    run_offsets = index["run_offsets"]
+    total = len(index["cumsum"]) - 1
+    run_ends = np.append(run_offsets[1:], total)
+
+    run = np.searchsorted(run_starts, positions, side='right') - 1
+    safe_run = np.clip(run, 0, None)
+    rank = np.minimum(run_offsets[safe_run] + positions - run_starts[safe_run] + 1, run_ends[safe_run])
+    return np.where(run < 0, 0, rank)
+
+
+def window_sums(depth_file, starts, ends):
+    """
+    Sum of depths and number of positions in each window [start, end] (1-based, inclusive).
+
+    Parameters:
+    - depth_file (str): Path to the depth file.
+    - starts (array-like): Window starts.
+    - ends (array-like): Window ends.
+
+    Returns:
+    - sums (np.ndarray), counts (np.ndarray)
+    """
+    index = load_depth_index(depth_file)
+    if len(index["run_starts"]) == 0:
+        zeros = np.zeros(len(np.atleast_1d(starts)), dtype=np.int64)
+        return zeros, zeros
+    lower = _rank(index, np.asarray(starts, dtype=np.int64) - 1)
+    upper = np.maximum(_rank(index, np.asarray(ends, dtype=np.int64)), lower)  # empty window if end < start
+    cumsum = index["cumsum"]
+    return cumsum[upper] - cumsum[lower], upper - lower
+
+
+@lru_cache(maxsize=64)
+def _depth_files(depth_dir, rDNA_type, dir_mtime_ns):
+    """{sample: depth file} of a directory; the directory's mtime changes when files are added or removed."""
+    depth_files = {}
+    for filename in sorted(os.listdir(depth_dir)):
+        parts = filename.split('_')
+        if len(parts) > 2 and parts[2] == rDNA_type and filename.endswith(DEPTH_FILE_EXTS):
+            depth_files.setdefault(parts[0], os.path.join(depth_dir, filename))
+    return depth_files
+
+
+def find_depth_file(depth_dir, sample, rDNA_type="45S"):
+    """
+    Finds the depth file of a sample and rDNA type, e.g. '<sample>_GL000220v1_45S_depth.txt'.
+    The directory is listed once and the sample -> file mapping is cached until it changes.
+    """
+    depth_files = _depth_files(depth_dir, rDNA_type, os.stat(depth_dir).st_mtime_ns)
+    if sample not in depth_files:
+        raise FileNotFoundError(f"No {rDNA_type} depth file for {sample} in {depth_dir}.")
+    return depth_files[sample]
+
+
+def mean_depth(sample, contig, start, end, depth_dir=None, rDNA_type="45S", depth_file=None):
+    """
+    Average depth of a sample in [start, end] (1-based, inclusive), answered from the prefix-sum index.
+
+    Parameters:
+    - sample (str): Sample ID, e.g. 'TCGA-4Z-AA7Y-10A'.
+    - contig (str): Contig name in the depth file.
+    - start (int), end (int): Window on the contig.
+    - depth_dir (str): Directory containing the depth files, e.g. 'depth_results_blood'.
+    - rDNA_type (str): '45S' or '5S'.
+    - depth_file (str, optional): The sample's depth file; if given, depth_dir is not searched.
+      For many windows of one sample, window_sums answers all of them in one call.
+
+    Returns:
+    - float: Average depth, 0 if the window has no positions.
+    """
+    if depth_file is None:
+        depth_file = find_depth_file(depth_dir, sample, rDNA_type)
+    index_contig = str(load_depth_index(depth_file)["contig"])
+    if contig != index_contig:
+        raise KeyError(f"{depth_file} has contig {index_contig}, not {contig}.")
+
+    sums, counts = window_sums(depth_file, [start], [end])
+    return int(sums[0]) / int(counts[0]) if counts[0] else 0
+
+
+def sliding_window_profile(depth_dir, BRD_file, output_file, window=100, step=50, rDNA_type="45S", reference_length=None):
+    """
+    Writes a sliding-window copy number profile of every sample: window average depth divided by
+    the sample's BRD average depth. All windows of a sample are computed in one vectorized lookup.
+
+    Parameters:
+    - depth_dir (str): Directory containing the depth files, e.g. 'depth_results_blood'.
+    - BRD_file (str): BRD CSV, e.g. 'blood_chr13_14_15_21_22_exon_BRD.csv' for 45S.
+    - output_file (str): Output CSV with Sample_ID, chr, Window_Start, Window_End, Average_Depth, copy_number.
+    - window (int): Window size in bases.
+    - step (int): Distance between window starts.
+    - rDNA_type (str): '45S' or '5S'.
+    - reference_length (int, optional): Last window end. Defaults to the last position of each file.
+    """
+    BRD = pd.read_csv(BRD_file).set_index("Sample_ID")["Average_Depth"]
+    profiles = []
+
+    for filename in sorted(os.listdir(depth_dir)):
+        parts = filename.split('_')
+        if len(parts) < 3 or parts[2] != rDNA_type or not filename.endswith(DEPTH_FILE_EXTS):
+            continue
+        sample = parts[0]
+        if sample not in BRD.index:
+            print(f"Sample not matched: {sample}")
+            continue
+
+        depth_file = os.path.join(depth_dir, filename)
+        index = load_depth_index(depth_file)
+        if reference_length:
+            last_position = reference_length
+        elif len(index["run_starts"]):
+            last_position = int(index["run_starts"][-1] + len(index["cumsum"]) - 1 - index["run_offsets"][-1] - 1)
+        else:
+            continue
+
+        starts = np.arange(1, max(last_position - window + 1, 1) + 1, step)
+        ends = np.minimum(starts + window - 1, last_position)
+        sums, counts = window_sums(depth_file, starts, ends)
+        averages = np.divide(sums, counts, out=np.zeros(len(sums)), where=counts > 0)
+
+        profiles.append(pd.DataFrame({
+            "Sample_ID": sample,
+            "chr": rDNA_type,
+            "Window_Start": starts,
+            "Window_End": ends,
+            "Average_Depth": averages,
+            "copy_number": averages / BRD[sample]
+        }))
+
+    columns = ["Sample_ID", "chr", "Window_Start", "Window_End", "Average_Depth", "copy_number"]
+    profile_df = pd.concat(profiles, ignore_index=True) if profiles else pd.DataFrame(columns=columns)
+    profile_df.to_csv(output_file, index=False)
+    print(f"Sliding-window copy number profile saved to {output_file}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        window = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+        step = int(sys.argv[5]) if len(sys.argv) > 5 else window // 2
+        sliding_window_profile(sys.argv[1], sys.argv[2], sys.argv[3], window=window, step=step)
+    else:
+        print("Usage: python depth_index.py <depth_dir> <BRD_file> <output_file> [window] [step]")
+
+# Example usage
+#mean_depth("TCGA-4Z-AA7Y-10A", "U13369.1", 3657, 5527, "CN_results/TCGA-BLCA/depth_results_blood")
+#python calculate_CN_TCGA_py/depth_index.py CN_results/TCGA-BLCA/depth_results_blood CN_results/TCGA-BLCA/blood_chr13_14_15_21_22_exon_BRD.csv CN_results/TCGA-BLCA_45S_window_CN.csv 200 100
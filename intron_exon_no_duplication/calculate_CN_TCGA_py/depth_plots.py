@@ -0,0 +1,298 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Depth QC plots. Profiles are decimated to at most PLOT_BINS bins (mean line and min-max band),
+# so a 16 kb 45S profile is drawn with a few thousand points instead of one marker per position.
+# Figures are drawn on matplotlib Figure objects with the Agg canvas (no pyplot, no GUI backend);
+# each process reuses one figure for all its per-sample plots, and batches of plots are rendered
+# in a process pool.
+
+PLOT_BINS = 2000
+FIGURE_SIZE = (10, 6)
+COLOR = '#377EB8'
+
+SMALL_MULTIPLE_BINS = 200
+PNG_OPTIONS = {"compress_level": 1}  # fast PNG compression, the plots are mostly flat colour
+
+_figure = None  # per-process figure reused by render_profile, see _profile_figure
+
+
+def binned_profile(positions, depths, bins=PLOT_BINS, start=None, end=None):
+    """
+    Decimates a depth profile into equal-width position bins.
+
+    Parameters:
+    - positions (array-like): Sorted positions.
+    - depths (array-like): Depth at each position.
+    - bins (int): Number of bins. Profiles with at most this many positions (and no start/end) are kept as is.
+    - start (int, optional), end (int, optional): Position range of the bins; defaults to the profile's range.
+
+    Returns:
+    - centers, means, lows, highs (np.ndarray): Bin centers and the mean, min and max depth of every bin
+      (NaN for bins without positions).
+    """
+    positions = np.asarray(positions)
+    depths = np.asarray(depths, dtype=np.float64)
+    if len(positions) == 0:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty
+    if len(positions) <= bins and start is None and end is None:
+        return positions.astype(np.float64), depths, depths, depths
+
+    start = positions[0] if start is None else start
+    end = positions[-1] if end is None else end
+    edges = np.linspace(start, end + 1, bins + 1)
+    inside = (positions >= start) & (positions <= end)
+    index = np.clip(np.searchsorted(edges, positions[inside], side='right') - 1, 0, bins - 1)
+    values = depths[inside]
+
+    counts = np.bincount(index, minlength=bins)
+    sums = np.bincount(index, weights=values, minlength=bins)
+    means = np.divide(sums, counts, out=np.full(bins, np.nan), where=counts > 0)
+    lows = np.full(bins, np.inf)
+    highs = np.full(bins, -np.inf)
+    np.minimum.at(lows, index, values)
+    np.maximum.at(highs, index, values)
+    lows[counts == 0] = np.nan
+    highs[counts == 0] = np.nan
+    return (edges[:-1] + edges[1:]) / 2, means, lows, highs
+
+
+def _new_figure(figsize):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _profile_figure():
+    global _figure
+    if _figure is None:
+        figure = _new_figure(FIGURE_SIZE)
+        axes = figure.add_subplot()
+        line, = axes.plot([], [], linestyle='-', color=COLOR, linewidth=0.8)
+        axes.set_xlabel('Position', fontsize=14)
+        axes.set_ylabel('Depth', fontsize=14)
+        axes.grid(True)
+        _figure = (figure, axes, line, [None])
+    return _figure
+
+
+def render_profile(profile, output_path, title='Depth Distribution along the Sequence'):
+    """
+    Saves one decimated depth profile (as returned by binned_profile) as an image. The figure,
+    axes and mean line of the current process are reused; only the data, band and title change.
+    """
+    figure, axes, line, band = _profile_figure()
+    centers, means, lows, highs = profile
+    if band[0] is not None:
+        band[0].remove()
+    band[0] = axes.fill_between(centers, lows, highs, color=COLOR, alpha=0.3, linewidth=0)
+    line.set_data(centers, means)
+    axes.relim()
+    axes.autoscale_view()
+    axes.set_title(title, fontsize=16)
+    figure.savefig(output_path, pil_kwargs=PNG_OPTIONS)
+
+
+def _render_batch(jobs):
+    for profile, output_path, title in jobs:
+        render_profile(profile, output_path, title)
+    return len(jobs)
+
+
+def render_profiles(jobs, workers=1, batch_size=16):
+    """
+    Renders many per-sample plots.
+
+    Parameters:
+    - jobs (list): (profile, output_path, title) tuples, profiles as returned by binned_profile.
+    - workers (int): Number of rendering processes. 1 renders in this process.
+    - batch_size (int): Plots sent to a worker at a time.
+    """
+    batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+    if workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_render_batch, batches))
+    else:
+        for batch in batches:
+            _render_batch(batch)
+
+
+def plot_small_multiples(profiles, output_path, columns=6, title=None):
+    """
+    Saves the depth profiles of many samples as a grid of small plots with a shared x axis.
+
+    Parameters:
+    - profiles (dict): {sample_id: profile}, profiles as returned by binned_profile. They are
+      re-binned to SMALL_MULTIPLE_BINS, which is plenty for a 2 x 1.6 inch panel. Profiles without
+      depth data are left out.
+    - output_path (str): Path of the image.
+    - columns (int): Plots per row.
+    - title (str, optional): Title of the figure.
+    """
+    from matplotlib.ticker import MaxNLocator
+
+    profiles = _common_bins(profiles, SMALL_MULTIPLE_BINS)
+    if not profiles:
+        print(f"No depth data to plot, {output_path} not saved")
+        return
+    rows = max(1, -(-len(profiles) // columns))
+    height = 1.6 * rows + 0.6
+    figure = _new_figure((2.2 * columns, height))
+    # fixed margins instead of tight_layout, which measures every tick label of every panel
+    figure.subplots_adjust(left=0.04, right=0.99, bottom=0.3 / height, top=1 - 0.6 / height,
+                           wspace=0.25, hspace=0.45)
+    axes_grid = figure.subplots(rows, columns, sharex=True, squeeze=False)
+
+    for axes, (sample, (centers, means, lows, highs)) in zip(axes_grid.flat, profiles.items()):
+        axes.fill_between(centers, lows, highs, color=COLOR, alpha=0.3, linewidth=0)
+        axes.plot(centers, means, color=COLOR, linewidth=0.6)
+        axes.set_title(sample, fontsize=7)
+        axes.tick_params(labelsize=6)
+        axes.xaxis.set_major_locator(MaxNLocator(3))
+        axes.yaxis.set_major_locator(MaxNLocator(3))
+    for axes in list(axes_grid.flat)[len(profiles):]:
+        axes.set_visible(False)
+
+    if title:
+        figure.suptitle(title)
+    figure.savefig(output_path, dpi=100, pil_kwargs=PNG_OPTIONS)
+
+
+def plot_depth_heatmap(profiles, output_path, title=None, normalize=True):
+    """
+    Saves the depth profiles of many samples as a heatmap, one row per sample.
+
+    Parameters:
+    - profiles (dict): {sample_id: profile}, all binned on the same range (binned_profile with start and end).
+    - output_path (str): Path of the image.
+    - title (str, optional): Title of the figure.
+    - normalize (bool): If True, every row is divided by the sample's mean depth.
+    Profiles without depth data are left out.
+    """
+    profiles = _nonempty_profiles(profiles)
+    if not profiles:
+        print(f"No depth data to plot, {output_path} not saved")
+        return
+    samples = list(profiles)
+    matrix = np.vstack([profiles[sample][1] for sample in samples])
+    if normalize:
+        row_means = np.nanmean(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, row_means, out=np.full_like(matrix, np.nan), where=row_means > 0)
+    centers = profiles[samples[0]][0]
+
+    figure = _new_figure((12, max(3, 0.12 * len(samples) + 1.5)))
+    axes = figure.add_subplot()
+    image = axes.imshow(matrix, aspect='auto', interpolation='nearest', cmap='viridis',
+                        extent=(centers[0], centers[-1], len(samples) - 0.5, -0.5))
+    axes.set_yticks(range(len(samples)))
+    axes.set_yticklabels(samples, fontsize=max(2, min(8, 600 // max(len(samples), 1))))
+    axes.set_xlabel('Position')
+    figure.colorbar(image, ax=axes, label='Depth / sample mean' if normalize else 'Depth')
+    if title:
+        axes.set_title(title)
+    figure.tight_layout()
+    figure.savefig(output_path, dpi=100, pil_kwargs=PNG_OPTIONS)
+
+
+def _load_profile(file_path, bins=PLOT_BINS):
+    from split_depth_files import load_depth_array
+
+    _, positions, depths = load_depth_array(file_path)
+    return binned_profile(positions, depths, bins)
+
+
+def _nonempty_profiles(profiles):
+    """Leaves out the profiles without depth data (e.g. no depth rows in the region), with a warning."""
+    empty = [sample for sample, profile in profiles.items() if np.isnan(profile[1]).all()]
+    if empty:
+        print(f"Warning: no depth data for {len(empty)} samples, left out of the plot: {' '.join(empty)}")
+    return {sample: profile for sample, profile in profiles.items() if sample not in empty}
+
+
+def _common_bins(profiles, bins):
+    """Re-bins decimated profiles onto one position range, so heatmap columns line up; empty profiles are left out."""
+    profiles = _nonempty_profiles(profiles)
+    if not profiles:
+        return {}
+    start = min(profile[0][0] for profile in profiles.values())
+    end = max(profile[0][-1] for profile in profiles.values())
+    rebinned = {}
+    for sample, (centers, means, _, _) in profiles.items():
+        valid = ~np.isnan(means)
+        rebinned[sample] = binned_profile(centers[valid], means[valid], bins, start, end)
+    return rebinned
+
+
+def plot_project_depths(Project_ID=None, root_dir=None, input_dir=None, output_dir=None, rDNA_types=('45S', '5S'),
+                        per_sample=True, small_multiples=True, heatmap=True, bins=PLOT_BINS, heatmap_bins=400, workers=1):
+    """
+    Plot-rendering stage for QC: per-sample depth profiles, and per rDNA type a small-multiples
+    grid and a heatmap of all samples.
+
+    Parameters:
+    - Project_ID (str, optional): The TCGA project
+    - root_dir (str, optional): The root directory where the project data is stored.
+    - input_dir (str, optional): Directory with the depth files; '<root_dir>/<Project_ID>/depth_results_blood' by default.
+    - output_dir (str, optional): Where the images are saved; '<root_dir>/<Project_ID>/depth_plots' by default.
+    - rDNA_types (tuple): rDNA types to plot, e.g. ('45S', '5S', '18S') with the split depth directory.
+    - per_sample (bool): Save '<sample>_<rDNA_type>_depth_distribution.png' for every sample.
+    - small_multiples (bool): Save '<rDNA_type>_small_multiples.png'.
+    - heatmap (bool): Save '<rDNA_type>_heatmap.png'.
+    - bins (int): Bins of the per-sample and small-multiples profiles.
+    - heatmap_bins (int): Bins of the heatmap columns.
+    - workers (int): Number of processes loading depth files and rendering per-sample plots.
+    The heatmap re-bins the decimated profiles, so every depth file is read once.
+    """
+    if Project_ID and root_dir:
+        input_dir = input_dir or os.path.join(root_dir, Project_ID, "depth_results_blood")
+        output_dir = output_dir or os.path.join(root_dir, Project_ID, "depth_plots")
+    elif not input_dir or not output_dir:
+        raise ValueError("Either (Project_ID and root_dir) or (input_dir and output_dir) must be provided.")
+    os.makedirs(output_dir, exist_ok=True)
+
+    from depth_text import DEPTH_FILE_EXTS
+
+    for rDNA_type in rDNA_types:
+        files = {filename.split('_')[0]: os.path.join(input_dir, filename)
+                 for filename in sorted(os.listdir(input_dir))
+                 if filename.endswith(DEPTH_FILE_EXTS) and len(filename.split('_')) > 2 and filename.split('_')[2] == rDNA_type}
+        if not files:
+            continue
+        samples = list(files)
+        file_paths = [files[sample] for sample in samples]
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                profiles = dict(zip(samples, executor.map(_load_profile, file_paths, [bins] * len(samples))))
+        else:
+            profiles = {sample: _load_profile(file_path, bins) for sample, file_path in zip(samples, file_paths)}
+
+        if per_sample:
+            jobs = [(profile, os.path.join(output_dir, f"{sample}_{rDNA_type}_depth_distribution.png"),
+                     f"{sample} {rDNA_type} Depth Distribution") for sample, profile in profiles.items()]
+            render_profiles(jobs, workers)
+        if small_multiples:
+            plot_small_multiples(profiles, os.path.join(output_dir, f"{rDNA_type}_small_multiples.png"),
+                                 title=f"{Project_ID or ''} {rDNA_type} depth".strip())
+        if heatmap:
+            plot_depth_heatmap(_common_bins(profiles, heatmap_bins), os.path.join(output_dir, f"{rDNA_type}_heatmap.png"),
+                               title=f"{Project_ID or ''} {rDNA_type} depth / sample mean".strip())
+        print(f"Plotted {len(samples)} {rDNA_type} depth profiles in {output_dir}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        plot_project_depths(sys.argv[1], sys.argv[2], workers=workers)
+    else:
+        print("Usage: python depth_plots.py <Project_ID> <root_dir> [workers]")
+
+# Example usage:
+#python calculate_CN_TCGA_py/depth_plots.py TCGA-BLCA CN_results 16
+#plot_project_depths(input_dir="CN_results/TCGA-BLCA/depth_results_blood_5s_45s_18s_5.8s_28s", output_dir="qc", rDNA_types=("18S", "28S"))
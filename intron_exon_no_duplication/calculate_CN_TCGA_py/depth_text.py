@@ -0,0 +1,123 @@
+import io
+import gzip
+import shutil
+import signal
+import tempfile
+import subprocess
+from depth_binary import DEPTH_BINARY_EXT
+
+try:
+    from isal import igzip, igzip_threaded
+except ImportError:  # python-isal is optional
+    igzip = igzip_threaded = None
+
+# `samtools depth` text files may be kept gzip or bgzip compressed ('.txt.gz', '.txt.bgz').
+# Compression is detected from the first bytes of the file, not from its name. Compressed files
+# are decompressed with python-isal if installed, otherwise with pigz if it is on the PATH,
+# otherwise with the gzip module; bgzip files are multi-member gzip and work with all three.
+
+DEPTH_TEXT_EXTS = (".txt", ".txt.gz", ".txt.bgz")
+DEPTH_FILE_EXTS = DEPTH_TEXT_EXTS + (DEPTH_BINARY_EXT,)
+
+# Bytes buffered per read of a depth text file
+READ_BUFFER_SIZE = 16 * 1024 * 1024
+# Threads used by isal/pigz to decompress one file
+DECOMPRESS_THREADS = 4
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_depth_file(file_name):
+    """Returns True if file_name is a text (plain or compressed) or binary depth file (by extension)."""
+    return file_name.endswith(DEPTH_FILE_EXTS)
+
+
+def depth_file_stem(file_name):
+    """Removes the depth file extension, e.g. 'S1_chr1_exon_depth.txt.gz' -> 'S1_chr1_exon_depth'."""
+    for extension in sorted(DEPTH_FILE_EXTS, key=len, reverse=True):
+        if file_name.endswith(extension):
+            return file_name[:-len(extension)]
+    return file_name
+
+
+def is_gzip_file(file_path):
+    """Returns True if the file starts with the gzip magic bytes (gzip and bgzip)."""
+    with open(file_path, 'rb') as file:
+        return file.read(2) == _GZIP_MAGIC
+
+
+class _PigzReader(io.BufferedReader):
+    """Binary stream over the output of `pigz -dc`; a failed decompression raises on close."""
+
+    def __init__(self, file_path):
+        self._file_path = file_path
+        # stderr goes to a file: a pipe that is only read on close would block pigz once it fills up
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(["pigz", "-dc", "-p", str(DECOMPRESS_THREADS), file_path],
+                                         stdout=subprocess.PIPE, stderr=self._stderr, bufsize=0)
+        super().__init__(self._process.stdout, READ_BUFFER_SIZE)
+
+    def close(self):
+        if self.closed:
+            return
+        # pigz only gets SIGPIPE if the stream is closed before the end of its output
+        closed_early = bool(self.peek(1))
+        super().close()
+        returncode = self._process.wait()
+        # the end of the log is enough to report the error
+        self._stderr.seek(max(0, self._stderr.seek(0, io.SEEK_END) - 4096))
+        error = self._stderr.read().decode(errors="replace").strip()
+        self._stderr.close()
+        if returncode == -signal.SIGPIPE and closed_early:
+            return
+        if returncode < 0:  # killed, e.g. by the OOM killer or Slurm: the output is truncated
+            raise OSError(f"pigz was killed by {signal.Signals(-returncode).name} on {self._file_path}: {error}")
+        if returncode > 0:
+            raise OSError(f"pigz failed on {self._file_path}: {error}")
+
+
+def _open_gzip(file_path):
+    if igzip_threaded is not None:
+        return igzip_threaded.open(file_path, 'rb', threads=DECOMPRESS_THREADS, block_size=READ_BUFFER_SIZE)
+    if shutil.which("pigz"):
+        return _PigzReader(file_path)
+    return io.BufferedReader(gzip.open(file_path, 'rb'), READ_BUFFER_SIZE)
+
+
+def open_depth_text(file_path, mode='rb'):
+    """
+    Opens a depth text file for reading, decompressing gzip/bgzip files transparently.
+
+    Parameters:
+    - file_path (str): Path to a plain or gzip/bgzip compressed depth text file.
+    - mode (str): 'rb' for a binary stream, 'r' for a text stream.
+
+    Returns:
+    - A file object; use it as a context manager.
+    """
+    if mode not in ('r', 'rb'):
+        raise ValueError(f"Unsupported mode: {mode}")
+    if not is_gzip_file(file_path):
+        return open(file_path, mode, buffering=READ_BUFFER_SIZE)
+    stream = _open_gzip(file_path)
+    return io.TextIOWrapper(stream) if mode == 'r' else stream
+
+
+def open_depth_stream(stream, mode='rb'):
+    """
+    Like open_depth_text, for a depth text file that is already open as a buffered binary stream
+    (e.g. a stream of prefetch_io.iter_prefetched). gzip/bgzip data is detected from its first bytes
+    and decompressed with python-isal if installed, otherwise with the gzip module.
+
+    Parameters:
+    - stream (io.BufferedReader): Binary stream at the start of the file; close it after the
+      returned file object.
+    - mode (str): 'rb' for a binary stream, 'r' for a text stream.
+    """
+    if mode not in ('r', 'rb'):
+        raise ValueError(f"Unsupported mode: {mode}")
+    if stream.peek(2)[:2] == _GZIP_MAGIC:
+        gzip_module = igzip if igzip is not None else gzip
+        stream = io.BufferedReader(gzip_module.GzipFile(fileobj=stream, mode='rb'), READ_BUFFER_SIZE)
+    return io.TextIOWrapper(stream) if mode == 'r' else stream
+
@@ -1,29 +1,151 @@
 import average_depth
-import calculate_all_CN
 import split_depth_files
+import rDNA_regions
+import manifest
+import run_report
+import prefetch_io
 import os
-import shutil
-import pandas as pd
-import matplotlib.pyplot as plt
-import sys
+import argparse
 
-def main(Project_ID=None, root_dir=None):
-    split_depth_files.split_depth_files(Project_ID, root_dir)
-    average_depth.process_depth_files_for_all_rDNA(Project_ID, root_dir)
-    calculate_all_CN.caculate_CN_for_all_rDNA(Project_ID, root_dir)
+# pandas is only imported by the copy number step (calculate_all_CN) and matplotlib only for plots,
+# so runs with averages_only=True and CSV output start with numpy as the only heavy import.
+
+
+def _calculate_CN(Project_ID, root_dir, per_type_CN, output_format, stream=False):
+    import calculate_all_CN
+
+    with run_report.stage("calculate_CN"):
+        if stream:
+            calculate_all_CN.calculate_CN_for_all_rDNA_streaming(Project_ID, root_dir, write_per_type=per_type_CN, output_format=output_format)
+        else:
+            calculate_all_CN.calculate_CN_for_all_rDNA_vectorized(Project_ID, root_dir, write_per_type=per_type_CN, output_format=output_format)
+
+
+def _run(Project_ID, root_dir, use_views, write_split_files, region_file, incremental, force, use_cache, per_type_CN,
+         output_format, averages_only, stream, prefetch_depth, read_size):
+    if incremental:
+        # only new or changed depth files are read, the others come from the manifest
+        ranges = rDNA_regions.load_region_registry(region_file) if region_file else split_depth_files.RRNA_RANGES
+        with run_report.stage("manifest"):
+            aggregates = manifest.update_rDNA_aggregates(Project_ID, root_dir, ranges, force=force)
+        output_dir = os.path.join(root_dir, Project_ID, "average_depth_blood_csv")
+        with run_report.stage("average_depth"):
+            average_depth.save_average_depth_summaries(manifest.aggregates_to_averages(aggregates), output_dir, Project_ID,
+                                                       output_format=output_format)
+        if not averages_only:
+            _calculate_CN(Project_ID, root_dir, per_type_CN, output_format, stream)
+        return
+
+    # read-ahead of the depth files (prefetch_io.py); the time still blocked on I/O is printed at the end
+    io_stats = prefetch_io.new_io_stats()
+    io_options = {"prefetch_depth": prefetch_depth, "read_size": read_size, "io_stats": io_stats}
+    if region_file:
+        # every region of the registry is aggregated in the same single read of the 45S file
+        use_views = True
+    if write_split_files:
+        # the split files are written from the views
+        use_views = True
+    if use_views:
+        # 18S/5.8S/28S are views over the 45S depth array, no copy and no split files
+        ranges = rDNA_regions.load_region_registry(region_file) if region_file else split_depth_files.RRNA_RANGES
+        with run_report.stage("split_depth_views"):
+            views = split_depth_files.split_depth_views(Project_ID, root_dir, write_split_files=write_split_files, ranges=ranges,
+                                                        **io_options)
+        with run_report.stage("average_depth"):
+            average_depth.process_depth_files_for_all_rDNA(Project_ID, root_dir, views=views, output_format=output_format)
+    else:
+        with run_report.stage("split_depth_files"):
+            split_depth_files.split_depth_files(Project_ID, root_dir, **io_options)
+        cache_file = os.path.join(root_dir, Project_ID, "aggregate_cache.sqlite") if use_cache else None
+        with run_report.stage("average_depth"):
+            average_depth.process_depth_files_for_all_rDNA(Project_ID, root_dir, cache_file=cache_file, output_format=output_format,
+                                                           **io_options)
+    if prefetch_depth:
+        print(prefetch_io.format_io_stats(io_stats))
+    if not averages_only:
+        _calculate_CN(Project_ID, root_dir, per_type_CN, output_format, stream)
+
+def main(Project_ID=None, root_dir=None, use_views=False, write_split_files=False, region_file=None,
+         incremental=False, force=False, use_cache=False, per_type_CN=True, output_format="csv",
+         report_file=None, profile=None, averages_only=False, stream=False, prefetch_depth=0,
+         read_size=prefetch_io.PREFETCH_READ_SIZE):
+    """
+    Splits depth files, calculates average depth and copy number for all rDNA regions of a project.
+
+    With report_file, wall time, files, bytes, lines and peak memory of every stage (and per rDNA type)
+    are saved to a JSON run report (see run_report.py). profile ('cprofile' or 'pyinstrument') also
+    profiles every stage into '<Project_ID>/profiles'. averages_only stops after the average depth
+    tables, without importing pandas (for CSV output). stream writes the copy number tables chunk by
+    chunk in bounded memory (calculate_CN_for_all_rDNA_streaming). prefetch_depth > 0 reads that many
+    depth files ahead in threads, in reads of read_size bytes, while the current one is parsed; the
+    time still spent waiting for I/O is printed and saved as 'io_wait_ms' in the run report.
+    """
+    if report_file is None and not profile:
+        _run(Project_ID, root_dir, use_views, write_split_files, region_file, incremental, force, use_cache, per_type_CN,
+             output_format, averages_only, stream, prefetch_depth, read_size)
+        return
+
+    report_file = report_file or os.path.join(root_dir, Project_ID, "run_report.json")
+    run_report.start_report(Project_ID, profile=profile, profile_dir=os.path.join(root_dir, Project_ID, "profiles"))
+    status = "failed"
+    try:
+        _run(Project_ID, root_dir, use_views, write_split_files, region_file, incremental, force, use_cache, per_type_CN,
+             output_format, averages_only, stream, prefetch_depth, read_size)
+        status = "done"
+    finally:
+        report = run_report.finish_report()
+        report["run"]["status"] = status
+        run_report.save_report(report, report_file)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculate rDNA copy number for one TCGA project.")
+    parser.add_argument("Project_ID", nargs="?", help="the TCGA project ID, e.g. TCGA-BLCA")
+    parser.add_argument("root_dir", nargs="?", help="the root directory where the project data is stored")
+    parser.add_argument("--views", action="store_true",
+                        help="compute 18S/5.8S/28S from views over the 45S depth instead of copying and splitting files")
+    parser.add_argument("--write_split_files", action="store_true",
+                        help="with --views, still write the 18S/5.8S/28S depth files; implies --views")
+    parser.add_argument("--regions", nargs="?", const=rDNA_regions.DEFAULT_REGION_FILE, default=None,
+                        help="region registry file (default rDNA_regions.tsv: 5ETS, 18S, ITS1, 5.8S, ITS2, 28S, 3ETS); implies --views")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only read new or changed depth files, reusing the aggregates in <Project_ID>/manifest.json")
+    parser.add_argument("--force", action="store_true",
+                        help="with --incremental, ignore the manifest and re-read every depth file")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep exact depth sums in <Project_ID>/aggregate_cache.sqlite and skip unchanged files")
+    parser.add_argument("--skip_per_type_CN", action="store_true",
+                        help="only write <Project_ID>_CN_all.csv, not the per-type files in copy_number_results")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="format of the average depth and copy number tables; parquet needs pyarrow")
+    parser.add_argument("--report", nargs="?", const="", default=None,
+                        help="save a JSON run report with time, files, bytes, lines and peak memory per stage (default <Project_ID>/run_report.json)")
+    parser.add_argument("--averages_only", action="store_true",
+                        help="stop after the average depth tables in <Project_ID>/average_depth_blood_csv (fast path, no pandas with CSV)")
+    parser.add_argument("--stream", action="store_true",
+                        help="write the copy number tables chunk by chunk, in bounded memory")
+    parser.add_argument("--prefetch", type=int, nargs="?", const=prefetch_io.PREFETCH_DEPTH, default=0,
+                        help=f"read this many depth files ahead in threads (default {prefetch_io.PREFETCH_DEPTH}), for network filesystems")
+    parser.add_argument("--read_size", type=float, default=prefetch_io.PREFETCH_READ_SIZE / 1024 / 1024,
+                        help="MB per read of the prefetch threads")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"],
+                        help="profile every stage into <Project_ID>/profiles (implies --report)")
+    args = parser.parse_args()
+
     # Check if command-line arguments are provided
-    if len(sys.argv) > 2:
-        Project_ID = sys.argv[1]
-        root_dir = sys.argv[2]
+    if args.Project_ID and args.root_dir:
+        Project_ID = args.Project_ID
+        root_dir = args.root_dir
         #no additional parsing needed since sys.argv passes the raw string as-is from the command line
         print(f"Project_ID: {Project_ID}")
         print(f"root_dir: {root_dir}")
         print(f"Whether path is exist: {os.path.exists(root_dir)}")
-        main(Project_ID, root_dir)
+        main(Project_ID, root_dir, use_views=args.views, write_split_files=args.write_split_files, region_file=args.regions,
+             incremental=args.incremental, force=args.force, use_cache=args.cache,
+             per_type_CN=not args.skip_per_type_CN, output_format=args.format,
+             report_file=args.report, profile=args.profile, averages_only=args.averages_only,
+             stream=args.stream, prefetch_depth=args.prefetch, read_size=int(args.read_size * 1024 * 1024))
     else:
-        print("No arguments provided. Usage: python main.py <Project_ID> <root_dir>")  # error, no arguments provided
+        print("No arguments provided. Usage: python main.py <Project_ID> <root_dir> [--views] [--write_split_files] [--regions [file]] [--incremental [--force]] [--cache] [--skip_per_type_CN] [--format csv|parquet] [--report [file]] [--profile cprofile|pyinstrument] [--averages_only] [--stream] [--prefetch [N]] [--read_size MB]")  # error, no arguments provided
 
 #     - Project_ID (str): The TCGA project ID.
 #     - root_dir (str): The root directory where the project data is stored.
@@ -37,3 +159,10 @@ if __name__ == "__main__":
 #cp -r TCGA-LUSC/depth_results_blood CN_results/TCGA-LUSC
 #cp BRD_Results/TCGA-LUSC/blood_all_BRD.csv BRD_Results/TCGA-LUSC/blood_chr13_14_15_21_22_exon_BRD.csv BRD_Results/TCGA-LUSC/blood_chr1_exon_intron.csv CN_results/TCGA-LUSC
 #python calculate_CN_TCGA_py/main.py "TCGA-LUSC" "/home/Projects/CopyNumber_Calculation_test/CN_results"
+#python calculate_CN_TCGA_py/main.py "TCGA-LUSC" "/home/Projects/CopyNumber_Calculation_test/CN_results" --views
+#python calculate_CN_TCGA_py/main.py "TCGA-LUSC" "/home/Projects/CopyNumber_Calculation_test/CN_results" --regions
+#python calculate_CN_TCGA_py/main.py "TCGA-LUSC" "/home/Projects/CopyNumber_Calculation_test/CN_results" --incremental
+#python calculate_CN_TCGA_py/main.py "TCGA-LUSC" "/home/Projects/CopyNumber_Calculation_test/CN_results" --views --format parquet
+#python calculate_CN_TCGA_py/main.py "TCGA-LUSC" "/home/Projects/CopyNumber_Calculation_test/CN_results" --report --profile cprofile
+#python calculate_CN_TCGA_py/main.py "TCGA-LUSC" "/home/Projects/CopyNumber_Calculation_test/CN_results" --regions --stream --format parquet
+#python calculate_CN_TCGA_py/main.py "TCGA-LUSC" "/home/user/CancerEvolution/CN_results" --views --prefetch 8 --read_size 16
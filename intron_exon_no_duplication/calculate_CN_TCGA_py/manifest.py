@@ -0,0 +1,124 @@
+import os
+import json
+import numpy as np
+from aggregate_cache import file_sha256
+from depth_text import DEPTH_FILE_EXTS
+from split_depth_files import load_depth_array, region_views
+import run_report
+
+# The manifest ('<root_dir>/<Project_ID>/manifest.json') records, for every 5S/45S depth file of
+# depth_results_blood, its size, mtime and SHA-256 together with the exact (sum, count) of every
+# rDNA type derived from it. A file whose size and mtime are unchanged, or whose content hash is
+# unchanged, is not read again.
+
+MANIFEST_VERSION = 1
+
+
+def load_manifest(manifest_file):
+    """Loads a manifest, or returns an empty one if it is missing or of another version."""
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r') as file:
+            manifest = json.load(file)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def save_manifest(manifest, manifest_file):
+    """Saves a manifest atomically, so an interrupted run never leaves a truncated file."""
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def compute_aggregates(file_path, rDNA_type, ranges):
+    """
+    Reads one depth file and returns the exact (sum, count) of its rDNA type and, for 45S files,
+    of every region in ranges.
+    """
+    _, positions, depths = load_depth_array(file_path)
+    run_report.count(rDNA_type, files=1, bytes=os.path.getsize(file_path), lines=len(depths))
+    arrays = {rDNA_type: depths}
+    if rDNA_type == '45S':
+        arrays.update({region: region_depths for region, (_, region_depths) in region_views(positions, depths, ranges).items()})
+    return {name: [int(np.sum(values, dtype=np.int64)), len(values)] for name, values in arrays.items()}
+
+
+def update_rDNA_aggregates(Project_ID, root_dir, ranges, force=False):
+    """
+    Brings the manifest of a project up to date and returns the aggregates of all samples.
+    Only new or changed depth files are read.
+
+    Parameters:
+    - Project_ID (str): The TCGA project
+    - root_dir (str): The root directory where the project data is stored.
+    - ranges (dict): {region: (start, end)} regions on the 45S reference.
+    - force (bool): If True, ignores the existing manifest and re-reads every depth file.
+
+    Returns:
+    - dict: {rDNA_type: {sample_id: (total depth, number of positions)}} for 5S, 45S and every region.
+    """
+    input_dir = os.path.join(root_dir, Project_ID, "depth_results_blood")
+    manifest_file = os.path.join(root_dir, Project_ID, "manifest.json")
+
+    old_manifest = {"version": MANIFEST_VERSION, "files": {}} if force else load_manifest(manifest_file)
+    ranges_key = {region: list(bounds) for region, bounds in ranges.items()}
+    # 45S aggregates are only reusable if they were computed for the same regions
+    same_ranges = old_manifest.get("ranges") == ranges_key
+    new_manifest = {"version": MANIFEST_VERSION, "ranges": ranges_key, "files": {}}
+
+    reused = 0
+    processed = 0
+    for filename in sorted(os.listdir(input_dir)):
+        if not filename.endswith(DEPTH_FILE_EXTS) or len(filename.split('_')) < 3:
+            continue
+        rDNA_type = filename.split('_')[2]
+        if rDNA_type not in ('5S', '45S'):
+            continue
+
+        file_path = os.path.join(input_dir, filename)
+        stat = os.stat(file_path)
+        entry = old_manifest["files"].get(filename)
+        if entry and (rDNA_type == '5S' or same_ranges):
+            if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                new_manifest["files"][filename] = entry
+                run_report.count(rDNA_type, reused_files=1)
+                reused += 1
+                continue
+            sha256 = file_sha256(file_path)
+            if entry["sha256"] == sha256:
+                new_manifest["files"][filename] = dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                run_report.count(rDNA_type, reused_files=1, hashed_bytes=stat.st_size)
+                reused += 1
+                continue
+        else:
+            sha256 = file_sha256(file_path)
+
+        new_manifest["files"][filename] = {
+            "sample": filename.split('_')[0],  # Extract sample ID, e.g., 'TCGA-4Z-AA7Y-10A'
+            "rDNA_type": rDNA_type,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+            "aggregates": compute_aggregates(file_path, rDNA_type, ranges)
+        }
+        processed += 1
+
+    save_manifest(new_manifest, manifest_file)
+    print(f"Manifest {manifest_file}: {processed} new or changed depth files processed, {reused} reused.")
+
+    aggregates = {rDNA_type: {} for rDNA_type in ['5S', '45S', *ranges]}
+    for filename, entry in new_manifest["files"].items():
+        for name, (total_depth, total_length) in entry["aggregates"].items():
+            aggregates[name][entry["sample"]] = (total_depth, total_length)
+    return aggregates
+
+
+def aggregates_to_averages(aggregates):
+    """Converts {rDNA_type: {sample_id: (sum, count)}} to average depths, 0 when there are no positions."""
+    return {
+        rDNA_type: {sample: total_depth / total_length if total_length else 0
+                    for sample, (total_depth, total_length) in samples.items()}
+        for rDNA_type, samples in aggregates.items()
+    }
@@ -0,0 +1,202 @@
+import io
+import time
+import queue
+import threading
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import run_report
+
+# Read-ahead of depth files on filesystems with a high per-file latency (shared cluster storage).
+#
+# iter_prefetched() opens the next `depth` files of a list in a thread pool and reads each of them
+# with large sequential reads into a small queue of blocks, while the caller parses the current
+# file. Each file is handed over as a buffered binary stream, so the usual parsers work unchanged
+# (depth_text.open_depth_stream adds gzip/bgzip decompression). At most
+# depth * PREFETCH_BLOCKS * read_size bytes are buffered ahead. prefetch_files() wraps it for loops
+# that also skip files: open_prefetched(file_path) returns the stream of a prefetched file, or None
+# for a file that is read the usual way.
+#
+# The time the caller waits for data that has not arrived yet is counted as 'wait_seconds': it is
+# the I/O time that was not hidden behind parsing. The background read time is 'read_seconds'.
+
+# Files opened and read ahead of the one being parsed
+PREFETCH_DEPTH = 4
+# Bytes per read
+PREFETCH_READ_SIZE = 8 * 1024 * 1024
+# Blocks buffered per file before its reader thread waits for the parser
+PREFETCH_BLOCKS = 2
+
+_END = b""
+
+
+def new_io_stats():
+    """Returns an empty I/O statistics dict, filled by iter_prefetched."""
+    return {"files": 0, "bytes": 0, "read_seconds": 0.0, "wait_seconds": 0.0}
+
+
+def format_io_stats(stats):
+    """One-line summary of I/O statistics, e.g. for the log of a run."""
+    return (f"Prefetched {stats['files']} files ({stats['bytes'] / 1024 / 1024:.1f} MB) in {stats['read_seconds']:.2f} s "
+            f"of background reads, blocked on I/O for {stats['wait_seconds']:.2f} s")
+
+
+class _PrefetchRaw(io.RawIOBase):
+    """Raw stream over the blocks queued by the reader thread of one file."""
+
+    def __init__(self, file_path, blocks, cancel, stats):
+        self.name = file_path
+        self._blocks = blocks
+        self._cancel = cancel
+        self._stats = stats
+        self._pending = memoryview(_END)
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            if self._eof:
+                return 0
+            start = time.perf_counter()
+            block = self._blocks.get()
+            self._stats["wait_seconds"] += time.perf_counter() - start
+            if isinstance(block, BaseException):
+                self._eof = True
+                raise block
+            if not block:
+                self._eof = True
+                return 0
+            self._pending = memoryview(block)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        # a stream closed before its end stops the reader thread
+        self._cancel.set()
+        super().close()
+
+
+def _read_file(file_path, blocks, cancel, read_size, stats):
+    """Reader thread: queues the blocks of one file, then an empty block (or the error)"""
+    def put(item):
+        while not cancel.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        start = time.perf_counter()
+        with open(file_path, 'rb', buffering=0) as file:
+            while True:
+                block = file.read(read_size)
+                stats["bytes"] += len(block)
+                if not block:
+                    break
+                stats["read_seconds"] += time.perf_counter() - start
+                if not put(block):
+                    return
+                start = time.perf_counter()
+        stats["read_seconds"] += time.perf_counter() - start
+        put(_END)
+    except OSError as error:
+        put(error)
+
+
+def iter_prefetched(file_paths, depth=PREFETCH_DEPTH, read_size=PREFETCH_READ_SIZE, stats=None):
+    """
+    Yields (file_path, stream) for every file in order, reading the next files ahead in threads.
+
+    Parameters:
+    - file_paths (iterable): Files to read, in the order they are parsed.
+    - depth (int): Number of files opened and read ahead (threads).
+    - read_size (int): Bytes per read; also the buffer size of the streams.
+    - stats (dict, optional): Dict from new_io_stats(); files, bytes, read_seconds and wait_seconds
+      are added to it. The totals are also added to the run report (prefetched_files,
+      prefetched_bytes, io_wait_ms).
+
+    Each stream is a binary io.BufferedReader and must be read (or closed) before the next item is
+    requested; it is closed when the next item is yielded.
+    """
+    totals = new_io_stats()
+    file_paths = iter(file_paths)
+    pending = deque()  # (file_path, blocks, cancel, per-file stats)
+    executor = ThreadPoolExecutor(max_workers=max(1, depth), thread_name_prefix="prefetch")
+
+    def submit():
+        file_path = next(file_paths, None)
+        if file_path is None:
+            return False
+        blocks = queue.Queue(maxsize=PREFETCH_BLOCKS)
+        cancel = threading.Event()
+        file_stats = {"bytes": 0, "read_seconds": 0.0, "wait_seconds": 0.0}
+        executor.submit(_read_file, file_path, blocks, cancel, read_size, file_stats)
+        pending.append((file_path, blocks, cancel, file_stats))
+        return True
+
+    stream = None
+    file_stats = None
+    try:
+        while len(pending) < max(1, depth) and submit():
+            pass
+        while pending:
+            file_path, blocks, cancel, file_stats = pending.popleft()
+            submit()
+            stream = io.BufferedReader(_PrefetchRaw(file_path, blocks, cancel, file_stats), read_size)
+            yield file_path, stream
+            stream.close()
+            stream = None
+            _add_stats(totals, file_stats)
+    finally:
+        if stream is not None:
+            stream.close()
+            _add_stats(totals, file_stats)
+        for _, _, cancel, _ in pending:
+            cancel.set()
+        executor.shutdown(wait=True)
+        if stats is not None:
+            for key, value in totals.items():
+                stats[key] += value
+        run_report.count(prefetched_files=totals["files"], prefetched_bytes=totals["bytes"],
+                         io_wait_ms=totals["wait_seconds"] * 1000)
+
+
+def _add_stats(stats, file_stats):
+    stats["files"] += 1
+    for key in ("bytes", "read_seconds", "wait_seconds"):
+        stats[key] += file_stats[key]
+
+
+@contextlib.contextmanager
+def prefetch_files(file_paths, depth=PREFETCH_DEPTH, read_size=PREFETCH_READ_SIZE, stats=None):
+    """
+    Context manager over iter_prefetched that yields open_prefetched(file_path): the stream of
+    file_path if it is in file_paths, None otherwise (and always None if depth is 0). Files of
+    file_paths must be opened in their order.
+
+    with prefetch_files(text_files, depth) as open_prefetched:
+        for file_path in all_files:
+            stream = open_prefetched(file_path)  # None: read file_path directly
+    """
+    file_paths = list(file_paths) if depth else []
+    wanted = set(file_paths)
+    items = iter_prefetched(file_paths, depth, read_size, stats)
+
+    def open_prefetched(file_path):
+        if file_path not in wanted:
+            return None
+        next_path, stream = next(items)
+        if next_path != file_path:
+            raise ValueError(f"Prefetched files opened out of order: {file_path} instead of {next_path}")
+        return stream
+
+    try:
+        yield open_prefetched
+    finally:
+        items.close()
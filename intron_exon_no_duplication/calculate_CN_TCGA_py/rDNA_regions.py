@@ -0,0 +1,45 @@
+import os
+
+# Default region registry, next to this script
+DEFAULT_REGION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rDNA_regions.tsv")
+
+
+def load_region_registry(region_file=None, extra_regions=None):
+    """
+    Loads the rDNA region registry from a tab-separated file with columns region, start, end.
+
+    Parameters:
+    - region_file (str, optional): Path to the region file. Defaults to rDNA_regions.tsv.
+    - extra_regions (dict, optional): Additional user-defined windows {region: (start, end)}.
+
+    Returns:
+    - dict: {region: (start, end)} 1-based inclusive positions on the 45S reference, in file order.
+    """
+    region_file = region_file or DEFAULT_REGION_FILE
+    regions = {}
+
+    with open(region_file, 'r') as file:
+        for line in file:
+            if not line.strip() or line.startswith('#'):
+                continue
+            parts = line.strip().split('\t')
+            if parts[0] == "region":  # header
+                continue
+            if len(parts) != 3:
+                raise ValueError(f"Invalid line in {region_file}: {line.strip()}")
+            regions[parts[0]] = (int(parts[1]), int(parts[2]))
+
+    regions.update(extra_regions or {})
+
+    for region, (start, end) in regions.items():
+        # Region names end up in '<sample>_<region>' labels and file names split on '_'
+        if '_' in region or '/' in region or region in ('5S', '45S'):
+            raise ValueError(f"Invalid region name: {region}")
+        if not 1 <= start <= end:
+            raise ValueError(f"Invalid range for {region}: {start}-{end}")
+
+    return regions
+
+# Example usage
+#regions = load_region_registry()
+#regions = load_region_registry(extra_regions={"window1": (1, 500)})
@@ -0,0 +1,149 @@
+import os
+import re
+import sys
+import json
+import time
+import resource
+import cProfile
+import contextlib
+
+# Structured telemetry of a main.py run, saved as a JSON run report.
+#
+# main.py opens a report with start_report() and wraps each step in stage(); the readers call
+# count() to add files, bytes and lines to the innermost running stage and to its parents, in
+# total and per rDNA type. Outside of a report, stage() and count() do nothing.
+# Peak RSS is the process peak (ru_maxrss), so a stage's 'rss_growth_mb' is how much it raised it.
+
+_report = None  # the report of the current run, see start_report
+
+
+def _peak_rss_mb():
+    unit = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS, in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1024 / 1024, 1)
+
+
+def start_report(name, profile=None, profile_dir=None):
+    """
+    Starts recording a run report.
+
+    Parameters:
+    - name (str): Name of the run, e.g. the Project_ID.
+    - profile (str, optional): 'cprofile' or 'pyinstrument' to profile every top-level stage.
+    - profile_dir (str, optional): Where profiles are saved ('<stage>.prof' or '<stage>.html').
+    """
+    global _report
+    if profile not in (None, "cprofile", "pyinstrument"):
+        raise ValueError(f"Unknown profiler: {profile}")
+    if profile:
+        os.makedirs(profile_dir, exist_ok=True)
+    _report = {
+        "run": {"name": name, "started": time.strftime("%Y-%m-%d %H:%M:%S"), "argv": sys.argv},
+        "stages": [],
+        "_stack": [],
+        "_profile": profile,
+        "_profile_dir": profile_dir,
+        "_start": time.perf_counter()
+    }
+
+
+def _new_stage(name, labels):
+    return {"name": name, **labels, "seconds": 0.0, "files": 0, "bytes": 0, "lines": 0,
+            "peak_rss_mb": 0.0, "rss_growth_mb": 0.0, "per_type": {}, "stages": []}
+
+
+@contextlib.contextmanager
+def _profiled(name):
+    profile = _report["_profile"]
+    file_name = re.sub(r"[^\w.-]+", "_", name)
+    if profile == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(_report["_profile_dir"], f"{file_name}.prof"))
+    else:
+        from pyinstrument import Profiler  # optional, only needed for profile='pyinstrument'
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(os.path.join(_report["_profile_dir"], f"{file_name}.html"), 'w') as file:
+                file.write(profiler.output_html())
+
+
+@contextlib.contextmanager
+def stage(name, **labels):
+    """
+    Records a stage of the current run: wall time, peak RSS and the counters added by count().
+    Stages can be nested; only top-level stages are profiled.
+
+    Parameters:
+    - name (str): Stage name, e.g. 'split_depth_files'.
+    - labels: Extra fields stored with the stage, e.g. rDNA_type='45S'.
+    """
+    if _report is None:
+        yield
+        return
+
+    record = _new_stage(name, labels)
+    stack = _report["_stack"]
+    (stack[-1]["stages"] if stack else _report["stages"]).append(record)
+    stack.append(record)
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        if _report["_profile"] and len(stack) == 1:
+            with _profiled(name):
+                yield
+        else:
+            yield
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 3)
+        record["peak_rss_mb"] = _peak_rss_mb()
+        record["rss_growth_mb"] = round(record["peak_rss_mb"] - rss_before, 1)
+        stack.pop()
+
+
+def count(rDNA_type=None, **counters):
+    """
+    Adds counters (files, bytes, lines, ...) to the running stages, in total and per rDNA type.
+    Does nothing outside of a stage.
+    """
+    if _report is None:
+        return
+    for record in _report["_stack"]:
+        targets = [record]
+        if rDNA_type:
+            targets.append(record["per_type"].setdefault(rDNA_type, {}))
+        for target in targets:
+            for key, value in counters.items():
+                target[key] = target.get(key, 0) + int(value)
+
+
+def finish_report():
+    """
+    Stops recording.
+
+    Returns:
+    - dict: The report, or None if no report was started.
+    """
+    global _report
+    if _report is None:
+        return None
+    report = {key: value for key, value in _report.items() if not key.startswith("_")}
+    report["run"]["seconds"] = round(time.perf_counter() - _report["_start"], 3)
+    report["run"]["peak_rss_mb"] = _peak_rss_mb()
+    _report = None
+    return report
+
+
+def save_report(report, report_file):
+    """Saves a run report as JSON."""
+    os.makedirs(os.path.dirname(os.path.abspath(report_file)), exist_ok=True)
+    with open(report_file, 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f"Run report saved to {report_file}")
@@ -1,9 +1,42 @@
 import os
 import shutil
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from depth_binary import DEPTH_BINARY_EXT, DepthBlock, is_depth_binary, read_depth_binary, slice_depth_blocks, write_depth_binary
+from depth_text import DEPTH_FILE_EXTS, DEPTH_TEXT_EXTS, open_depth_stream, open_depth_text
+from prefetch_io import PREFETCH_READ_SIZE, prefetch_files
+import run_report
 
+# Ranges of the rRNA regions on the 45S reference (1-based, inclusive)
+RRNA_RANGES = {
+    '18S': (3657, 5527),
+    '5.8S': (6623, 6779),
+    '28S': (7935, 12969)
+}
 
 
-def split_depth_files(Project_ID=None, root_dir=None, input_dir=None, output_dir=None, relabel_positions=True):
+def split_depth_file_binary(input_file, output_files, ranges, relabel_positions=True):
+    """
+    Splits a binary 45S depth file into binary depth files for each rRNA region.
+    Regions are sliced from the memory-mapped depth array, no text is parsed or written.
+
+    Parameters:
+    - input_file (str): Path to the binary 45S depth file.
+    - output_files (dict): {region: output path}.
+    - ranges (dict): {region: (start, end)} 1-based inclusive positions on the 45S reference.
+    - relabel_positions (bool): If True, re-labels position coordinates from 1 for each rRNA region.
+    """
+    blocks = read_depth_binary(input_file)
+    for region, (start, end) in ranges.items():
+        region_blocks = slice_depth_blocks(blocks, start, end)
+        if relabel_positions:
+            region_blocks = [DepthBlock(b.contig, b.start - start + 1, b.depths) for b in region_blocks]
+        write_depth_binary(output_files[region], region_blocks)
+
+
+def split_depth_files(Project_ID=None, root_dir=None, input_dir=None, output_dir=None, relabel_positions=True,
+                      prefetch_depth=0, read_size=PREFETCH_READ_SIZE, io_stats=None):
     """
     Processes 45S depth files in the specified input directory, splitting data into separate files
     for 18S, 5.8S, and 28S regions, with optional renumbering of positions from 1.
@@ -15,9 +48,13 @@ def split_depth_files(Project_ID=None, root_dir=None, input_dir=None, output_dir
     - output_dir (str, optional): Path to the directory where the output files will be saved.
     If Project_ID and root_dir are provided, input_dir and output_dir are generated automatically.
     - relabel_positions (bool): If True, re-labels position coordinates from 1 for each rRNA region.
+    - prefetch_depth (int): Files copied at the same time, and 45S text files read ahead in threads
+      while the current one is split (see prefetch_io.py); 0 handles them one after another.
+    - read_size (int): Bytes per read of the prefetch threads.
+    - io_stats (dict, optional): prefetch_io.new_io_stats() dict that the prefetch statistics are added to.
     
     Output files:
-    For each 45S file, creates three output files:
+    For each 45S file, creates three output files (binary '.dbin' 45S files give '.dbin' outputs):
     - '<sample_id>_18S_depth.txt' for the 18S rRNA region.
     - '<sample_id>_5.8S_depth.txt' for the 5.8S rRNA region.
     - '<sample_id>_28S_depth.txt' for the 28S rRNA region.
@@ -36,74 +73,235 @@ def split_depth_files(Project_ID=None, root_dir=None, input_dir=None, output_dir
     print(f"Saving processed files to: {output_dir}")
 
     # Copy all files from input_dir to output_dir
-    for file_name in os.listdir(input_dir):
-        source_path = os.path.join(input_dir, file_name)
-        dest_path = os.path.join(output_dir, file_name)
+    with run_report.stage("copy depth files"):
+        copies = []
+        for file_name in os.listdir(input_dir):
+            source_path = os.path.join(input_dir, file_name)
+            dest_path = os.path.join(output_dir, file_name)
 
-        # Only process files, ignore subdirectorie
-        if os.path.isfile(source_path):
-            shutil.copy2(source_path, dest_path)
-            #print(f"Moved: {source_path} → {dest_path}")
+            # Only process files, ignore subdirectorie
+            if os.path.isfile(source_path):
+                copies.append((source_path, dest_path))
+                run_report.count(files=1, bytes=os.path.getsize(source_path))
+                #print(f"Moved: {source_path} → {dest_path}")
+        # on a network filesystem the latency of many small copies overlaps in threads
+        with ThreadPoolExecutor(max_workers=max(1, prefetch_depth)) as executor:
+            list(executor.map(shutil.copy2, [source for source, _ in copies], [dest for _, dest in copies]))
 
     print(f"All 45s 5s depth results files have been moved to {output_dir}.")
     
     # Define the ranges for each rRNA region
-    ranges = {
-        '18S': (3657, 5527),
-        '5.8S': (6623, 6779),
-        '28S': (7935, 12969)
-    }
+    ranges = RRNA_RANGES
 
     # Ensure the output directory exists
     #os.makedirs(output_dir, exist_ok=True)
 
     # List all files in the input directory and filter for 45S files
-    for filename in os.listdir(input_dir):
-        if '45S' in filename and filename.endswith('.txt'):  # Only process files with '45S' in the name and .txt extension
-            input_file = os.path.join(input_dir, filename)
-            base_name = filename.split('_')[0]  # Extract sample ID, e.g., 'TCGA-4Z-AA7Y-10A'
+    file_names = os.listdir(input_dir)
+    text_files = [os.path.join(input_dir, filename) for filename in file_names
+                  if '45S' in filename and filename.endswith(DEPTH_TEXT_EXTS)]
+    with run_report.stage("split 45S"), prefetch_files(text_files, prefetch_depth, read_size, io_stats) as open_prefetched:
+        for filename in file_names:
+            if '45S' in filename and filename.endswith(DEPTH_BINARY_EXT):  # Binary depth files are split by slicing
+                input_file = os.path.join(input_dir, filename)
+                base_name = filename.split('_')[0]  # Extract sample ID, e.g., 'TCGA-4Z-AA7Y-10A'
+                output_files = {region: os.path.join(output_dir, f"{base_name}_GL000220v1_{region}_depth{DEPTH_BINARY_EXT}")
+                                for region in ranges}
+                split_depth_file_binary(input_file, output_files, ranges, relabel_positions)
+                run_report.count("45S", files=1, bytes=os.path.getsize(input_file))
+                print(f"Data for {filename} has been split into separate files in {output_dir} for 18S, 5.8S, and 28S regions.")
+
+            elif '45S' in filename and filename.endswith(DEPTH_TEXT_EXTS):  # Only process files with '45S' in the name and .txt(.gz/.bgz) extension
+                input_file = os.path.join(input_dir, filename)
+                base_name = filename.split('_')[0]  # Extract sample ID, e.g., 'TCGA-4Z-AA7Y-10A'
             
-            # Generate output file paths
-            output_files = {
-                '18S': os.path.join(output_dir, f"{base_name}_GL000220v1_18S_depth.txt"),
-                '5.8S': os.path.join(output_dir, f"{base_name}_GL000220v1_5.8S_depth.txt"),
-                '28S': os.path.join(output_dir, f"{base_name}_GL000220v1_28S_depth.txt")
-            }
-
-            # Open output files for writing
-            with open(output_files['18S'], 'w') as file_18S, \
-                 open(output_files['5.8S'], 'w') as file_5_8S, \
-                 open(output_files['28S'], 'w') as file_28S:
+                # Generate output file paths
+                output_files = {
+                    '18S': os.path.join(output_dir, f"{base_name}_GL000220v1_18S_depth.txt"),
+                    '5.8S': os.path.join(output_dir, f"{base_name}_GL000220v1_5.8S_depth.txt"),
+                    '28S': os.path.join(output_dir, f"{base_name}_GL000220v1_28S_depth.txt")
+                }
+
+                # Open output files for writing
+                with open(output_files['18S'], 'w') as file_18S, \
+                     open(output_files['5.8S'], 'w') as file_5_8S, \
+                     open(output_files['28S'], 'w') as file_28S:
                 
-                # Read and process the input file line by line
-                try:
-                    with open(input_file, 'r') as file:
-                        for line in file:
-                            parts = line.strip().split('\t')
-                            try:
-                                position = int(parts[1])
-                                depth = parts[2]  # Assuming depth is in the third column
-                            except (ValueError, IndexError):
-                                print(f"Skipping invalid line: {line.strip()}")
-                                continue
-
-                            # Write to the appropriate file based on the position range
-                            if ranges['18S'][0] <= position <= ranges['18S'][1]:
-                                new_position = position - ranges['18S'][0] + 1 if relabel_positions else position
-                                file_18S.write(f"{parts[0]}\t{new_position}\t{depth}\n")
-                            elif ranges['5.8S'][0] <= position <= ranges['5.8S'][1]:
-                                new_position = position - ranges['5.8S'][0] + 1 if relabel_positions else position
-                                file_5_8S.write(f"{parts[0]}\t{new_position}\t{depth}\n")
-                            elif ranges['28S'][0] <= position <= ranges['28S'][1]:
-                                new_position = position - ranges['28S'][0] + 1 if relabel_positions else position
-                                file_28S.write(f"{parts[0]}\t{new_position}\t{depth}\n")
-
-                except FileNotFoundError:
-                    print(f"File {input_file} not found.")
-                except IOError:
-                    print(f"Error reading file {input_file}.")
-
-            print(f"Data for {filename} has been split into separate files in {output_dir} for 18S, 5.8S, and 28S regions.")
+                    # Read and process the input file line by line
+                    lines = 0
+                    stream = open_prefetched(input_file)
+                    try:
+                        with (open_depth_stream(stream, 'r') if stream is not None else open_depth_text(input_file, 'r')) as file:
+                            for lines, line in enumerate(file, 1):
+                                parts = line.strip().split('\t')
+                                try:
+                                    position = int(parts[1])
+                                    depth = parts[2]  # Assuming depth is in the third column
+                                except (ValueError, IndexError):
+                                    print(f"Skipping invalid line: {line.strip()}")
+                                    continue
+
+                                # Write to the appropriate file based on the position range
+                                if ranges['18S'][0] <= position <= ranges['18S'][1]:
+                                    new_position = position - ranges['18S'][0] + 1 if relabel_positions else position
+                                    file_18S.write(f"{parts[0]}\t{new_position}\t{depth}\n")
+                                elif ranges['5.8S'][0] <= position <= ranges['5.8S'][1]:
+                                    new_position = position - ranges['5.8S'][0] + 1 if relabel_positions else position
+                                    file_5_8S.write(f"{parts[0]}\t{new_position}\t{depth}\n")
+                                elif ranges['28S'][0] <= position <= ranges['28S'][1]:
+                                    new_position = position - ranges['28S'][0] + 1 if relabel_positions else position
+                                    file_28S.write(f"{parts[0]}\t{new_position}\t{depth}\n")
+
+                    except FileNotFoundError:
+                        print(f"File {input_file} not found.")
+                    except IOError:
+                        print(f"Error reading file {input_file}.")
+                    finally:
+                        if stream is not None:
+                            stream.close()
+                    run_report.count("45S", files=1, bytes=os.path.getsize(input_file), lines=lines)
+
+                print(f"Data for {filename} has been split into separate files in {output_dir} for 18S, 5.8S, and 28S regions.")
+
+def load_depth_array(file_path, stream=None):
+    """
+    Loads a depth file into position and depth arrays. Binary depth files are memory-mapped.
+
+    Parameters:
+    - file_path (str): Path to a text (plain, gzip or bgzip) or binary ('.dbin') depth file of a single contig.
+    - stream (optional): The text file already opened as a binary stream (see prefetch_io.prefetch_files);
+      it is read instead of file_path and closed.
+
+    Returns:
+    - contig (str): Contig name of the first line/block ('' for an empty file).
+    - positions (np.ndarray): Positions, sorted as in the file.
+    - depths (np.ndarray): Depth at each position.
+    """
+    if is_depth_binary(file_path):
+        blocks = read_depth_binary(file_path)
+        if not blocks:
+            return "", np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32)
+        positions = np.concatenate([np.arange(b.start, b.start + len(b.depths)) for b in blocks])
+        depths = blocks[0].depths if len(blocks) == 1 else np.concatenate([b.depths for b in blocks])
+        return blocks[0].contig, positions, depths
+
+    contig = ""
+    positions = []
+    depths = []
+    with (stream if stream is not None else contextlib.nullcontext()), \
+         (open_depth_stream(stream, 'r') if stream is not None else open_depth_text(file_path, 'r')) as file:
+        for line in file:
+            parts = line.strip().split('\t')
+            try:
+                position = int(parts[1])
+                depth = int(parts[2])
+            except (ValueError, IndexError):
+                print(f"Skipping invalid line: {line.strip()}")
+                continue
+            if not positions:
+                contig = parts[0]
+            positions.append(position)
+            depths.append(depth)
+    return contig, np.array(positions, dtype=np.int64), np.array(depths, dtype=np.int64)
+
+
+def region_views(positions, depths, ranges=RRNA_RANGES, relabel_positions=True):
+    """
+    Returns each rRNA region as a view over the 45S depth array, without copying depths.
+
+    Parameters:
+    - positions (np.ndarray): Sorted 45S positions.
+    - depths (np.ndarray): 45S depths.
+    - ranges (dict): {region: (start, end)} 1-based inclusive positions.
+    - relabel_positions (bool): If True, re-labels position coordinates from 1 for each rRNA region.
+
+    Returns:
+    - dict: {region: (positions, depths)}
+    """
+    views = {}
+    for region, (start, end) in ranges.items():
+        first = np.searchsorted(positions, start, side='left')
+        last = np.searchsorted(positions, end, side='right')
+        region_positions = positions[first:last]
+        if relabel_positions:
+            region_positions = region_positions - start + 1
+        views[region] = (region_positions, depths[first:last])
+    return views
+
+
+def split_depth_views(Project_ID=None, root_dir=None, input_dir=None, output_dir=None, relabel_positions=True,
+                      write_split_files=False, ranges=RRNA_RANGES, prefetch_depth=0, read_size=PREFETCH_READ_SIZE,
+                      io_stats=None):
+    """
+    Loads the 5S and 45S depth files once and returns the 18S, 5.8S and 28S regions (or any
+    regions of a registry, see rDNA_regions.py) as views over the 45S depth array. Unlike split_depth_files, nothing is copied or re-serialized unless
+    write_split_files is True.
+
+    Parameters:
+    - Project_ID (str, optional): The TCGA project
+    - root_dir (str, optional): The root directory where the project data is stored.
+    - input_dir (str, optional): Path to the directory containing input depth files.
+    - output_dir (str, optional): Where split text files are written if write_split_files is True.
+    If Project_ID and root_dir are provided, input_dir and output_dir are generated automatically.
+    - relabel_positions (bool): If True, re-labels position coordinates from 1 for each rRNA region.
+    - write_split_files (bool): If True, also writes '<sample_id>_GL000220v1_<region>_depth.txt' files.
+    - ranges (dict): {region: (start, end)} regions on the 45S reference, RRNA_RANGES by default.
+    - prefetch_depth (int): Text depth files read ahead in threads while the current one is parsed
+      (see prefetch_io.py); 0 reads them one after another.
+    - read_size (int): Bytes per read of the prefetch threads.
+    - io_stats (dict, optional): prefetch_io.new_io_stats() dict that the prefetch statistics are added to.
+
+    Returns:
+    - dict: {rDNA_type: {sample_id: (positions, depths)}} for 5S, 45S and every region.
+    """
+    if Project_ID and root_dir:
+        input_dir = os.path.join(root_dir, Project_ID, "depth_results_blood")
+        output_dir = output_dir or os.path.join(root_dir, Project_ID, "depth_results_blood_5s_45s_18s_5.8s_28s")
+    elif not input_dir:
+        raise ValueError("Either (Project_ID and root_dir) or input_dir must be provided.")
+    if write_split_files:
+        if not output_dir:
+            raise ValueError("output_dir must be provided to write split files.")
+        os.makedirs(output_dir, exist_ok=True)
+
+    views = {rDNA_type: {} for rDNA_type in ['5S', '45S', *ranges]}
+
+    files = []
+    for filename in sorted(os.listdir(input_dir)):
+        if not filename.endswith(DEPTH_FILE_EXTS) or len(filename.split('_')) < 3:
+            continue
+        if filename.split('_')[2] in ('5S', '45S'):
+            files.append(filename)
+    text_files = [os.path.join(input_dir, filename) for filename in files if filename.endswith(DEPTH_TEXT_EXTS)]
+
+    with prefetch_files(text_files, prefetch_depth, read_size, io_stats) as open_prefetched:
+        for filename in files:
+            _add_sample_views(views, input_dir, filename, ranges, relabel_positions, write_split_files, output_dir,
+                              open_prefetched)
+
+    print(f"Loaded 5S and 45S depth files from {input_dir} as {', '.join(ranges)} views.")
+    return views
+
+
+def _add_sample_views(views, input_dir, filename, ranges, relabel_positions, write_split_files, output_dir, open_prefetched):
+    """Loads one 5S or 45S depth file of split_depth_views into views"""
+    rDNA_type = filename.split('_')[2]
+    base_name = filename.split('_')[0]  # Extract sample ID, e.g., 'TCGA-4Z-AA7Y-10A'
+
+    file_path = os.path.join(input_dir, filename)
+    contig, positions, depths = load_depth_array(file_path, open_prefetched(file_path))
+    run_report.count(rDNA_type, files=1, bytes=os.path.getsize(file_path), lines=len(depths))
+    views[rDNA_type][base_name] = (positions, depths)
+    if rDNA_type != '45S':
+        return
+
+    for region, (region_positions, region_depths) in region_views(positions, depths, ranges, relabel_positions).items():
+        views[region][base_name] = (region_positions, region_depths)
+        if write_split_files:
+            output_file = os.path.join(output_dir, f"{base_name}_GL000220v1_{region}_depth.txt")
+            with open(output_file, 'w') as file:
+                file.writelines(f"{contig}\t{position}\t{depth}\n" for position, depth in zip(region_positions, region_depths))
+
 
 # Example usage
 # split_files("/data/depth_files", "/depth/18s_5.8s_28s", relabel_positions=True)
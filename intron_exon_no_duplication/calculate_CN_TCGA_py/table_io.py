@@ -0,0 +1,242 @@
+import os
+import csv
+
+# Output tables can be written as CSV (default) or as Parquet (needs pyarrow). Parquet files keep
+# typed columns and store the repeated label columns below as categoricals.
+# pandas is only imported when a table is read or written as Parquet, so CSV writers stay light.
+
+OUTPUT_FORMATS = ("csv", "parquet")
+CATEGORICAL_COLUMNS = ["Sample_ID", "Sample", "chr", "Label", "Depth_File", "Project_ID"]
+
+
+def table_path(path, output_format="csv"):
+    """Returns path with the extension of output_format, e.g. 'x_CN_all.csv' -> 'x_CN_all.parquet'."""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    return os.path.splitext(path)[0] + f".{output_format}"
+
+
+def resolve_table(path):
+    """Returns path if it exists, otherwise the same table in the other format if that exists."""
+    if os.path.exists(path):
+        return path
+    for output_format in OUTPUT_FORMATS:
+        other = table_path(path, output_format)
+        if os.path.exists(other):
+            return other
+    return path
+
+
+def write_table(df, path, output_format="csv"):
+    """
+    Writes a table as CSV or Parquet.
+
+    Parameters:
+    - df (pd.DataFrame): The table.
+    - path (str): Output path; its extension is replaced by the one of output_format.
+    - output_format (str): 'csv' or 'parquet'.
+
+    Returns:
+    - str: The path written.
+    """
+    path = table_path(path, output_format)
+    if output_format == "parquet":
+        df = df.astype({column: "category" for column in CATEGORICAL_COLUMNS if column in df.columns})
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def write_rows(rows, columns, path, output_format="csv"):
+    """
+    Writes a table given as a list of dicts. CSV is written without pandas, with the same
+    content as DataFrame.to_csv.
+
+    Parameters:
+    - rows (list of dict): The table rows.
+    - columns (list): Column order.
+    - path (str): Output path; its extension is replaced by the one of output_format.
+    - output_format (str): 'csv' or 'parquet'.
+
+    Returns:
+    - str: The path written.
+    """
+    if output_format != "csv":
+        import pandas as pd
+        return write_table(pd.DataFrame(rows, columns=columns), path, output_format)
+
+    path = table_path(path, output_format)
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def _dictionary_schema(schema):
+    """
+    Schema with int32 dictionary indices for the categorical columns: pandas picks the smallest
+    index type for the categories of one batch (int8 below 128), which later batches may not fit.
+    """
+    import pyarrow as pa
+    fields = [pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type), field.nullable)
+              if pa.types.is_dictionary(field.type) else field for field in schema]
+    return pa.schema(fields, metadata=schema.metadata)
+
+
+class TableWriter:
+    """
+    Appends row batches to one CSV or Parquet table, so a table can be written while it is computed
+    with only the current batch in memory. Batches are lists of dicts or DataFrames with the columns
+    given at open; CSV output is the same as a single write_rows or write_table call.
+
+    with TableWriter(path, columns, output_format) as writer:
+        for rows in batches:
+            writer.write_rows(rows)
+    """
+
+    def __init__(self, path, columns, output_format="csv", lineterminator="\n"):
+        self.path = table_path(path, output_format)
+        self.columns = list(columns)
+        self.output_format = output_format
+        self.rows = 0
+        self._lineterminator = lineterminator
+        self._parquet = None
+        self._schema = None
+        if output_format == "csv":
+            self._file = open(self.path, 'w', newline='')
+            self._csv = csv.DictWriter(self._file, fieldnames=self.columns, lineterminator=lineterminator)
+            self._csv.writeheader()
+
+    def write_rows(self, rows):
+        """Appends a list of dicts."""
+        if not rows:
+            return
+        if self.output_format == "csv":
+            self._csv.writerows(rows)
+            self.rows += len(rows)
+            return
+        import pandas as pd
+        self.write_frame(pd.DataFrame(rows, columns=self.columns))
+
+    def write_frame(self, df):
+        """Appends a DataFrame (its columns are reordered to the columns of the table)."""
+        if df.empty:
+            return
+        df = df[self.columns]
+        if self.output_format == "csv":
+            df.to_csv(self._file, index=False, header=False, lineterminator=self._lineterminator)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            # label columns are dictionary-encoded like write_table; the schema of the first
+            # batch is kept so that every row group of the file has the same types
+            df = df.astype({column: "category" for column in CATEGORICAL_COLUMNS if column in df.columns})
+            if self._parquet is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self._schema = _dictionary_schema(table.schema)
+                table = table.cast(self._schema)
+                self._parquet = pq.ParquetWriter(self.path, self._schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._parquet.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        """Closes the table. A Parquet table without any row is written with string columns."""
+        if self.output_format == "csv":
+            self._file.close()
+            return
+        if self._parquet is None:
+            import pandas as pd
+            pd.DataFrame(columns=self.columns).to_parquet(self.path, index=False)
+        else:
+            self._parquet.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def partition_file(dataset_dir, Project_ID):
+    """
+    Clears the Project_ID partition of a Parquet dataset written by write_partitioned_dataset and
+    returns the path of a new file in it, for a TableWriter without the Project_ID column.
+    """
+    partition_dir = os.path.join(dataset_dir, f"Project_ID={Project_ID}")
+    if os.path.isdir(partition_dir):
+        for file_name in os.listdir(partition_dir):
+            os.remove(os.path.join(partition_dir, file_name))
+    os.makedirs(partition_dir, exist_ok=True)
+    return os.path.join(partition_dir, "part-0.parquet")
+
+
+def write_partitioned_dataset(df, dataset_dir):
+    """
+    Writes a table to a Parquet dataset partitioned by Project_ID (dataset_dir/Project_ID=<id>/...).
+    The partitions of the projects in df are replaced, other projects are kept.
+    """
+    df = df.astype({column: "category" for column in CATEGORICAL_COLUMNS if column in df.columns})
+    df.to_parquet(dataset_dir, index=False, partition_cols=["Project_ID"],
+                  existing_data_behavior="delete_matching")
+    return dataset_dir
+
+
+def list_tables(directory):
+    """
+    Lists the CSV and Parquet tables of a directory, sorted by name. If a table exists in both
+    formats, only the most recently written one is returned.
+    """
+    tables = {}
+    for file_name in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(file_name)
+        if extension[1:] not in OUTPUT_FORMATS:
+            continue
+        path = os.path.join(directory, file_name)
+        if stem not in tables or os.path.getmtime(path) > os.path.getmtime(tables[stem]):
+            tables[stem] = path
+    return [tables[stem] for stem in sorted(tables)]
+
+
+def read_table(path, columns=None, filters=None):
+    """
+    Reads a CSV or Parquet table, or a partitioned Parquet dataset directory.
+
+    Parameters:
+    - path (str): Path to the table. If it does not exist, the other format is tried.
+    - columns (list, optional): Columns to read (Parquet reads only these columns).
+    - filters (list, optional): Parquet filters, e.g. [("Project_ID", "in", ["TCGA-BLCA"])].
+    """
+    import pandas as pd
+
+    path = resolve_table(path)
+    if os.path.isdir(path) or path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns, filters=filters)
+    return pd.read_csv(path, usecols=columns)
+
+
+def iter_table_chunks(path, chunksize=100000, columns=None, filters=None):
+    """
+    Reads a CSV or Parquet table, or a partitioned Parquet dataset directory, as DataFrames of at
+    most chunksize rows, so that a large summary never has to be held in memory at once.
+
+    Parameters: as read_table, plus
+    - chunksize (int): Maximum number of rows per DataFrame.
+    """
+    import pandas as pd
+
+    path = resolve_table(path)
+    if not (os.path.isdir(path) or path.endswith(".parquet")):
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    dataset = ds.dataset(path, format="parquet", partitioning="hive" if os.path.isdir(path) else None)
+    expression = pq.filters_to_expression(filters) if filters else None
+    for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=chunksize):
+        if batch.num_rows:
+            yield batch.to_pandas()
@@ -0,0 +1,251 @@
+import os
+import sys
+import csv
+import time
+import queue
+import shlex
+import argparse
+import threading
+import subprocess
+from collections import namedtuple
+
+import cn_path  # noqa: F401 - the shared depth readers live next to the copy number scripts
+
+from table_io import write_rows
+
+# Runs steps 1.1 to 2.2 of one project as a single pool of tasks, instead of the shell scripts'
+# batches of background jobs followed by `wait`. A task starts as soon as its dependencies are done
+# and enough cores are free for its thread budget, so a slow BAM only holds its own cores.
+# Failed tasks are retried; the status of every task is kept in a CSV and its output in its own log.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("1.1", "1.2", "2.1", "2.2")
+STATUS_COLUMNS = ["Task", "Stage", "Threads", "Status", "Attempts", "Returncode", "Seconds", "Log"]
+
+# GL000220v1 holds the 45S copies, chr1q42 the 5S cluster (see 1.1extract_merge_reads_test_data_paralle.sh)
+REGION_45S = "chrUn_GL000220v1"
+REGION_5S = "chr1:226743523-231781906"
+
+# name: unique task name, also the log name; command: bash command; threads: cores reserved while it runs;
+# depends_on: names of the tasks that must be done first
+Task = namedtuple("Task", ["name", "stage", "command", "threads", "depends_on"])
+
+
+def _python_command(code):
+    # Paths stay relative to the working directory, like in the shell scripts; modules come from the repo
+    return f"PYTHONPATH={shlex.quote(REPO_DIR)}${{PYTHONPATH:+:$PYTHONPATH}} {shlex.quote(sys.executable)} -c {shlex.quote(code)}"
+
+
+def project_tasks(Project_ID, bam_dir, bed_dir="intron_exon_no_duplication", stages=STAGES, threads_per_task=2,
+                  align_threads=8, brd_workers=4, reference_5S="rDNA_paper/5S_X12811.1.fasta",
+                  reference_45S="rDNA_paper/45S_U13369.1_Modified_forward_16kb.fasta", extractor="samtools"):
+    """
+    Builds the tasks of steps 1.1 to 2.2 for one project, with the directories of the shell scripts.
+
+    Parameters:
+    - Project_ID (str): The TCGA project, e.g. 'TCGA-BLCA'.
+    - bam_dir (str): Directory containing the indexed BAM files.
+    - bed_dir (str): Directory containing the BED files.
+    - stages (tuple): Stages to run:
+      '1.1' extract GL000220v1 and 1q42 reads to FASTQ, per BAM;
+      '1.2' align to 45S/5S and compute the FLAG 0/16 depth (1.2 to 1.4, see depth_from_alignments.py), per FASTQ;
+      '2.1' samtools depth -a -b, per BAM and BED file;
+      '2.2' BRD tables of the project.
+    - threads_per_task (int): samtools threads of every 2.1 task (THREADS_PER_TASK of 2.1).
+    - align_threads (int): bwa mem threads of every 1.2 task.
+    - brd_workers (int): Processes of the 2.2 task.
+    - reference_5S (str), reference_45S (str): bwa-indexed reference FASTA files.
+    - extractor (str): '1.1' with 'samtools' (view to SAM, then fastq, as in the shell script) or 'pysam'
+      (both regions read in one pass per BAM, no SAM files; see extract_rDNA_reads.py).
+
+    Returns:
+    - list: Task tuples.
+    """
+    sam_dir = f"{Project_ID}/wgs_sam_GL000220v1_1q42_10_v1"
+    fastq_dir = f"{Project_ID}/wgs_fastq_GL000220v1_1q42_10_v1"
+    depth_dir = f"{Project_ID}/depth_results_blood"
+    brd_depth_dir = f"{Project_ID}/depth_results_exon_intron_blood_no_duplication"
+    brd_dir = f"BRD_Results/{Project_ID}"
+
+    bam_files = sorted(os.path.join(bam_dir, f) for f in os.listdir(bam_dir) if f.endswith(".bam"))
+    bed_files = sorted(os.path.join(bed_dir, f) for f in os.listdir(bed_dir) if f.endswith(".bed"))
+    q = shlex.quote
+    tasks = []
+
+    for bam_file in bam_files:
+        base_name = os.path.basename(bam_file)[:-len(".bam")]
+        extract_task = f"1.1_{base_name}"
+
+        if "1.1" in stages and extractor == "pysam":
+            code = (f"import os; os.makedirs({fastq_dir!r}, exist_ok=True); "
+                    f"from extract_rDNA_reads import extract_bam_fastq; "
+                    f"extract_bam_fastq({bam_file!r}, {fastq_dir!r})")
+            tasks.append(Task(extract_task, "1.1", _python_command(code), 1, ()))
+        elif "1.1" in stages:
+            steps = [f"mkdir -p {q(sam_dir)} {q(fastq_dir)}"]
+            for region, suffix in ((REGION_45S, "GL000220v1"), (REGION_5S, "1q42")):
+                sam_file = q(f"{sam_dir}/{base_name}_{suffix}.sam")
+                steps.append(f"samtools view -h {q(bam_file)} {region} > {sam_file}")
+                steps.append(f"samtools fastq {sam_file} > {q(f'{fastq_dir}/{base_name}_{suffix}.fastq')}")
+            tasks.append(Task(extract_task, "1.1", " && ".join(steps), 1, ()))
+
+        if "1.2" in stages:
+            for suffix, rDNA_type, reference in (("GL000220v1", "45S", reference_45S), ("1q42", "5S", reference_5S)):
+                fastq_file = f"{fastq_dir}/{base_name}_{suffix}.fastq"
+                depth_file = f"{depth_dir}/{base_name}_{suffix}_{rDNA_type}_f0_16_depth.txt"
+                code = (f"import os; os.makedirs({depth_dir!r}, exist_ok=True); "
+                        f"from depth_from_alignments import align_and_depth; "
+                        f"align_and_depth({fastq_file!r}, {reference!r}, {depth_file!r}, threads={align_threads})")
+                depends_on = (extract_task,) if "1.1" in stages else ()
+                tasks.append(Task(f"1.2_{base_name}_{rDNA_type}", "1.2", _python_command(code), align_threads, depends_on))
+
+        if "2.1" in stages:
+            output_dir = f"{brd_depth_dir}/{base_name}"
+            for bed_file in bed_files:
+                bed_name = os.path.basename(bed_file)[:-len(".bed")]
+                output_file = q(f"{output_dir}/{base_name}_{bed_name}_depth.txt")
+                command = (f"mkdir -p {q(output_dir)} && "
+                           f"samtools depth -@ {threads_per_task} -a -b {q(bed_file)} {q(bam_file)} > {output_file}")
+                tasks.append(Task(f"2.1_{base_name}_{bed_name}", "2.1", command, threads_per_task, ()))
+
+    if "2.2" in stages:
+        code = (f"import os; os.makedirs({brd_dir!r}, exist_ok=True); "
+                f"from batch_BRD_average_results import process_BRD_outputs, standard_BRD_groups; "
+                f"process_BRD_outputs(root_dir={brd_depth_dir!r}, label='blood', "
+                f"output_file_all={brd_dir + '/blood_all_BRD.csv'!r}, workers={brd_workers}, "
+                f"cache_file={brd_dir + '/aggregate_cache.sqlite'!r}, exact=True, stream=True, "
+                f"groups=standard_BRD_groups({brd_dir!r}, 'blood'))")
+        depends_on = tuple(task.name for task in tasks if task.stage == "2.1")
+        tasks.append(Task(f"2.2_{Project_ID}", "2.2", _python_command(code), brd_workers, depends_on))
+
+    return tasks
+
+
+def read_status(status_file):
+    """Reads a status CSV written by run_tasks into {task name: row}; empty if it does not exist."""
+    if not os.path.exists(status_file):
+        return {}
+    with open(status_file, newline='') as file:
+        return {row["Task"]: row for row in csv.DictReader(file)}
+
+
+def _run_task(process, log, name, finished):
+    returncode = process.wait()
+    log.close()
+    finished.put((name, returncode))
+
+
+def run_tasks(tasks, cores, status_file, log_dir, retries=1, resume=False):
+    """
+    Runs tasks with at most `cores` threads in use. Whenever a task ends, the freed cores go to the
+    next ready tasks in order; a task that does not fit is passed over by smaller ones that do.
+
+    Parameters:
+    - tasks (list): Task tuples; a task's thread budget is capped at cores.
+    - cores (int): Cores available, e.g. $SLURM_CPUS_PER_TASK.
+    - status_file (str): CSV with one row per task, rewritten whenever a task ends.
+    - log_dir (str): Directory of the task logs ('<task name>.log', stdout and stderr).
+    - retries (int): Times a failed task is run again before it is marked failed.
+    - resume (bool): If True, tasks marked done in an existing status_file are not run again.
+
+    Returns:
+    - list: The status rows (dicts with STATUS_COLUMNS). Tasks whose dependencies failed are 'skipped'.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    previous = read_status(status_file) if resume else {}
+    statuses = {}
+    for task in tasks:
+        done_before = previous.get(task.name, {}).get("Status") == "done"
+        statuses[task.name] = dict(previous[task.name]) if done_before else {
+            "Task": task.name, "Stage": task.stage, "Threads": min(task.threads, cores), "Status": "pending",
+            "Attempts": 0, "Returncode": "", "Seconds": 0.0, "Log": os.path.join(log_dir, f"{task.name}.log")}
+
+    def save():
+        write_rows(list(statuses.values()), STATUS_COLUMNS, status_file)
+
+    pending = [task for task in tasks if statuses[task.name]["Status"] == "pending"]
+    running = {}  # name: (task, start time)
+    free_cores = cores
+    finished = queue.Queue()
+
+    while pending or running:
+        # Start every ready task that fits, in order
+        for task in list(pending):
+            states = [statuses[name]["Status"] if name in statuses else "done" for name in task.depends_on]
+            if any(state in ("failed", "skipped") for state in states):
+                statuses[task.name]["Status"] = "skipped"
+                pending.remove(task)
+                continue
+            threads = statuses[task.name]["Threads"]
+            if any(state != "done" for state in states) or threads > free_cores:
+                continue
+
+            pending.remove(task)
+            free_cores -= threads
+            status = statuses[task.name]
+            status["Status"] = "running"
+            status["Attempts"] += 1
+            log = open(status["Log"], 'a')
+            log.write(f"=== attempt {status['Attempts']}: {task.command}\n")
+            log.flush()
+            process = subprocess.Popen(task.command, shell=True, executable="/bin/bash", stdout=log, stderr=log)
+            threading.Thread(target=_run_task, args=(process, log, task.name, finished), daemon=True).start()
+            running[task.name] = (task, time.time())
+
+        if not running:
+            break  # the remaining tasks depend on failed ones
+        name, returncode = finished.get()
+        task, start = running.pop(name)
+        status = statuses[name]
+        free_cores += status["Threads"]
+        status["Returncode"] = returncode
+        status["Seconds"] = round(status["Seconds"] + time.time() - start, 1)
+
+        if returncode == 0:
+            status["Status"] = "done"
+        elif status["Attempts"] <= retries:
+            status["Status"] = "pending"
+            pending.append(task)  # retried after the tasks already waiting
+        else:
+            status["Status"] = "failed"
+        print(f"{name}: {status['Status']} (attempt {status['Attempts']}, returncode {returncode}, "
+              f"{free_cores}/{cores} cores free, {len(pending)} pending)")
+        save()
+
+    save()
+    failed = [name for name, status in statuses.items() if status["Status"] in ("failed", "skipped")]
+    print(f"{len(statuses) - len(failed)} of {len(statuses)} tasks done. Status saved to {status_file}")
+    if failed:
+        print(f"Failed or skipped tasks: {' '.join(failed)}")
+    return list(statuses.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run steps 1.1 to 2.2 of a project as one pool of tasks.")
+    parser.add_argument("Project_ID", help="the TCGA project, e.g. TCGA-BLCA")
+    parser.add_argument("bam_dir", help="directory containing the indexed BAM files")
+    parser.add_argument("--bed_dir", default="intron_exon_no_duplication", help="directory containing the BED files")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="stages to run")
+    parser.add_argument("--cores", type=int, default=int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count())),
+                        help="cores to keep busy (default: $SLURM_CPUS_PER_TASK)")
+    parser.add_argument("--threads_per_task", type=int, default=2, help="samtools depth threads per 2.1 task")
+    parser.add_argument("--align_threads", type=int, default=8, help="bwa mem threads per 1.2 task")
+    parser.add_argument("--brd_workers", type=int, default=4, help="processes of the 2.2 task")
+    parser.add_argument("--extractor", choices=["samtools", "pysam"], default="samtools",
+                        help="1.1 with samtools view/fastq, or in one pass per BAM with pysam (no SAM files)")
+    parser.add_argument("--retries", type=int, default=1, help="times a failed task is run again")
+    parser.add_argument("--resume", action="store_true", help="skip the tasks marked done in the status file")
+    args = parser.parse_args()
+
+    tasks = project_tasks(args.Project_ID, args.bam_dir, args.bed_dir, tuple(args.stages), args.threads_per_task,
+                          args.align_threads, args.brd_workers, extractor=args.extractor)
+    print(f"Running {len(tasks)} tasks on {args.cores} cores")
+    run_tasks(tasks, args.cores, os.path.join(args.Project_ID, "scheduler_status.csv"),
+              os.path.join(args.Project_ID, "scheduler_logs"), retries=args.retries, resume=args.resume)
+
+# Example usage (replaces 1.1, 1.2, 1.3, 1.4, 2.1 and 2.2):
+#python pipeline_scheduler.py TCGA-BLCA /home/user/CancerEvolution/Datasets/TCGA_WGS/data/TCGA-BLCA --cores 128
+# Same, with 1.1 reading each BAM once in pysam instead of writing SAM files:
+#python pipeline_scheduler.py TCGA-BLCA /home/user/CancerEvolution/Datasets/TCGA_WGS/data/TCGA-BLCA --cores 128 --extractor pysam
+# Only the BRD stages, rerunning what failed before:
+#python pipeline_scheduler.py TCGA-BLCA /home/user/CancerEvolution/Datasets/TCGA_WGS/data/TCGA-BLCA --stages 2.1 2.2 --resume
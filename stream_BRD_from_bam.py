@@ -0,0 +1,149 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pysam
+
+from batch_BRD_average_results import write_BRD_outputs, standard_BRD_groups
+
+# samtools depth default --excl-flags: UNMAP, SECONDARY, QCFAIL, DUP
+EXCLUDE_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+
+def read_bed_regions(bed_file):
+    """
+    Reads a BED file and merges overlapping intervals, so that every position is counted
+    once, like samtools depth -b.
+
+    Parameters:
+    - bed_file (str): Path to the BED file (0-based, half-open).
+
+    Returns:
+    - dict: {contig: [(start, end), ...]} sorted and merged intervals.
+    """
+    intervals = {}
+    with open(bed_file, 'r') as file:
+        for line in file:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            parts = line.strip().split('\t')
+            intervals.setdefault(parts[0], []).append((int(parts[1]), int(parts[2])))
+
+    regions = {}
+    for contig, contig_intervals in intervals.items():
+        merged = []
+        for start, end in sorted(contig_intervals):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        regions[contig] = merged
+    return regions
+
+
+def sum_region_depth(bam, contig, start, end, exclude_flags=EXCLUDE_FLAGS):
+    """
+    Sum of per-position depth over [start, end) without materializing the positions.
+
+    Each read contributes the overlap of its aligned blocks with the region, which equals
+    the samtools depth default (deletions and reference skips are not counted).
+    """
+    total_depth = 0
+    for read in bam.fetch(contig, start, end):
+        if read.flag & exclude_flags:
+            continue
+        for block_start, block_end in read.get_blocks():
+            overlap = min(block_end, end) - max(block_start, start)
+            if overlap > 0:
+                total_depth += overlap
+    return total_depth
+
+
+def stream_bam_partials(bam_file, bed_files):
+    """
+    Computes the (sum, count) of samtools depth -a -b for every BED file of one BAM.
+
+    Parameters:
+    - bam_file (str): Path to an indexed BAM file.
+    - bed_files (list): Paths to the BED files.
+
+    Returns:
+    - tuple: (sample_id, [(core_name, total_depth, total_length), ...]), with core_name
+      matching the depth files of 2.1, e.g. 'chr1_exon_depth'.
+    """
+    sample_id = os.path.basename(bam_file)[:-len(".bam")]
+    sample_partials = []
+
+    with pysam.AlignmentFile(bam_file, "rb") as bam:
+        contig_lengths = dict(zip(bam.references, bam.lengths))
+
+        for bed_file in bed_files:
+            bed_name = os.path.basename(bed_file)[:-len(".bed")]
+            total_depth = 0
+            total_length = 0
+
+            for contig, intervals in read_bed_regions(bed_file).items():
+                if contig not in contig_lengths:
+                    continue
+                for start, end in intervals:
+                    # samtools depth stops at the end of the contig
+                    end = min(end, contig_lengths[contig])
+                    if end <= start:
+                        continue
+                    total_depth += sum_region_depth(bam, contig, start, end)
+                    total_length += end - start
+
+            sample_partials.append((f"{bed_name}_depth", total_depth, total_length))
+
+    print(f"Streamed depth for {sample_id}")
+    return sample_id, sample_partials
+
+
+def stream_BRD_from_bam(bam_dir, bed_dir, output_dir, label="blood", workers=1, output_format="csv"):
+    """
+    Writes {label}_all_BRD.csv, {label}_chr13_14_15_21_22_exon_BRD.csv and {label}_chr1_exon_intron.csv
+    directly from BAM files, without writing the depth files of step 2.1.
+
+    Parameters:
+    - bam_dir (str): Directory containing the indexed BAM files.
+    - bed_dir (str): Directory containing the BED files, e.g. 'intron_exon_no_duplication'.
+    - output_dir (str): Directory where the BRD CSV files are saved.
+    - label (str): Label written to every row, e.g. 'blood'.
+    - workers (int): Number of BAM files processed in parallel.
+    - output_format (str): 'csv' or 'parquet'.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    bam_files = sorted(os.path.join(bam_dir, f) for f in os.listdir(bam_dir) if f.endswith(".bam"))
+    bed_files = sorted(os.path.join(bed_dir, f) for f in os.listdir(bed_dir) if f.endswith(".bed"))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(stream_bam_partials, bam_files, [bed_files] * len(bam_files)))
+    else:
+        results = [stream_bam_partials(bam_file, bed_files) for bam_file in bam_files]
+
+    partials = dict(sorted(results))
+    write_BRD_outputs(partials, label,
+                      output_file_all=os.path.join(output_dir, f"{label}_all_BRD.csv"),
+                      groups=standard_BRD_groups(output_dir, label),
+                      output_format=output_format)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute BRD CSVs directly from BAM + BED files.")
+    parser.add_argument("bam_dir", help="directory containing the indexed BAM files")
+    parser.add_argument("output_dir", help="directory for the BRD CSV files, e.g. BRD_Results/TCGA-BLCA")
+    parser.add_argument("--bed_dir", default="intron_exon_no_duplication", help="directory containing the BED files")
+    parser.add_argument("--label", default="blood", help="label written to every row")
+    parser.add_argument("--workers", type=int, default=1, help="number of BAM files processed in parallel")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="format of the BRD tables")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.bam_dir):
+        print(f"BAM directory not found: {args.bam_dir}")
+        sys.exit(1)
+    stream_BRD_from_bam(args.bam_dir, args.bed_dir, args.output_dir, label=args.label, workers=args.workers,
+                        output_format=args.format)
+
+# Example usage (replaces 2.1 + 2.2, no depth files are written):
+#python stream_BRD_from_bam.py /home/user/CancerEvolution/Datasets/TCGA_WGS/data/TCGA-BLCA BRD_Results/TCGA-BLCA --workers 32